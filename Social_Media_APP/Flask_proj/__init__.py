@@ -1,18 +1,124 @@
+"""Application factory.
 
-from flask import Flask
+    app = create_app()                                  # settings from config.Config and the environment
+    app = create_app({'SQLALCHEMY_DATABASE_URI': ...})  # overrides, e.g. for a script or a benchmark
+
+Importing the package only defines the extensions; routes, the API and
+their dependencies load when an app is created. Caches, indexes and worker
+pools are kept per app (see app_state), each configured from its own app's
+config. An app created before a fork (gunicorn --preload, see
+gunicorn.conf.py) is safe to share: each child drops the database
+connections and per-app state it inherited and rebuilds them on first use.
+"""
+import os
+import secrets
+import tempfile
+import threading
+import weakref
+
+from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from Flask_proj.config import Config, engine_options, install_sqlite_pragmas
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'T2xKNZBXZQEmwSpqJ5yv1SWrIwjXgeNQ'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+db = SQLAlchemy()
+bcrypt = Bcrypt()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 login_manager.login_message_category = 'info'
 
-from Flask_proj import routes
-from Flask_proj.routes import users
-app.register_blueprint(users)
\ No newline at end of file
+STATE_KEY = 'flask_proj'
+_engines = weakref.WeakKeyDictionary()  # app -> its engines, disposed after a fork
+_state_lock = threading.RLock()
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if config:
+        app.config.from_mapping(config)
+        if 'SQLALCHEMY_ENGINE_OPTIONS' not in config:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    if not app.config.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = instance_secret_key(app)
+
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    app.extensions[STATE_KEY] = {}
+    with app.app_context():
+        install_sqlite_pragmas(app, db.engine)
+        _engines[app] = list(db.engines.values())
+
+    from Flask_proj import sessions
+    sessions.init_app(app)
+
+    from Flask_proj.routes import main
+    from Flask_proj.api import api
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+
+    if app.config['METRICS']:
+        from Flask_proj import fragments, metrics, user_cache
+        with app.app_context():
+            metrics.install_metrics(app, db.engine)
+        metrics.registry.register_cache('user', user_cache.stats)
+        metrics.registry.register_cache('fragment', fragments.stats)
+
+    if app.config['PROXY_FIX_HOPS']:
+        # request.remote_addr is the client, not the proxy, for the rate limits and /_metrics
+        hops = app.config['PROXY_FIX_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+    return app
+
+
+def app_state(name, factory=None):
+    """current_app's object called `name`, made by factory() on first use.
+
+    Without a factory, returns None when it has not been made yet."""
+    state = current_app.extensions[STATE_KEY]
+    value = state.get(name)
+    if value is None and factory is not None:
+        with _state_lock:
+            value = state.get(name)
+            if value is None:
+                value = state[name] = factory()
+    return value
+
+
+def _after_fork_in_child():
+    # Pooled connections, worker threads and process pools cannot be shared with the parent:
+    # drop them and let the child build its own. close=False leaves the parent's sockets alone.
+    global _state_lock
+    _state_lock = threading.RLock()
+    for app, engines in list(_engines.items()):
+        app.extensions[STATE_KEY] = {}
+        for engine in engines:
+            engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def instance_secret_key(app):
+    """A random key kept in the instance folder, shared by every worker on this host.
+
+    Set SECRET_KEY in the environment when several hosts serve the site."""
+    path = os.path.join(app.instance_path, 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(app.instance_path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=app.instance_path)
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(secrets.token_hex(32))
+        try:
+            # link() never replaces: when workers race, the first key wins and the rest read it
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path) as file:
+        return file.read().strip()
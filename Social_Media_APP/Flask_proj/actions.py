@@ -0,0 +1,146 @@
+"""Writes shared by the page routes and the JSON API.
+
+Each function commits the change once, together with its version stamp
+bumps and the jobs for its durable side effects (counters, notifications,
+SQL feed inboxes, avatar cleanup, see jobs.py), so its latency does not grow
+with the number of side effects. After the commit it updates what lives in
+this process (the memory feed inbox, the friend graph, the user cache)
+and kicks the job workers.
+"""
+from flask import current_app
+from sqlalchemy import select
+
+from Flask_proj import db, avatars, counters, feed, fragments, graph, jobs, notifications, search, stamps, \
+    user_cache
+from Flask_proj.models import Friendship, FriendRequest, Post, User
+
+
+# Posts
+# --------------------------------------------------------------------------
+
+def create_post(user_id, content, privacy):
+    post = Post(user_id=user_id, content=content, privacy=privacy)
+    db.session.add(post)
+    db.session.flush()
+    version = stamps.post_changed(post)
+    feed.post_saved(post)
+    counters.refresh_later(user_id)
+    db.session.commit()
+    feed.fan_out(post, version)
+    jobs.kick()
+    return post
+
+
+def update_post(post, content, privacy):
+    fragments.forget_post(post)
+    old_privacy = post.privacy
+    post.content = content
+    post.privacy = privacy
+    version = stamps.post_changed(post, old_privacy)
+    feed.post_saved(post)
+    db.session.commit()
+    feed.update_post(post, version)
+    jobs.kick()
+
+
+def delete_post(post):
+    feed.remove_post(post)
+    fragments.forget_post(post)
+    version = stamps.post_changed(post)
+    counters.refresh_later(post.user_id)
+    db.session.delete(post)
+    db.session.commit()
+    feed.post_deleted(post, version)
+    search.post_deleted(post)
+    jobs.kick()
+
+
+# Friends & Friend Requests
+# --------------------------------------------------------------------------
+
+def send_friend_request(sender_id, receiver_id):
+    """The pending request from sender to receiver, created unless one exists."""
+    friend_request = FriendRequest.query.filter_by(user_id=sender_id, friend_id=receiver_id, status='pending').first()
+    if not friend_request:
+        friend_request = FriendRequest(user_id=sender_id, friend_id=receiver_id, status='pending')
+        db.session.add(friend_request)
+        stamps.request_changed(sender_id, receiver_id)
+        counters.refresh_later(receiver_id)
+        notifications.notify_later(receiver_id, sender_id, 'friend_request')
+        db.session.commit()
+        jobs.kick()
+    return friend_request
+
+
+def drop_friend_requests(friend_requests):
+    """Cancel or decline the requests in one transaction."""
+    for friend_request in friend_requests:
+        db.session.delete(friend_request)
+        stamps.request_changed(friend_request.user_id, friend_request.friend_id)
+        counters.refresh_later(friend_request.friend_id)
+    db.session.commit()
+    jobs.kick()
+
+
+def accept_friend_requests(friend_requests):
+    """Turn the requests into friendships in one transaction."""
+    pairs = [(friend_request.user_id, friend_request.friend_id) for friend_request in friend_requests]
+    for friend_request in friend_requests:
+        # (user_id, friend_id) is unique, so skip rows left over from an earlier friendship
+        for user_id, friend_id in ((friend_request.user_id, friend_request.friend_id),
+                                   (friend_request.friend_id, friend_request.user_id)):
+            if not Friendship.query.filter_by(user_id=user_id, friend_id=friend_id).first():
+                db.session.add(Friendship(user_id=user_id, friend_id=friend_id, status='friends'))
+            feed.friends_changed(user_id, friend_id)
+        db.session.delete(friend_request)
+        stamps.friendship_changed(friend_request.user_id, friend_request.friend_id)
+        counters.refresh_later(friend_request.user_id, friend_request.friend_id)
+        notifications.notify_later(friend_request.user_id, friend_request.friend_id, 'friend_accepted')
+    db.session.commit()
+    for user_id, friend_id in pairs:
+        graph.add_friendship(user_id, friend_id)
+        feed.backfill(user_id, friend_id)
+        feed.backfill(friend_id, user_id)
+    jobs.kick()
+
+
+def remove_friend(user_id, friend_id):
+    for owner_id, other_id in ((user_id, friend_id), (friend_id, user_id)):
+        Friendship.query.filter_by(user_id=owner_id, friend_id=other_id).delete(synchronize_session=False)
+        feed.friends_changed(owner_id, other_id)
+    stamps.friendship_changed(user_id, friend_id)
+    counters.refresh_later(user_id, friend_id)
+    db.session.commit()
+    graph.remove_friendship(user_id, friend_id)
+    feed.purge(user_id, friend_id)
+    feed.purge(friend_id, user_id)
+    jobs.kick()
+
+
+# Profile
+# --------------------------------------------------------------------------
+
+def profile_updated(user, old_avatar_hash=None):
+    """Commit edits already applied to `user` (names, email, avatar_hash)."""
+    stamps.profile_changed(user.id)
+    if old_avatar_hash and old_avatar_hash != user.avatar_hash:
+        # Delayed, so pages and browsers still holding the old URL can finish loading it
+        jobs.enqueue('avatars.cleanup', {'digest': old_avatar_hash}, key=old_avatar_hash,
+                     delay=current_app.config['AVATAR_CLEANUP_DELAY'])
+    db.session.commit()
+    user_cache.invalidate(user.id)
+    jobs.kick()
+
+
+@jobs.handler('avatars.cleanup')
+def remove_unused_avatars(payloads):
+    """Delete replaced avatar files that no user points at any more."""
+    store = avatars.get_store()
+    grace = current_app.config['AVATAR_CLEANUP_DELAY']
+    for digest in {payload['digest'] for payload in payloads}:
+        if not store.exists(digest):
+            continue
+        in_use = db.session.scalar(select(User.id).where(User.avatar_hash == digest).limit(1))
+        # Someone may have uploaded the same image and not saved their profile yet
+        if not in_use and store.age(digest) >= grace:
+            store.remove(digest)
@@ -0,0 +1,324 @@
+"""Versioned JSON API under /api/v1 for mobile and JS clients.
+
+Covers what the pages do, without the redirect and re-render: timeline
+pages, profiles, posts and friend actions, plus batch endpoints so a client
+can fetch several users or answer several friend requests in one round trip.
+Authentication is the same session cookie as the site. Writes only accept
+`application/json` bodies; browsers cannot send those cross-site without a
+CORS preflight, which stands in for the CSRF token of the HTML forms.
+
+Responses are compact JSON (orjson when installed), compressed with brotli
+or gzip when the client accepts it and the body is over API_COMPRESS_MIN_SIZE.
+"""
+import gzip
+import json
+
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user
+from sqlalchemy.orm import load_only, undefer_group
+from werkzeug.exceptions import HTTPException
+
+from Flask_proj import actions, avatars, db, feed, graph, search, stamps, timeline
+from Flask_proj.models import FriendRequest, Post, User
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder gives the same output a bit slower
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+PRIVACY_CHOICES = ('Public', 'Friends', 'Only Me')
+PRIVACY_MODES = ('all', 'friends', 'public')
+MAX_BATCH = 100
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+users = Blueprint('users', __name__, url_prefix='/users')
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def json_response(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def json_body():
+    if not request.is_json:
+        abort(415, 'Send an application/json body.')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, 'Expected a JSON object.')
+    return data
+
+
+def id_list(values):
+    """Unique ids from a JSON list or a comma-separated query string, at most MAX_BATCH of them."""
+    if isinstance(values, str):
+        values = values.split(',') if values else []
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        abort(400, 'ids must be integers.')
+    if len(ids) > MAX_BATCH:
+        abort(400, f'At most {MAX_BATCH} ids per request.')
+    return ids
+
+
+@api.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        abort(401, 'Log in first.')
+
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+    response = json_response({'error': error.description}, error.code)
+    if error.code == 405:
+        response.headers['Allow'] = ', '.join(error.valid_methods or ())
+    return response
+
+
+@api.after_request
+def compress(response):
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.content_length is None
+            or response.content_length < current_app.config.get('API_COMPRESS_MIN_SIZE', 1024)):
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(response.get_data(), quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# Serialization
+# --------------------------------------------------------------------------
+
+def user_json(user):
+    return {
+        'id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'avatar_url': avatars.avatar_url(user),
+    }
+
+
+def post_json(post):
+    return {
+        'id': post.post_id,
+        'author': user_json(post.user),
+        'content': post.content,
+        'privacy': post.privacy,
+        'created_at': post.created_at.isoformat(),
+        'updated_at': (post.updated_at or post.created_at).isoformat(),
+    }
+
+
+def request_json(friend_request, sender):
+    return {
+        'id': friend_request.id,
+        'from': user_json(sender),
+        'to_user_id': friend_request.friend_id,
+        'created_at': friend_request.created_at.isoformat(),
+    }
+
+
+def page_json(posts, next_cursor):
+    return {'posts': [post_json(post) for post in posts], 'next_cursor': next_cursor}
+
+
+def conditional(etag, build):
+    """Answer If-None-Match with 304, otherwise build() the JSON body and tag it."""
+    if stamps.not_modified(etag):
+        return stamps.tag_response(Response(status=304), etag)
+    return stamps.tag_response(json_response(build()), etag)
+
+
+def page_args():
+    return timeline.parse_cursor(request.args.get('before')), timeline.parse_limit(request.args.get('limit'))
+
+
+# Timeline & Users
+# --------------------------------------------------------------------------
+
+@api.route('/timeline')
+def home_timeline():
+    privacy_mode = request.args.get('privacy_mode', 'all')
+    if privacy_mode not in PRIVACY_MODES:
+        abort(400, f'privacy_mode must be one of {", ".join(PRIVACY_MODES)}.')
+    before, limit = page_args()
+
+    def build():
+        if privacy_mode == 'friends':
+            return page_json(*feed.friends_timeline(current_user.id, before, limit))
+        return page_json(*timeline.timeline(current_user.id, privacy_mode, before, limit))
+    return conditional(stamps.home_etag(current_user.id, privacy_mode, before, limit), build)
+
+
+@users.route('')
+def batch_users():
+    """GET /users?ids=1,2,3 -> the users that exist, in the order asked for."""
+    ids = id_list(request.args.get('ids', ''))
+    found = {user.id: user for user in User.query.options(
+        load_only(User.id, User.first_name, User.last_name, User.avatar_hash)
+    ).filter(User.id.in_(ids))} if ids else {}
+    return json_response({'users': [user_json(found[user_id]) for user_id in ids if user_id in found]})
+
+
+def visible_posts(user):
+    return timeline.with_authors(timeline.profile_posts(current_user, user))
+
+
+@users.route('/<int:user_id>')
+def user_profile(user_id):
+    def build():
+        user = db.session.get(User, user_id, options=[undefer_group('counters')]) or abort(404)
+        relationship = current_user.relationship_with(user) if user_id != current_user.id else None
+        before, limit = page_args()
+        return dict(
+            user_json(user),
+            email=user.email,
+            friend_count=user.friend_count,
+            post_count=user.post_count,
+            pending_request_count=user.pending_request_count if relationship is None else None,
+            friends=[user_json(friend) for friend in user.friend_list()],
+            mutual_friends=graph.get_graph().mutual_count(current_user.id, user_id) if relationship else None,
+            relationship=relationship._asdict() if relationship else None,
+            **page_json(*timeline.page_of(visible_posts(user), before, limit)),
+        )
+    paging = request.args.get('before'), request.args.get('limit')
+    return conditional(stamps.etag('api', stamps.profile_etag(current_user.id, user_id), *paging), build)
+
+
+@users.route('/<int:user_id>/posts')
+def user_posts(user_id):
+    user = db.get_or_404(User, user_id)
+    before, limit = page_args()
+    return json_response(page_json(*timeline.page_of(visible_posts(user), before, limit)))
+
+
+api.register_blueprint(users)
+
+
+@api.route('/search')
+def search_posts():
+    after = search.decode_cursor(request.args.get('after'))
+    limit = timeline.parse_limit(request.args.get('limit'))
+    return json_response(page_json(*search.search_posts(current_user.id, request.args.get('q', ''), after, limit)))
+
+
+# Posts
+# --------------------------------------------------------------------------
+
+def post_fields(data, partial=False):
+    content, privacy = data.get('content'), data.get('privacy')
+    if content is not None and (not isinstance(content, str) or not content.strip()):
+        abort(400, 'content must be a non-empty string.')
+    if privacy is not None and privacy not in PRIVACY_CHOICES:
+        abort(400, f'privacy must be one of {", ".join(PRIVACY_CHOICES)}.')
+    if not partial and (content is None or privacy is None):
+        abort(400, 'content and privacy are required.')
+    return content, privacy
+
+
+def own_post_or_404(post_id):
+    post = db.get_or_404(Post, post_id)
+    if post.user_id != current_user.id:
+        abort(404)
+    return post
+
+
+@api.route('/posts', methods=['POST'])
+def create_post():
+    post = actions.create_post(current_user.id, *post_fields(json_body()))
+    return json_response(post_json(post), 201)
+
+
+@api.route('/posts/<int:post_id>', methods=['PATCH'])
+def update_post(post_id):
+    post = own_post_or_404(post_id)
+    content, privacy = post_fields(json_body(), partial=True)
+    actions.update_post(post, content if content is not None else post.content, privacy or post.privacy)
+    return json_response(post_json(post))
+
+
+@api.route('/posts/<int:post_id>', methods=['DELETE'])
+def delete_post(post_id):
+    actions.delete_post(own_post_or_404(post_id))
+    return Response(status=204)
+
+
+# Friends & Friend Requests
+# --------------------------------------------------------------------------
+
+@api.route('/friend_requests')
+def list_friend_requests():
+    received = FriendRequest.query.filter_by(friend_id=current_user.id, status='pending') \
+        .order_by(FriendRequest.created_at.desc()).limit(MAX_BATCH * 5).all()
+    senders = {user.id: user for user in User.query.options(
+        load_only(User.id, User.first_name, User.last_name, User.avatar_hash)
+    ).filter(User.id.in_({friend_request.user_id for friend_request in received}))}
+    return json_response({'friend_requests': [
+        request_json(friend_request, senders[friend_request.user_id])
+        for friend_request in received if friend_request.user_id in senders
+    ]})
+
+
+@api.route('/friend_requests', methods=['POST'])
+def send_friend_request():
+    user_id = json_body().get('user_id')
+    user = db.session.get(User, user_id) if isinstance(user_id, int) else None
+    if user is None or user.id == current_user.id:
+        abort(404)
+    if current_user.is_friends_with(user):
+        abort(409, 'Already friends.')
+    friend_request = actions.send_friend_request(current_user.id, user.id)
+    return json_response({'id': friend_request.id, 'to_user_id': user.id}, 201)
+
+
+def received_requests(ids):
+    """The caller's pending requests among ids, and the ids that are not."""
+    found = FriendRequest.query.filter(
+        FriendRequest.id.in_(ids), FriendRequest.friend_id == current_user.id).all() if ids else []
+    found_ids = {friend_request.id for friend_request in found}
+    return found, [request_id for request_id in ids if request_id not in found_ids]
+
+
+@api.route('/friend_requests/accept', methods=['POST'])
+def accept_friend_requests():
+    """Accept up to MAX_BATCH requests, {"ids": [...]}, in one transaction."""
+    found, missing = received_requests(id_list(json_body().get('ids') or []))
+    actions.accept_friend_requests(found)
+    return json_response({'accepted': [friend_request.id for friend_request in found], 'not_found': missing})
+
+
+@api.route('/friend_requests/decline', methods=['POST'])
+def decline_friend_requests():
+    found, missing = received_requests(id_list(json_body().get('ids') or []))
+    actions.drop_friend_requests(found)
+    return json_response({'declined': [friend_request.id for friend_request in found], 'not_found': missing})
+
+
+@api.route('/friend_requests/<int:request_id>', methods=['DELETE'])
+def cancel_friend_request(request_id):
+    friend_request = FriendRequest.query.filter_by(id=request_id, user_id=current_user.id).first_or_404()
+    actions.drop_friend_requests([friend_request])
+    return Response(status=204)
+
+
+@api.route('/friends/<int:friend_id>', methods=['DELETE'])
+def remove_friend(friend_id):
+    actions.remove_friend(current_user.id, friend_id)
+    return Response(status=204)
@@ -0,0 +1,109 @@
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from flask import current_app, url_for
+
+CHUNK_SIZE = 64 * 1024
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+]
+
+
+class AvatarStore:
+    """Content-addressed image store: files are named by their sha256 and written once."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def variant_path(self, digest, size):
+        return f'{self.path(digest)}-{size}'
+
+    def exists(self, digest):
+        return bool(DIGEST_RE.match(digest or '')) and os.path.exists(self.path(digest))
+
+    def _commit(self, tmp_path, digest):
+        target = self.path(digest)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+            # A fresh upload keeps the file safe from a pending cleanup, see age()
+            os.utime(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+        return digest
+
+    def age(self, digest):
+        """Seconds since the image was last uploaded."""
+        return time.time() - os.path.getmtime(self.path(digest))
+
+    def remove(self, digest):
+        """Delete an image and its variants."""
+        for path in [self.path(digest)] + glob.glob(glob.escape(self.path(digest)) + '-*'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.path(digest)):
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root)
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            self._commit(tmp_path, digest)
+        return digest
+
+    def put_file(self, path):
+        with open(path, 'rb') as source:
+            return self.put_stream(source)
+
+    def put_stream(self, stream, max_bytes=None):
+        """Copy a stream into the store in chunks. Returns None if it exceeds max_bytes."""
+        sha = hashlib.sha256()
+        size = 0
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    break
+                sha.update(chunk)
+                tmp.write(chunk)
+        if max_bytes is not None and size > max_bytes:
+            os.remove(tmp_path)
+            return None
+        return self._commit(tmp_path, sha.hexdigest())
+
+
+def get_store():
+    root = current_app.config.get('AVATAR_STORE') or os.path.join(current_app.instance_path, 'avatars')
+    return AvatarStore(root)
+
+
+def sniff_mimetype(path):
+    with open(path, 'rb') as file:
+        head = file.read(12)
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    return 'application/octet-stream'
+
+
+def avatar_url(user, size=None):
+    if user is not None and user.avatar_hash:
+        return url_for('main.avatar', digest=user.avatar_hash, s=size)
+    return url_for('static', filename='images/default-avatar.svg')
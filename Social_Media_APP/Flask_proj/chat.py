@@ -0,0 +1,272 @@
+"""Chat delivery: batched message writes, a wake-up broker and keyset history.
+
+Messages reach waiting clients through the database, so every worker sees
+every message: the writer bumps the conversation's chat:A:B version stamp
+in the transaction of each batch and wakes the waiters of its own process
+at once. For the other processes' messages, one poller thread per process
+reads the stamps of every conversation someone waits on in a single query
+each CHAT_POLL_INTERVAL seconds and wakes those that moved. Event ids are
+chat_ids. Waiting clients block on a Condition, without touching the
+database, rather than owning a dedicated thread, so under a gevent worker
+thousands of idle streams cost one greenlet each.
+"""
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, func, insert, or_, select
+
+from Flask_proj import app_state, db, stamps
+from Flask_proj.models import Chat, User, VersionStamp
+
+HISTORY_LIMIT = 30
+BATCH_LIMIT = 100  # messages returned by one wait
+
+
+def conversation_key(user_id, friend_id):
+    return min(user_id, friend_id), max(user_id, friend_id)
+
+
+def stamp_name(key):
+    return 'chat:%d:%d' % key
+
+
+def between(key):
+    user_id, friend_id = key
+    return or_(and_(Chat.user_id == user_id, Chat.friend_id == friend_id),
+               and_(Chat.user_id == friend_id, Chat.friend_id == user_id))
+
+
+def last_id(key):
+    """The newest chat_id in the conversation; a stream started after it misses nothing already written."""
+    flush_before_read()
+    return db.session.scalar(select(func.max(Chat.chat_id)).where(between(key))) or 0
+
+
+def messages_after(key, after, limit=BATCH_LIMIT):
+    """[(chat_id, message)] newer than `after`, oldest first, on a connection of its own."""
+    statement = (select(Chat.chat_id, Chat.user_id, Chat.friend_id, Chat.message_content, Chat.sent_at,
+                        User.first_name, User.last_name)
+                 .join(User, User.id == Chat.user_id)
+                 .where(between(key), Chat.chat_id > after)
+                 .order_by(Chat.chat_id).limit(limit))
+    with db.engine.connect() as connection:
+        rows = connection.execute(statement).all()
+    return [(row.chat_id, {
+        'user_id': row.user_id,
+        'friend_id': row.friend_id,
+        'sender_name': f'{row.first_name} {row.last_name}',
+        'message_content': row.message_content,
+        'sent_at': row.sent_at.isoformat(),
+    }) for row in rows]
+
+
+class Watch:
+    """The waiters on one conversation: woken when `generation` moves."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.version = None  # the chat stamp the poller last read
+        self.waiters = 0
+
+    def wake(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+
+class Broker:
+    """Wakes the waiters on a conversation in this process once its new messages are committed."""
+
+    def __init__(self, app, poll_interval=1.0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self._watches = {}  # conversation key: Watch, while someone waits on it
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def _watch(self, key):
+        with self._lock:
+            watch = self._watches.get(key)
+            if watch is None:
+                watch = self._watches[key] = Watch()
+            watch.waiters += 1
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._run, name='chat-poller', daemon=True)
+                self._poller.start()
+            return watch
+
+    def _unwatch(self, key, watch):
+        with self._lock:
+            watch.waiters -= 1
+            if not watch.waiters:
+                del self._watches[key]
+
+    def notify(self, keys):
+        with self._lock:
+            watches = [self._watches[key] for key in keys if key in self._watches]
+        for watch in watches:
+            watch.wake()
+
+    def poll(self):
+        """Read the stamps of all watched conversations in one query and wake those that moved."""
+        with self._lock:
+            watches = {stamp_name(key): watch for key, watch in self._watches.items()}
+        if not watches:
+            return
+        with db.engine.connect() as connection:
+            found = dict(connection.execute(select(VersionStamp.name, VersionStamp.version)
+                                            .where(VersionStamp.name.in_(watches))).all())
+        for name, watch in watches.items():
+            version = found.get(name, 0)
+            # The first read wakes too: a message may have committed since the waiter looked
+            if version != watch.version:
+                watch.version = version
+                watch.wake()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception:
+                self.app.logger.exception('Failed to poll chat stamps')
+
+    def wait(self, key, after, timeout):
+        """Return [(chat_id, message)] newer than `after`, waiting up to `timeout` seconds for one."""
+        deadline = time.monotonic() + timeout
+        watch = self._watch(key)
+        try:
+            while True:
+                generation = watch.generation
+                messages = messages_after(key, after)
+                if messages:
+                    return messages
+                with watch.condition:
+                    while watch.generation == generation:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return []
+                        watch.condition.wait(remaining)
+        finally:
+            self._unwatch(key, watch)
+
+
+class ChatWriter:
+    """Buffers messages and inserts them in one transaction per batch.
+
+    A batch that fails to commit is rolled back and tried again first on the
+    next flush; after `max_attempts` failures it is dropped and logged.
+    """
+
+    def __init__(self, app, batch_size=100, interval=0.2, max_attempts=5):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        self._failed = None  # (attempts, rows) of the batch to retry
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def write(self, row):
+        self._queue.put(row)
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _insert(self, rows):
+        keys = {conversation_key(row['user_id'], row['friend_id']) for row in rows}
+        db.session.execute(insert(Chat), rows)
+        stamps.bump(*sorted(stamp_name(key) for key in keys))
+        db.session.commit()
+        get_broker().notify(keys)
+
+    def flush(self):
+        """Write everything queued so far; raises when a batch fails, after keeping it for a retry."""
+        with self._flush_lock, self.app.app_context():
+            while True:
+                attempts, rows = self._failed or (0, self._drain())
+                self._failed = None
+                if not rows:
+                    return
+                try:
+                    self._insert(rows)
+                except Exception:
+                    db.session.rollback()
+                    attempts += 1
+                    if attempts < self.max_attempts:
+                        self._failed = attempts, rows
+                    else:
+                        self.app.logger.error('Dropped %d chat messages after %d failed writes', len(rows), attempts)
+                    raise
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Failed to write chat messages')
+
+
+def get_broker():
+    return app_state('chat.broker', lambda: Broker(current_app._get_current_object(),
+                                                   poll_interval=current_app.config.get('CHAT_POLL_INTERVAL', 1.0)))
+
+
+def get_writer():
+    config = current_app.config
+    return app_state('chat.writer', lambda: ChatWriter(current_app._get_current_object(),
+                                                       batch_size=config.get('CHAT_BATCH_SIZE', 100),
+                                                       interval=config.get('CHAT_FLUSH_INTERVAL', 0.2),
+                                                       max_attempts=config.get('CHAT_WRITE_ATTEMPTS', 5)))
+
+
+def flush_before_read():
+    """Write queued messages so a read sees them; on failure the read shows what is committed."""
+    try:
+        get_writer().flush()
+    except Exception:
+        current_app.logger.exception('Failed to write chat messages')
+
+
+def send_message(sender, friend_id, content):
+    """Queue the message for the writer; waiters get it once its batch is committed."""
+    sent_at = datetime.utcnow()
+    get_writer().write(dict(user_id=sender.id, friend_id=friend_id, message_content=content, sent_at=sent_at))
+    return {
+        'user_id': sender.id,
+        'friend_id': friend_id,
+        'sender_name': f'{sender.first_name} {sender.last_name}',
+        'message_content': content,
+        'sent_at': sent_at.isoformat(),
+    }
+
+
+def history(user_id, friend_id, before=None, limit=HISTORY_LIMIT):
+    """One page of the conversation, newest first, as (messages, next_cursor)."""
+    flush_before_read()
+    query = Chat.query.filter(between((user_id, friend_id)))
+    if before:
+        sent_at, chat_id = before
+        query = query.filter(or_(Chat.sent_at < sent_at, and_(Chat.sent_at == sent_at, Chat.chat_id < chat_id)))
+    messages = query.order_by(Chat.sent_at.desc(), Chat.chat_id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(messages) > limit:
+        last = messages[limit - 1]
+        next_cursor = f'{last.sent_at.isoformat()},{last.chat_id}'
+    return messages[:limit], next_cursor
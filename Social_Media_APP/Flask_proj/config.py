@@ -0,0 +1,83 @@
+import os
+import sqlite3
+
+from sqlalchemy import event
+
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
+    # Heroku-style URLs use the scheme SQLAlchemy dropped in 1.4
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+        # busy_timeout is set per connection below; the driver timeout covers the first connect
+        return {'connect_args': {'timeout': 30}}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+
+class Config:
+    # Without one, create_app generates a key in the instance folder that all local workers share
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLALCHEMY_DATABASE_URI = database_uri()
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -16000,
+        'temp_store': 'MEMORY',
+    }
+    FEED_INBOX = os.environ.get('FEED_INBOX') or None  # 'memory' or 'sql' to enable fan-out-on-write feeds
+    METRICS = bool(os.environ.get('METRICS'))  # Server-Timing headers and /_metrics, see metrics.py
+    # Who may read /_metrics: a bearer token and/or client addresses; nobody when neither is set
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    METRICS_ALLOWED_IPS = tuple(ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip())
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))  # existing hashes are upgraded on login
+    # Half the cores at most, so a login burst leaves CPU for everything else
+    PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+    # People search through the FTS5 name index migration 10 creates (SQLite), see directory.py
+    DIRECTORY_FTS = bool(os.environ.get('DIRECTORY_FTS'))
+    POST_SEARCH = os.environ.get('POST_SEARCH') or None  # 'fts' or 'memory'; default depends on the database
+    SEARCH_RANK_WINDOW = 5000  # matches ranked per search, newest first, see search.py
+    API_COMPRESS_MIN_SIZE = 1024  # smaller /api/v1 bodies are sent uncompressed
+    # Background job threads per process, see jobs.py; 0 runs each write's jobs inline after it commits
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+    JOB_MAX_ATTEMPTS = 5  # then the job is kept as 'dead'
+    AVATAR_CLEANUP_DELAY = 3600  # seconds a replaced avatar stays on disk
+    # Seconds between checks for chat messages written by other worker processes, see chat.py
+    CHAT_POLL_INTERVAL = float(os.environ.get('CHAT_POLL_INTERVAL', 1))
+    # 'sqlite' or 'file' keep sessions server-side, see sessions.py; default is Flask's signed cookie
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or None
+    # Reverse proxies in front of the app whose X-Forwarded-For and -Proto are trusted (gunicorn.conf.py
+    # binds 127.0.0.1 behind one); set 0 when clients connect directly, or they can pick their own address
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 1))
+    # (attempts, per seconds) token buckets in front of login; login_email counts per email and client
+    # address, so failing sign-ins from elsewhere cannot lock an account out
+    RATE_LIMITS = {
+        'login_ip': (20, 60),
+        'login_email': (5, 300),
+    }
+
+
+def install_sqlite_pragmas(app, engine):
+    """Apply app.config['SQLITE_PRAGMAS'] to every new SQLite connection."""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in app.config.get('SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
@@ -0,0 +1,65 @@
+"""Denormalized per-user counts: friends, posts and pending friend requests received.
+
+Pages read a badge or a profile stat from the user row instead of loading
+the collection. The write paths in actions.py call refresh_later() for each
+user whose counts changed, which queues a 'counters' job keyed by user: a
+burst of writes for one user is recounted once, from the source tables, and
+a retried job cannot count twice. The job bumps the user's version stamp so
+a page rendered before the recount is not served from a 304 afterwards, and
+drops the user from the user cache, whose record carries the request badge.
+Anything that writes around actions (bulk seeding, manual SQL, old data)
+drifts; `reconcile` recomputes every user and fixes the rows that differ.
+Run it after imports and periodically:
+
+    python db_test.py reconcile_counters
+"""
+from sqlalchemy import func, or_, select, update
+
+from Flask_proj import db, jobs, stamps, user_cache
+from Flask_proj.models import Friendship, FriendRequest, Post, User
+
+RECONCILE_BATCH = 5000
+
+
+def refresh_later(*user_ids):
+    """Queue a recount of these users' counters in the current transaction."""
+    for user_id in set(user_ids):
+        jobs.enqueue('counters', {'user_id': user_id}, key=str(user_id))
+
+
+@jobs.handler('counters')
+def refresh(payloads):
+    user_ids = sorted({payload['user_id'] for payload in payloads})
+    db.session.execute(update(User).where(User.id.in_(user_ids)).values(**expected_counts())
+                       .execution_options(synchronize_session=False))
+    stamps.bump(*[f'user:{user_id}' for user_id in user_ids])
+    return lambda: user_cache.invalidate(*user_ids)
+
+
+def expected_counts():
+    """Correlated subqueries computing each counter from the rows it counts."""
+    return {
+        'friend_count': select(func.count()).where(Friendship.user_id == User.id).scalar_subquery(),
+        'post_count': select(func.count()).where(Post.user_id == User.id).scalar_subquery(),
+        'pending_request_count': select(func.count()).where(
+            FriendRequest.friend_id == User.id, FriendRequest.status == 'pending').scalar_subquery(),
+    }
+
+
+def reconcile(batch_size=RECONCILE_BATCH):
+    """Recompute every user's counters, one id range per transaction. Returns how many rows had drifted."""
+    repaired = 0
+    last_id = db.session.scalar(select(func.max(User.id))) or 0
+    db.session.commit()
+    for start in range(0, last_id, batch_size):
+        counts = expected_counts()
+        result = db.session.execute(
+            update(User)
+            .where(User.id > start, User.id <= start + batch_size,
+                   or_(*[getattr(User, name) != expected for name, expected in counts.items()]))
+            .values(**counts)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        repaired += result.rowcount
+    return repaired
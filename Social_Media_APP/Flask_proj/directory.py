@@ -0,0 +1,111 @@
+"""Paginated, prefix-searchable people directory."""
+import base64
+import json
+
+from flask import current_app
+from sqlalchemy import and_, exists, or_, select, text
+from sqlalchemy.orm import load_only
+
+from Flask_proj import db
+from Flask_proj.models import User, Friendship, FriendRequest, search_key
+
+DEFAULT_LIMIT = 24
+PREFIX_END = chr(0x10FFFF)
+
+# Optional name index for app.config['DIRECTORY_FTS'] (SQLite only), created by migration 10;
+# unicode61 folds case and diacritics on both sides of MATCH
+FTS_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5("
+    "first_name, last_name, content='user', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS user_fts_insert AFTER INSERT ON user BEGIN "
+    "INSERT INTO user_fts(rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name); END",
+    "CREATE TRIGGER IF NOT EXISTS user_fts_delete AFTER DELETE ON user BEGIN "
+    "INSERT INTO user_fts(user_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); END",
+    "CREATE TRIGGER IF NOT EXISTS user_fts_update AFTER UPDATE OF first_name, last_name ON user BEGIN "
+    "INSERT INTO user_fts(user_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); "
+    "INSERT INTO user_fts(rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name); END",
+    "INSERT INTO user_fts(user_fts) VALUES ('rebuild')",
+]
+
+
+def encode_cursor(last_name, first_name, user_id):
+    return base64.urlsafe_b64encode(json.dumps([last_name, first_name, user_id]).encode()).decode()
+
+
+def decode_cursor(value):
+    if not value:
+        return None
+    try:
+        last_name, first_name, user_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return str(last_name), str(first_name), int(user_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def sort_keys():
+    return User.last_name_key, User.first_name_key
+
+
+def prefix(expression, term):
+    return and_(expression >= term, expression < term + PREFIX_END)
+
+
+def fts_enabled():
+    return current_app.config.get('DIRECTORY_FTS') and db.engine.dialect.name == 'sqlite'
+
+
+def fts_match(q):
+    # Every word must match as a prefix: "ann"* "smi"*
+    terms = ['"%s"*' % word.replace('"', '""') for word in q.split()]
+    return select(text('rowid')).select_from(text('user_fts')).where(
+        text('user_fts MATCH :match').bindparams(match=' '.join(terms)))
+
+
+def search_filter(q):
+    if fts_enabled():
+        return User.id.in_(fts_match(q))
+    term = search_key(q.strip())
+    last_name, first_name = sort_keys()
+    return or_(prefix(last_name, term), prefix(first_name, term), prefix(User.email_key, term))
+
+
+def not_connected(viewer_id):
+    """Exclude friends and anyone with a pending request in either direction."""
+    friends = exists().where(Friendship.user_id == viewer_id, Friendship.friend_id == User.id)
+    pending = exists().where(FriendRequest.status == 'pending', or_(
+        and_(FriendRequest.user_id == viewer_id, FriendRequest.friend_id == User.id),
+        and_(FriendRequest.user_id == User.id, FriendRequest.friend_id == viewer_id)
+    ))
+    return and_(~friends, ~pending)
+
+
+def search_people(viewer_id, q=None, after=None, limit=DEFAULT_LIMIT):
+    """Return one page of (users, next_cursor), ordered by last and first name."""
+    last_name, first_name = sort_keys()
+    query = db.session.query(User, last_name, first_name).options(
+        load_only(User.id, User.first_name, User.last_name, User.avatar_hash)
+    ).filter(User.id != viewer_id, not_connected(viewer_id))
+
+    if q and q.strip():
+        query = query.filter(search_filter(q))
+    if after:
+        after_last, after_first, after_id = after
+        query = query.filter(or_(
+            last_name > after_last,
+            and_(last_name == after_last, first_name > after_first),
+            and_(last_name == after_last, first_name == after_first, User.id > after_id)
+        ))
+
+    rows = query.order_by(last_name, first_name, User.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        user, user_last_name, user_first_name = rows[limit - 1]
+        next_cursor = encode_cursor(user_last_name, user_first_name, user.id)
+    return [row[0] for row in rows[:limit]], next_cursor
+
+
+def create_fts_index(connection):
+    for statement in FTS_STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,365 @@
+"""Fan-out-on-write inboxes for the 'friends' home timeline.
+
+Public and Friends posts are pushed into the inbox of the author and each
+of their friends. Enable with app.config['FEED_INBOX'] = 'memory' or 'sql'.
+
+The memory inbox lives in each process and is updated right after a write
+commits there. Each inbox remembers the posts:A stamp of every author in it
+and the owner's friends:U stamp (see stamps.py); a write applied here moves
+the author's stamp on by the version it produced. Before an inbox is read,
+the owner's stamps and the sum of their friends' posts stamps are compared
+with what it holds, so it is only rebuilt after it missed a write made
+through another worker, or a change of friends.
+
+The SQL inbox is updated by jobs queued in the write transaction
+('feed.post', 'feed.author'), which rebuild the affected rows from the
+current posts and friendships; only deleting a post removes its rows in the
+same transaction, since feed_entry references it.
+"""
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import and_, delete, insert, or_, select
+
+from Flask_proj import app_state, db, jobs, stamps, timeline
+from Flask_proj.models import Friendship, FeedEntry, Post
+
+FAN_OUT_PRIVACY = ('Public', 'Friends')
+BACKFILL_LIMIT = 500
+
+
+class InboxBackend:
+    """Interface for inbox stores. Entries are (created_at, post_id, author_id)."""
+
+    # Durable inboxes are written by jobs in the database transaction that runs them
+    durable = False
+
+    def push(self, owner_ids, entry):
+        raise NotImplementedError
+
+    def extend(self, owner_id, entries):
+        raise NotImplementedError
+
+    def remove_post(self, owner_ids, post_id):
+        raise NotImplementedError
+
+    def remove_author(self, owner_id, author_id):
+        raise NotImplementedError
+
+    def page(self, owner_id, before, limit):
+        """Return up to limit + 1 post ids older than `before`, or None when the
+        inbox cannot answer and the caller should fall back to the Post table."""
+        raise NotImplementedError
+
+
+class MemoryInbox(InboxBackend):
+    """Per-process inboxes kept in an LRU of bounded, sorted lists.
+
+    Inboxes are hydrated from the Post table on first read, and again when
+    they missed a stamp version, so evicting an owner only costs one
+    timeline query the next time they load the page.
+    """
+
+    def __init__(self, max_owners=10000, max_entries=BACKFILL_LIMIT):
+        self.max_owners = max_owners
+        self.max_entries = max_entries
+        self._inboxes = OrderedDict()
+        self._truncated = set()
+        # owner_id: (friends:U version, {author_id: posts:A version}) the inbox holds
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _trim(self, owner_id, entries):
+        if len(entries) > self.max_entries:
+            del entries[:len(entries) - self.max_entries]
+            self._truncated.add(owner_id)
+
+    def push(self, owner_ids, entry):
+        with self._lock:
+            for owner_id in owner_ids:
+                entries = self._inboxes.get(owner_id)
+                # Owners that are not loaded are hydrated from the database later
+                if entries is None:
+                    continue
+                index = bisect_left(entries, entry)
+                # A hydrate that ran after the commit already holds the entry
+                if index == len(entries) or entries[index] != entry:
+                    entries.insert(index, entry)
+                    self._trim(owner_id, entries)
+
+    def extend(self, owner_id, entries):
+        with self._lock:
+            current = self._inboxes.get(owner_id)
+            if current is not None:
+                current.extend(entries)
+                current.sort()
+                self._trim(owner_id, current)
+
+    def remove_post(self, owner_ids, post_id):
+        with self._lock:
+            for owner_id in owner_ids:
+                entries = self._inboxes.get(owner_id)
+                if entries is not None:
+                    entries[:] = [entry for entry in entries if entry[1] != post_id]
+
+    def remove_author(self, owner_id, author_id):
+        with self._lock:
+            entries = self._inboxes.get(owner_id)
+            if entries is not None:
+                entries[:] = [entry for entry in entries if entry[2] != author_id]
+
+    def applied(self, owner_ids, author_id, version):
+        """The write that moved posts:author_id to `version` is in the owners' inboxes.
+
+        Inboxes that missed an earlier version keep theirs and are rebuilt on read."""
+        with self._lock:
+            for owner_id in owner_ids:
+                held = self._versions.get(owner_id)
+                if held and held[1].get(author_id, 0) == version - 1:
+                    held[1][author_id] = version
+
+    def hydrate(self, owner_id):
+        # Read the stamps first, so a write committed during the query makes it stale, not lost
+        friends_stamp, = stamps.versions([f'friends:{owner_id}'])
+        authors = stamps.friends_versions(owner_id, 'posts')
+        authors[owner_id], = stamps.versions([f'posts:{owner_id}'])
+        posts, next_cursor = timeline.page_of(
+            Post.query.filter(timeline.visibility_filter(owner_id, 'friends')),
+            limit=self.max_entries
+        )
+        entries = sorted((post.created_at, post.post_id, post.user_id) for post in posts)
+        with self._lock:
+            self._inboxes[owner_id] = entries
+            self._versions[owner_id] = (friends_stamp, authors)
+            if next_cursor:
+                self._truncated.add(owner_id)
+            else:
+                self._truncated.discard(owner_id)
+            while len(self._inboxes) > self.max_owners:
+                evicted, _ = self._inboxes.popitem(last=False)
+                self._truncated.discard(evicted)
+                self._versions.pop(evicted, None)
+
+    def is_current(self, owner_id):
+        with self._lock:
+            held = self._versions.get(owner_id)
+            if owner_id not in self._inboxes or not held:
+                return False
+            friends_stamp, authors = held
+            own = authors.get(owner_id, 0)
+            friends = sum(authors.values()) - own
+        # Stamps only grow, so equal sums mean no friend's stamp moved past ours
+        return ((own, friends_stamp) == tuple(stamps.versions([f'posts:{owner_id}', f'friends:{owner_id}']))
+                and friends == stamps.friends_version(owner_id, 'posts'))
+
+    def page(self, owner_id, before, limit):
+        if not self.is_current(owner_id):
+            self.hydrate(owner_id)
+        with self._lock:
+            entries = self._inboxes.get(owner_id)
+            if entries is None:
+                return None
+            self._inboxes.move_to_end(owner_id)
+            end = bisect_left(entries, before) if before else len(entries)
+            start = max(0, end - limit - 1)
+            if end - start <= limit and owner_id in self._truncated:
+                # The page reaches past the oldest entry we kept
+                return None
+            return [entry[1] for entry in reversed(entries[start:end])]
+
+
+class SqlInbox(InboxBackend):
+    """Inboxes stored in the feed_entry table. Writes join the caller's transaction."""
+
+    durable = True
+
+    def push(self, owner_ids, entry):
+        created_at, post_id, author_id = entry
+        rows = [dict(owner_id=owner_id, post_id=post_id, author_id=author_id, created_at=created_at)
+                for owner_id in owner_ids]
+        if rows:
+            db.session.execute(insert(FeedEntry), rows)
+
+    def extend(self, owner_id, entries):
+        rows = [dict(owner_id=owner_id, post_id=post_id, author_id=author_id, created_at=created_at)
+                for created_at, post_id, author_id in entries]
+        if rows:
+            db.session.execute(insert(FeedEntry), rows)
+
+    def remove_post(self, owner_ids, post_id):
+        db.session.execute(delete(FeedEntry).where(FeedEntry.post_id == post_id))
+
+    def remove_author(self, owner_id, author_id):
+        db.session.execute(delete(FeedEntry).where(
+            FeedEntry.owner_id == owner_id, FeedEntry.author_id == author_id))
+
+    def page(self, owner_id, before, limit):
+        query = select(FeedEntry.post_id).where(FeedEntry.owner_id == owner_id)
+        if before:
+            created_at, post_id = before
+            query = query.where(or_(
+                FeedEntry.created_at < created_at,
+                and_(FeedEntry.created_at == created_at, FeedEntry.post_id < post_id)
+            ))
+        query = query.order_by(FeedEntry.created_at.desc(), FeedEntry.post_id.desc()).limit(limit + 1)
+        return list(db.session.scalars(query))
+
+    def rebuild(self):
+        db.session.execute(delete(FeedEntry))
+        # The author's own inbox, then one row per friend
+        db.session.execute(insert(FeedEntry).from_select(
+            ['owner_id', 'post_id', 'author_id', 'created_at'],
+            select(Post.user_id, Post.post_id, Post.user_id, Post.created_at).where(
+                Post.privacy.in_(FAN_OUT_PRIVACY))
+        ))
+        posts = select(Post.post_id, Post.user_id, Post.created_at).where(
+            Post.privacy.in_(FAN_OUT_PRIVACY)).subquery()
+        db.session.execute(insert(FeedEntry).from_select(
+            ['owner_id', 'post_id', 'author_id', 'created_at'],
+            select(Friendship.user_id, posts.c.post_id, posts.c.user_id, posts.c.created_at)
+            .join(posts, posts.c.user_id == Friendship.friend_id)
+        ))
+        db.session.commit()
+
+
+BACKENDS = {
+    'memory': MemoryInbox,
+    'sql': SqlInbox,
+}
+
+
+def get_inbox():
+    name = current_app.config.get('FEED_INBOX')
+    if not name:
+        return None
+    return app_state('feed.inbox', BACKENDS[name])
+
+
+def local_inbox():
+    """The inbox to update in this process after a commit; None when jobs keep it up to date."""
+    inbox = get_inbox()
+    return inbox if inbox and not inbox.durable else None
+
+
+def friend_ids(user_id):
+    return list(db.session.scalars(timeline.friend_ids_query(user_id)))
+
+
+def recent_posts(author_id):
+    return [tuple(row) for row in db.session.execute(
+        select(Post.created_at, Post.post_id, Post.user_id)
+        .where(Post.user_id == author_id, Post.privacy.in_(FAN_OUT_PRIVACY))
+        .order_by(Post.created_at.desc())
+        .limit(BACKFILL_LIMIT)
+    )]
+
+
+# Before commit: queue the SQL inbox update
+# --------------------------------------------------------------------------
+
+def post_saved(post):
+    """A post was created or edited; post_id must be assigned (flush first)."""
+    inbox = get_inbox()
+    if inbox and inbox.durable:
+        jobs.enqueue('feed.post', {'post_id': post.post_id}, key=str(post.post_id))
+
+
+def friends_changed(owner_id, author_id):
+    """author_id's posts should appear in, or leave, owner_id's inbox."""
+    inbox = get_inbox()
+    if inbox and inbox.durable:
+        jobs.enqueue('feed.author', {'owner_id': owner_id, 'author_id': author_id},
+                     key=f'{owner_id}:{author_id}')
+
+
+@jobs.handler('feed.post')
+def refresh_posts(payloads):
+    """Rewrite the inbox rows of each post from its current privacy."""
+    inbox = SqlInbox()
+    post_ids = sorted({payload['post_id'] for payload in payloads})
+    db.session.execute(delete(FeedEntry).where(FeedEntry.post_id.in_(post_ids)))
+    posts = db.session.execute(select(Post.created_at, Post.post_id, Post.user_id).where(
+        Post.post_id.in_(post_ids), Post.privacy.in_(FAN_OUT_PRIVACY)))
+    friends = {}
+    for entry in posts:
+        author_id = entry.user_id
+        if author_id not in friends:
+            friends[author_id] = friend_ids(author_id)
+        inbox.push([author_id] + friends[author_id], tuple(entry))
+
+
+@jobs.handler('feed.author')
+def refresh_authors(payloads):
+    """Replace an author's posts in an owner's inbox after they became friends or stopped being friends."""
+    inbox = SqlInbox()
+    pairs = sorted({(payload['owner_id'], payload['author_id']) for payload in payloads})
+    for owner_id, author_id in pairs:
+        inbox.remove_author(owner_id, author_id)
+        friends = db.session.scalar(select(Friendship.id).where(
+            Friendship.user_id == owner_id, Friendship.friend_id == author_id).limit(1))
+        if friends:
+            inbox.extend(owner_id, recent_posts(author_id))
+
+
+# After commit: update this process's memory inbox
+# --------------------------------------------------------------------------
+
+def fan_out(post, version):
+    """Push a new post; version is the posts:A stamp its commit produced."""
+    inbox = local_inbox()
+    if inbox:
+        owners = [post.user_id] + friend_ids(post.user_id)
+        if post.privacy in FAN_OUT_PRIVACY:
+            inbox.push(owners, (post.created_at, post.post_id, post.user_id))
+        inbox.applied(owners, post.user_id, version)
+
+
+def remove_post(post):
+    """Called before the post is deleted, in the same transaction for the SQL inbox."""
+    inbox = get_inbox()
+    if inbox:
+        inbox.remove_post([post.user_id] + friend_ids(post.user_id), post.post_id)
+
+
+def update_post(post, version):
+    if local_inbox():
+        remove_post(post)
+        fan_out(post, version)
+
+
+def post_deleted(post, version):
+    inbox = local_inbox()
+    if inbox:
+        inbox.applied([post.user_id] + friend_ids(post.user_id), post.user_id, version)
+
+
+def backfill(owner_id, author_id):
+    """Copy an author's recent posts into a new friend's inbox."""
+    inbox = local_inbox()
+    if inbox:
+        posts = recent_posts(author_id)
+        inbox.remove_author(owner_id, author_id)
+        inbox.extend(owner_id, posts)
+
+
+def purge(owner_id, author_id):
+    inbox = local_inbox()
+    if inbox:
+        inbox.remove_author(owner_id, author_id)
+
+
+def friends_timeline(user_id, before=None, limit=timeline.DEFAULT_LIMIT):
+    """Same result as timeline.timeline(user_id, 'friends', ...) read from the inbox."""
+    inbox = get_inbox()
+    post_ids = inbox.page(user_id, before, limit) if inbox else None
+    if post_ids is None:
+        return timeline.timeline(user_id, 'friends', before, limit)
+
+    posts = timeline.with_authors(Post.query.filter(Post.post_id.in_(post_ids))).all()
+    by_id = {post.post_id: post for post in posts}
+    posts = [by_id[post_id] for post_id in post_ids if post_id in by_id]
+    posts, more = posts[:limit], len(post_ids) > limit
+    next_cursor = timeline.make_cursor(posts[-1]) if more and posts else None
+    return posts, next_cursor
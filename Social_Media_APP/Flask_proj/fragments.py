@@ -0,0 +1,84 @@
+"""Cache for rendered post cards and profile blocks.
+
+Post cards are keyed by (post_id, updated_at), so an edited post is never
+served from its old entry. Anything that shows a user's name, avatar or
+friends is keyed by that user's profile:U / friends:U version stamps too,
+the database counters the write routes bump in the transaction of their
+change and the ETags are built from (see stamps.py). A worker therefore
+never serves a block older than the stamps it put in the page's ETag, and
+the per-process LRU needs no cross-worker invalidation.
+"""
+from flask import current_app
+from markupsafe import Markup
+
+from Flask_proj import app_state, stamps
+from Flask_proj.cache import LRUCache
+
+POST_TEMPLATES = {
+    'home': 'fragments/post_home.html',
+    'profile': 'fragments/post_profile.html',
+    'list': 'fragments/post_list.html',
+}
+
+
+def get_backend():
+    """The configured FRAGMENT_CACHE_BACKEND, or a process-local LRU cache."""
+    config = current_app.config
+    return config.get('FRAGMENT_CACHE_BACKEND') or app_state(
+        'fragments.cache', lambda: LRUCache(maxsize=config.get('FRAGMENT_CACHE_SIZE', 20000),
+                                            ttl=config.get('FRAGMENT_CACHE_TTL', 300)))
+
+
+def generation(kind, user_id):
+    return stamps.versions([f'{kind}:{user_id}'])[0]
+
+
+def prefetch(posts):
+    """Read the stamps the cards of `posts` are keyed by in one query instead of one per author."""
+    stamps.versions(sorted({f'profile:{post.user_id}' for post in posts}))
+
+
+def cached(key, render):
+    html = get_backend().get(key)
+    if html is None:
+        html = render()
+        get_backend().set(key, html)
+    return Markup(html)
+
+
+def render(template_name, **context):
+    return current_app.jinja_env.get_template(template_name).render(**context)
+
+
+def post_card(post, variant='home', owner=False):
+    """Rendered card for one post. `owner` adds the edit/delete buttons on profiles."""
+    version = (post.updated_at or post.created_at).isoformat()
+    key = ('post', variant, bool(owner), post.post_id, version, generation('profile', post.user_id))
+    return cached(key, lambda: render(POST_TEMPLATES[variant], post=post, owner=owner))
+
+
+def profile_sidebar(user):
+    """Avatar and friend grid; changes with the user's profile or friend list, or a friend's profile."""
+    key = ('profile_sidebar', user.id, generation('profile', user.id), generation('friends', user.id),
+           stamps.friends_version(user.id, 'profile'))
+    return cached(key, lambda: render('fragments/profile_sidebar.html', user=user))
+
+
+def profile_details(user):
+    key = ('profile_details', user.id, generation('profile', user.id))
+    return cached(key, lambda: render('fragments/profile_details.html', user=user))
+
+
+def forget_post(post):
+    """Drop the cached cards for post's current version; call before editing or deleting it.
+
+    Edited posts get a new key anyway, this only frees the old entries early."""
+    version = (post.updated_at or post.created_at).isoformat()
+    token = generation('profile', post.user_id)
+    for variant in POST_TEMPLATES:
+        for owner in (False, True):
+            get_backend().delete(('post', variant, owner, post.post_id, version, token))
+
+
+def stats():
+    return get_backend().stats()
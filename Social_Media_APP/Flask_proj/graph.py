@@ -0,0 +1,161 @@
+"""In-memory friend graph for mutual-friend counts and "people you may know".
+
+Adjacency lists are sorted int arrays built from the Friendship table and
+updated in place by the friend routes. Each process rebuilds its copy after
+GRAPH_TTL seconds so edits made by other workers are picked up; the rebuild
+runs in a background thread while readers keep using the old graph, and the
+new one replaces it in a single assignment.
+"""
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from flask import current_app
+from sqlalchemy import select, union
+
+from Flask_proj import STATE_KEY, app_state, db
+from Flask_proj.models import Friendship, FriendRequest
+
+# Bound the work for users with very many friends
+MAX_FANOUT = 1000
+
+
+class FriendGraph:
+
+    def __init__(self, adjacency=None):
+        self.adjacency = adjacency or {}
+        self.built_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_edges(cls, edges):
+        grouped = defaultdict(list)
+        for user_id, friend_id in edges:
+            grouped[user_id].append(friend_id)
+        return cls({user_id: array('l', sorted(set(friends))) for user_id, friends in grouped.items()})
+
+    @classmethod
+    def from_database(cls):
+        return cls.from_edges(db.session.execute(select(Friendship.user_id, Friendship.friend_id)))
+
+    def friends(self, user_id):
+        return self.adjacency.get(user_id, array('l'))
+
+    def _insert(self, user_id, friend_id):
+        friends = self.adjacency.setdefault(user_id, array('l'))
+        index = bisect_left(friends, friend_id)
+        if index == len(friends) or friends[index] != friend_id:
+            friends.insert(index, friend_id)
+
+    def _remove(self, user_id, friend_id):
+        friends = self.adjacency.get(user_id)
+        if friends:
+            index = bisect_left(friends, friend_id)
+            if index < len(friends) and friends[index] == friend_id:
+                del friends[index]
+
+    def add_friendship(self, user_id, friend_id):
+        with self._lock:
+            self._insert(user_id, friend_id)
+            self._insert(friend_id, user_id)
+
+    def remove_friendship(self, user_id, friend_id):
+        with self._lock:
+            self._remove(user_id, friend_id)
+            self._remove(friend_id, user_id)
+
+    def mutual_count(self, user_id, other_id):
+        first, second = self.friends(user_id), self.friends(other_id)
+        if len(first) > len(second):
+            first, second = second, first
+        # Probe the longer sorted list with each id from the shorter one
+        count = 0
+        for friend_id in first:
+            index = bisect_left(second, friend_id)
+            if index < len(second) and second[index] == friend_id:
+                count += 1
+        return count
+
+    def mutual_counts(self, user_id, other_ids):
+        return {other_id: self.mutual_count(user_id, other_id) for other_id in other_ids}
+
+    def suggestions(self, user_id, k=10, exclude=()):
+        """Top-k second-degree users as (user_id, mutual friend count), leaving out `exclude`."""
+        friends = self.friends(user_id)
+        counts = Counter()
+        for friend_id in friends[:MAX_FANOUT]:
+            counts.update(self.friends(friend_id)[:MAX_FANOUT])
+        counts.pop(user_id, None)
+        for other_id in (*friends, *exclude):
+            counts.pop(other_id, None)
+        return heapq.nlargest(k, counts.items(), key=lambda item: (item[1], -item[0]))
+
+
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    state = current_app.extensions[STATE_KEY]
+    graph = state.get('graph')
+    if graph is None:
+        with _graph_lock:
+            graph = state.get('graph')
+            if graph is None:
+                graph = state['graph'] = FriendGraph.from_database()
+    elif time.monotonic() - graph.built_at > current_app.config.get('GRAPH_TTL', 300):
+        with _graph_lock:
+            # Edits made while the rebuild runs are collected here and replayed on the new graph
+            if 'graph.edits' not in state:
+                state['graph.edits'] = []
+                threading.Thread(target=_rebuild, args=(current_app._get_current_object(), state),
+                                 name='friend-graph', daemon=True).start()
+    return graph
+
+
+def _rebuild(app, state):
+    try:
+        with app.app_context():
+            graph = FriendGraph.from_database()
+    except Exception:
+        app.logger.exception('Failed to rebuild the friend graph')
+        graph = None
+    with _graph_lock:
+        edits = state.pop('graph.edits', [])
+        if graph is not None:
+            for method, user_id, friend_id in edits:
+                getattr(graph, method)(user_id, friend_id)
+            state['graph'] = graph
+
+
+def _edit(method, user_id, friend_id):
+    with _graph_lock:
+        graph = app_state('graph')
+        edits = app_state('graph.edits')
+        if edits is not None:
+            edits.append((method, user_id, friend_id))
+    if graph is not None:
+        getattr(graph, method)(user_id, friend_id)
+
+
+def add_friendship(user_id, friend_id):
+    _edit('add_friendship', user_id, friend_id)
+
+
+def remove_friendship(user_id, friend_id):
+    _edit('remove_friendship', user_id, friend_id)
+
+
+def pending_ids_query(user_id):
+    """Users with a pending friend request to or from user_id."""
+    return union(
+        select(FriendRequest.friend_id).where(FriendRequest.user_id == user_id, FriendRequest.status == 'pending'),
+        select(FriendRequest.user_id).where(FriendRequest.friend_id == user_id, FriendRequest.status == 'pending'),
+    )
+
+
+def suggestions(user_id, k=10):
+    """People you may know, without those already asked or asking."""
+    return get_graph().suggestions(user_id, k, exclude=db.session.scalars(pending_ids_query(user_id)).all())
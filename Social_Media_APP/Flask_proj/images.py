@@ -0,0 +1,98 @@
+import importlib.util
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+
+from Flask_proj import app_state, avatars
+
+# Pillow is optional, without it only originals are served. It is imported by
+# the pool processes that use it, which keeps it out of every worker's start-up.
+HAS_PILLOW = importlib.util.find_spec('PIL') is not None
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = (48, 200)
+VARIANT_MAX_BYTES = 24 * 1024
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+QUALITY_STEPS = (85, 75, 60, 45, 30)
+# A variant that is still too large at the lowest quality is shrunk by this factor, down to MIN_VARIANT_SIZE
+DOWNSCALE_STEP = 0.75
+MIN_VARIANT_SIZE = 16
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def get_pool():
+    workers = current_app.config.get('IMAGE_WORKERS', 2)
+    return app_state('images.pool', lambda: ProcessPoolExecutor(max_workers=workers))
+
+
+def save_upload(file_storage):
+    """Stream an uploaded image into the avatar store and queue its variants."""
+    limit = current_app.config.get('MAX_UPLOAD_BYTES', MAX_UPLOAD_BYTES)
+    store = avatars.get_store()
+    digest = store.put_stream(file_storage.stream, max_bytes=limit)
+    if digest is None:
+        raise UploadTooLarge(f'Images must be smaller than {limit // (1024 * 1024)} MB.')
+    schedule_variants(store.root, digest)
+    return digest
+
+
+def schedule_variants(root, digest):
+    """Queue the thumbnails of digest unless they exist or this process is already making them."""
+    if not HAS_PILLOW:
+        return
+    if all(os.path.exists(avatars.AvatarStore(root).variant_path(digest, size)) for size in VARIANT_SIZES):
+        return
+    pending = app_state('images.pending', set)
+    if digest in pending:
+        return
+    pending.add(digest)
+
+    def done(future):
+        pending.discard(digest)
+        if future.exception():
+            logger.error('Image processing failed', exc_info=future.exception())
+
+    get_pool().submit(make_variants, root, digest).add_done_callback(done)
+
+
+def _encode(image, max_bytes):
+    """Encoded bytes of at most max_bytes: lower the quality first, then the size."""
+    from PIL import Image, features
+
+    image_format = 'WEBP' if features.check('webp') else 'JPEG'
+    while True:
+        for quality in QUALITY_STEPS:
+            with tempfile.SpooledTemporaryFile() as buffer:
+                image.save(buffer, image_format, quality=quality)
+                if buffer.tell() <= max_bytes:
+                    buffer.seek(0)
+                    return buffer.read()
+        width, height = image.size
+        if max(width, height) <= MIN_VARIANT_SIZE:
+            raise ValueError(f'Cannot encode a {width}x{height} image in {max_bytes} bytes')
+        image = image.resize((max(MIN_VARIANT_SIZE, int(width * DOWNSCALE_STEP)),
+                              max(MIN_VARIANT_SIZE, int(height * DOWNSCALE_STEP))), Image.LANCZOS)
+
+
+def make_variants(root, digest, sizes=VARIANT_SIZES, max_bytes=VARIANT_MAX_BYTES):
+    """Runs in a worker process: write square, re-encoded thumbnails next to the original."""
+    from PIL import Image, ImageOps
+
+    store = avatars.AvatarStore(root)
+    with Image.open(store.path(digest)) as original:
+        original = ImageOps.exif_transpose(original).convert('RGB')
+        for size in sizes:
+            target = store.variant_path(digest, size)
+            if os.path.exists(target):
+                continue
+            data = _encode(ImageOps.fit(original, (size, size), Image.LANCZOS), max_bytes)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, target)
@@ -0,0 +1,205 @@
+"""Durable background jobs for the side effects of a write.
+
+The write paths in actions.py enqueue jobs in the same transaction as the
+row they change, so a job exists exactly when its change committed, and the
+request pays for one commit however many side effects there are. Worker
+threads (JOB_WORKERS per process, woken by kick() after each write) claim
+due jobs in batches, run every job of a kind through its handler in one
+transaction and delete them in that same transaction.
+
+A claimed job is leased: it stays 'running' until run_after, and a worker
+that dies mid-batch leaves it to be claimed again once the lease expires.
+A batch that fails is retried one job at a time; a job that keeps failing
+backs off exponentially and is marked 'dead' after JOB_MAX_ATTEMPTS, kept
+with its last error for `python db_test.py retry_dead_jobs`.
+
+Handlers take the payloads of a batch and must be safe to run twice. A
+handler may return a function to call once its transaction has committed,
+to update what lives in the process that ran it.
+Jobs enqueued with a key are coalesced while queued, so the handlers
+recompute state (a user's counts, a post's inbox rows) instead of applying
+deltas. Set JOB_WORKERS = 0 to run jobs inline right after the write.
+"""
+import json
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from Flask_proj import app_state, db
+from Flask_proj.models import Job
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+LEASE_SECONDS = 60
+RETRY_DELAY = 5
+POLL_INTERVAL = 1.0
+# A kicked worker waits this long, so a burst of writes becomes one batch
+LINGER_SECONDS = 0.05
+
+HANDLERS = {}
+UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def handler(kind):
+    """Register func(payloads) as the handler for jobs of `kind`."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload=None, key=None, delay=0):
+    """Add a job to the current transaction; commit it with the change it follows."""
+    values = dict(kind=kind, key=key, payload=json.dumps(payload or {}),
+                  run_after=datetime.utcnow() + timedelta(seconds=delay))
+    upsert = UPSERTS.get(db.engine.dialect.name)
+    if key is not None and upsert is not None:
+        statement = upsert(Job).values(**values).on_conflict_do_nothing(
+            index_elements=[Job.kind, Job.key], index_where=Job.status == 'queued')
+    else:
+        statement = insert(Job).values(**values)
+    db.session.execute(statement)
+
+
+# Running jobs
+# --------------------------------------------------------------------------
+
+def claim(limit):
+    """Lease up to `limit` due jobs, oldest first."""
+    now = datetime.utcnow()
+    due = (Job.status.in_(('queued', 'running')), Job.run_after <= now)
+    # SKIP LOCKED keeps PostgreSQL workers apart; SQLite serializes the UPDATE itself
+    ids = select(Job.job_id).where(*due).order_by(Job.run_after, Job.job_id).limit(limit) \
+        .with_for_update(skip_locked=True)
+    lease = timedelta(seconds=current_app.config.get('JOB_LEASE_SECONDS', LEASE_SECONDS))
+    rows = db.session.execute(
+        update(Job).where(Job.job_id.in_(ids.scalar_subquery()), *due)
+        .values(status='running', run_after=now + lease, attempts=Job.attempts + 1)
+        .returning(Job.job_id, Job.kind, Job.payload, Job.attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return sorted(rows)
+
+
+def run(kind, jobs):
+    """Run one handler over jobs in a transaction that also deletes them. False if it raised."""
+    try:
+        after_commit = HANDLERS[kind]([json.loads(job.payload) for job in jobs])
+        db.session.execute(delete(Job).where(Job.job_id.in_([job.job_id for job in jobs])))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if len(jobs) == 1:
+            failed(jobs[0], traceback.format_exc())
+        return False
+    if after_commit:
+        after_commit()
+    return True
+
+
+def failed(job, error):
+    config = current_app.config
+    if job.attempts >= config.get('JOB_MAX_ATTEMPTS', MAX_ATTEMPTS):
+        values = dict(status='dead')
+        current_app.logger.error('Job %s (%s) failed for good:\n%s', job.job_id, job.kind, error)
+    else:
+        # Stay leased until the retry is due, so the key stays free for new work
+        delay = config.get('JOB_RETRY_DELAY', RETRY_DELAY) * 2 ** (job.attempts - 1)
+        values = dict(run_after=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.execute(update(Job).where(Job.job_id == job.job_id).values(last_error=error, **values))
+    db.session.commit()
+
+
+def run_pending(limit=None):
+    """Claim and run one batch of due jobs. Returns how many were claimed."""
+    jobs = claim(limit or current_app.config.get('JOB_BATCH_SIZE', BATCH_SIZE))
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+    for kind, batch in by_kind.items():
+        if kind not in HANDLERS:
+            for job in batch:
+                failed(job, f'No handler for job kind {kind!r}')
+        elif not run(kind, batch) and len(batch) > 1:
+            # Find the job that broke the batch and let the others through
+            for job in batch:
+                run(kind, [job])
+    return len(jobs)
+
+
+def drain():
+    """Run due jobs until none are left. Returns how many were claimed."""
+    total = 0
+    while True:
+        claimed = run_pending()
+        if not claimed:
+            return total
+        total += claimed
+
+
+def retry_dead():
+    """Give every dead job a fresh set of attempts. Returns how many were revived."""
+    # Revived as expired leases, which do not compete with queued jobs for their key
+    result = db.session.execute(update(Job).where(Job.status == 'dead').values(
+        status='running', attempts=0, run_after=datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount
+
+
+def stats():
+    rows = db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all()
+    return dict(rows)
+
+
+# Workers
+# --------------------------------------------------------------------------
+
+class JobWorker:
+    """Threads that run due jobs, woken by kick() or every poll interval."""
+
+    def __init__(self, app, threads=1, interval=POLL_INTERVAL, linger=LINGER_SECONDS):
+        self.app = app
+        self.interval = interval
+        self.linger = linger
+        self._wake = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f'job-worker-{number}', daemon=True)
+                         for number in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def kick(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            if self._wake.wait(self.interval):
+                time.sleep(self.linger)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while run_pending():
+                        pass
+            except Exception:
+                self.app.logger.exception('Job worker failed')
+
+
+def get_worker():
+    config = current_app.config
+    return app_state('jobs.worker', lambda: JobWorker(current_app._get_current_object(),
+                                                      threads=config.get('JOB_WORKERS', 1),
+                                                      interval=config.get('JOB_POLL_INTERVAL', POLL_INTERVAL),
+                                                      linger=config.get('JOB_LINGER_SECONDS', LINGER_SECONDS)))
+
+
+def kick():
+    """Called after a write commits: wake a worker, or run the jobs here with JOB_WORKERS = 0."""
+    if current_app.config.get('JOB_WORKERS') == 0:
+        drain()
+    else:
+        get_worker().kick()
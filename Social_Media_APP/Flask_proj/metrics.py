@@ -0,0 +1,237 @@
+"""Opt-in per-request SQL and timing instrumentation.
+
+Enable with METRICS=1 (app.config['METRICS']). Each response then carries a
+Server-Timing header (db, template and total time) and /_metrics serves
+per-endpoint aggregates in the Prometheus text format to scrapers that send
+`Authorization: Bearer <METRICS_TOKEN>` or connect from METRICS_ALLOWED_IPS;
+with neither configured it answers 404. The allowed addresses are matched
+against request.remote_addr, the client only when PROXY_FIX_HOPS matches the
+proxies in front of the app (see create_app). DB time covers
+statement execution, not fetching rows. Per-request state is bounded: at
+most MAX_TRACKED_STATEMENTS distinct statements and the SLOWEST_KEPT
+slowest ones are remembered.
+"""
+import heapq
+import hmac
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from flask import Response, abort, before_render_template, request, request_finished, request_started, \
+    request_tearing_down, template_rendered
+from sqlalchemy import event
+
+# A statement executed this many times in one request is reported as a likely N+1
+REPEAT_THRESHOLD = 5
+MAX_TRACKED_STATEMENTS = 200
+SLOWEST_KEPT = 3
+STATEMENT_LABEL_LENGTH = 160
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_started = None
+        self.statements = Counter()
+        self.slowest = []
+
+    def record_query(self, statement, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        if statement in self.statements or len(self.statements) < MAX_TRACKED_STATEMENTS:
+            self.statements[statement] += 1
+        if len(self.slowest) < SLOWEST_KEPT:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+    def repeated(self):
+        return {statement: count for statement, count in self.statements.items() if count >= REPEAT_THRESHOLD}
+
+    def server_timing(self, total):
+        return (f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries", '
+                f'tpl;dur={self.template_seconds * 1000:.1f}, total;dur={total * 1000:.1f}')
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.queries = 0
+        self.repeated_requests = 0
+        self.buckets = [0] * len(BUCKETS)
+        self.slowest = {}
+
+
+class Registry:
+    """Per-endpoint totals across requests, shared by all threads of the process."""
+
+    def __init__(self):
+        self.endpoints = defaultdict(EndpointStats)
+        self.caches = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, metrics, total):
+        with self._lock:
+            stats = self.endpoints[endpoint or 'none']
+            stats.requests += 1
+            stats.seconds += total
+            stats.db_seconds += metrics.db_seconds
+            stats.template_seconds += metrics.template_seconds
+            stats.queries += metrics.queries
+            stats.repeated_requests += bool(metrics.repeated())
+            for index, bound in enumerate(BUCKETS):
+                if total <= bound:
+                    stats.buckets[index] += 1
+            for seconds, statement in metrics.slowest:
+                label = ' '.join(statement.split())[:STATEMENT_LABEL_LENGTH]
+                stats.slowest[label] = max(seconds, stats.slowest.get(label, 0))
+            if len(stats.slowest) > SLOWEST_KEPT:
+                stats.slowest = dict(heapq.nlargest(SLOWEST_KEPT, stats.slowest.items(), key=lambda item: item[1]))
+
+    def register_cache(self, name, stats):
+        """Expose `stats()` (a dict of counters, see cache.LRUCache.stats) as app_cache_*."""
+        self.caches[name] = stats
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{format_labels(labels)} {value}' for labels, value in samples)
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            caches = list(self.caches.items())
+
+            def per_endpoint(attribute):
+                return [({'endpoint': endpoint}, round(getattr(stats, attribute), 6)) for endpoint, stats in endpoints]
+
+            lines.append('# HELP app_request_seconds Request duration.')
+            lines.append('# TYPE app_request_seconds histogram')
+            for endpoint, stats in endpoints:
+                labels = format_labels({'endpoint': endpoint})
+                for bound, count in zip(BUCKETS + ('+Inf',), stats.buckets + [stats.requests]):
+                    bucket_labels = format_labels({'endpoint': endpoint, 'le': bound})
+                    lines.append(f'app_request_seconds_bucket{bucket_labels} {count}')
+                lines.append(f'app_request_seconds_sum{labels} {stats.seconds:.6f}')
+                lines.append(f'app_request_seconds_count{labels} {stats.requests}')
+            metric('app_db_queries_total', 'counter', 'SQL statements executed.', per_endpoint('queries'))
+            metric('app_db_seconds_total', 'counter', 'Time spent in SQL statements.', per_endpoint('db_seconds'))
+            metric('app_template_seconds_total', 'counter', 'Time spent rendering templates.',
+                   per_endpoint('template_seconds'))
+            metric('app_repeated_statement_requests_total', 'counter',
+                   f'Requests that ran one statement at least {REPEAT_THRESHOLD} times (likely N+1).',
+                   per_endpoint('repeated_requests'))
+            metric('app_slow_query_seconds', 'gauge', 'Slowest statements seen per endpoint.', [
+                ({'endpoint': endpoint, 'statement': statement}, round(seconds, 6))
+                for endpoint, stats in endpoints
+                for statement, seconds in sorted(stats.slowest.items(), key=lambda item: item[1], reverse=True)
+            ])
+
+        cache_stats = [(name, stats()) for name, stats in caches]
+        for counter, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('size', 'gauge')):
+            samples = [({'cache': name}, stats[counter]) for name, stats in cache_stats if counter in stats]
+            if samples:
+                name = f'app_cache_{counter}' + ('_total' if kind == 'counter' else '')
+                metric(name, kind, f'Cache {counter}.', samples)
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+# A ContextVar rather than flask.g: the cursor hooks run for every statement and
+# must stay cheap, and they also fire outside requests (chat writer, CLI)
+_current = ContextVar('request_metrics', default=None)
+registry = Registry()
+
+
+def current():
+    return _current.get()
+
+
+def scraper_allowed(config):
+    token = config.get('METRICS_TOKEN')
+    if token and request.authorization and request.authorization.type == 'bearer':
+        return hmac.compare_digest(request.authorization.token or '', token)
+    return request.remote_addr in (config.get('METRICS_ALLOWED_IPS') or ())
+
+
+def install_metrics(app, engine):
+    """Hook SQLAlchemy and Flask signals and add the /_metrics endpoint."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.record_query(statement, seconds)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        started = exception_context.connection and exception_context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+    def on_request_started(sender, **extra):
+        _current.set(RequestMetrics())
+
+    def on_before_render(sender, template, context, **extra):
+        metrics = current()
+        if metrics is not None:
+            metrics.template_started = time.perf_counter()
+
+    def on_rendered(sender, template, context, **extra):
+        metrics = current()
+        if metrics is not None and metrics.template_started is not None:
+            metrics.template_seconds += time.perf_counter() - metrics.template_started
+            metrics.template_started = None
+
+    def on_request_finished(sender, response, **extra):
+        metrics = current()
+        if metrics is None:
+            return
+        total = time.perf_counter() - metrics.started
+        response.headers['Server-Timing'] = metrics.server_timing(total)
+        registry.observe(request.endpoint, metrics, total)
+        for statement, count in metrics.repeated().items():
+            app.logger.warning('%s ran the same statement %d times: %s', request.endpoint, count, statement)
+
+    def on_tearing_down(sender, **extra):
+        _current.set(None)
+
+    # Signals hold weak references by default; these closures only live here
+    request_started.connect(on_request_started, app, weak=False)
+    before_render_template.connect(on_before_render, app, weak=False)
+    template_rendered.connect(on_rendered, app, weak=False)
+    request_finished.connect(on_request_finished, app, weak=False)
+    request_tearing_down.connect(on_tearing_down, app, weak=False)
+
+    def metrics_view():
+        if not scraper_allowed(app.config):
+            abort(404)
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/_metrics', 'metrics', metrics_view)
@@ -0,0 +1,260 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in order, inside its own transaction, and is
+recorded in the schema_version table. Migrations are written to be safe on
+databases created by older db.create_all() calls, so `python db_test.py
+upgrade` brings any existing site.db up to date.
+
+A migration creates the tables and indexes of its own version, spelled out
+below, never the ones the models describe today: a model that gains a
+column or an index later must not change what an old migration does.
+"""
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, LargeBinary, MetaData, String, Table, Text, func,
+                        inspect, select, text)
+
+from Flask_proj import db, directory, search
+from Flask_proj.models import search_key
+
+schema_version = Table(
+    'schema_version', db.metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255)),
+    Column('applied_at', DateTime, default=datetime.utcnow),
+)
+
+MIGRATIONS = []
+
+# Tables as their migration created them
+# --------------------------------------------------------------------------
+
+frozen = MetaData()
+
+Table('user', frozen,
+      Column('id', Integer, primary_key=True),
+      Column('first_name', String(255)),
+      Column('last_name', String(255)),
+      Column('email', String(255), unique=True),
+      Column('profile_image', LargeBinary),
+      Column('password', String(255)))
+
+Table('friendship', frozen,
+      Column('id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('user.id')),
+      Column('friend_id', Integer, ForeignKey('user.id')),
+      Column('status', String(255)),
+      Column('created_at', DateTime))
+
+Table('friend_request', frozen,
+      Column('id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+      Column('friend_id', Integer, ForeignKey('user.id'), nullable=False),
+      Column('status', String(255)),
+      Column('created_at', DateTime, nullable=False))
+
+Table('post', frozen,
+      Column('post_id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('user.id')),
+      Column('content', String(255)),
+      Column('privacy', String(255)),
+      Column('created_at', DateTime))
+
+Table('chat', frozen,
+      Column('chat_id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('user.id')),
+      Column('friend_id', Integer, ForeignKey('user.id')),
+      Column('message_content', String(255)),
+      Column('sent_at', DateTime))
+
+Table('feed_entry', frozen,
+      Column('owner_id', Integer, ForeignKey('user.id'), primary_key=True),
+      Column('post_id', Integer, ForeignKey('post.post_id'), primary_key=True),
+      Column('author_id', Integer, ForeignKey('user.id')),
+      Column('created_at', DateTime))
+
+Table('version_stamp', frozen,
+      Column('name', String(64), primary_key=True),
+      Column('version', Integer, nullable=False))
+
+Table('job', frozen,
+      Column('job_id', Integer, primary_key=True),
+      Column('kind', String(64), nullable=False),
+      Column('key', String(128)),
+      Column('payload', Text, nullable=False),
+      Column('status', String(16), nullable=False),
+      Column('attempts', Integer, nullable=False),
+      Column('run_after', DateTime, nullable=False),
+      Column('last_error', Text),
+      Column('created_at', DateTime))
+
+Table('notification', frozen,
+      Column('notification_id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+      Column('actor_id', Integer, ForeignKey('user.id'), nullable=False),
+      Column('kind', String(32), nullable=False),
+      Column('created_at', DateTime, nullable=False),
+      Column('read_at', DateTime))
+
+
+def migration(version, description):
+    def register(apply):
+        MIGRATIONS.append((version, description, apply))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return apply
+    return register
+
+
+def add_column(connection, table_name, column_name, column_type, constraints=''):
+    """ALTER TABLE ADD COLUMN unless it exists; the type is compiled for the connection's database."""
+    columns = [column['name'] for column in inspect(connection).get_columns(table_name)]
+    if column_name not in columns:
+        ddl_type = column_type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN {column_name} {ddl_type} {constraints}'))
+
+
+def create_tables(connection, *names):
+    frozen.create_all(connection, tables=[frozen.tables[name] for name in names], checkfirst=True)
+
+
+def create_indexes(connection, *statements):
+    # IF NOT EXISTS rather than checkfirst, which cannot see SQLite expression indexes
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def delete_duplicates(connection, table_name, *columns):
+    table = frozen.tables[table_name]
+    keep = select(func.min(table.c.id)).group_by(*[table.c[column] for column in columns])
+    connection.execute(table.delete().where(table.c.id.not_in(keep.scalar_subquery())))
+
+
+@migration(1, 'create tables')
+def create_initial_tables(connection):
+    create_tables(connection, 'user', 'friendship', 'friend_request', 'post', 'chat', 'feed_entry')
+
+
+@migration(2, 'add user.avatar_hash')
+def add_avatar_hash(connection):
+    add_column(connection, 'user', 'avatar_hash', String(64))
+
+
+@migration(3, 'indexes for timeline, feed, chat and directory lookups')
+def add_lookup_indexes(connection):
+    create_indexes(
+        connection,
+        'CREATE INDEX IF NOT EXISTS ix_post_privacy_created_at ON post (privacy, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_post_user_id_created_at ON post (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_post_created_at ON post (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_feed_entry_owner_created_at ON feed_entry (owner_id, created_at, post_id)',
+        'CREATE INDEX IF NOT EXISTS ix_feed_entry_post_id ON feed_entry (post_id)',
+        'CREATE INDEX IF NOT EXISTS ix_chat_user_id_friend_id_sent_at ON chat (user_id, friend_id, sent_at)',
+        """CREATE INDEX IF NOT EXISTS ix_user_name_lower
+           ON "user" (lower(coalesce(last_name, '')), lower(coalesce(first_name, '')), id)""",
+        """CREATE INDEX IF NOT EXISTS ix_user_first_name_lower ON "user" (lower(coalesce(first_name, '')))""",
+        'CREATE INDEX IF NOT EXISTS ix_user_email_lower ON "user" (lower(email))',
+    )
+
+
+@migration(4, 'unique (user_id, friend_id) on friendships and friend requests')
+def add_friend_pair_constraints(connection):
+    delete_duplicates(connection, 'friendship', 'user_id', 'friend_id')
+    delete_duplicates(connection, 'friend_request', 'user_id', 'friend_id')
+    create_indexes(
+        connection,
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_friendship_user_id_friend_id ON friendship (user_id, friend_id)',
+        'CREATE INDEX IF NOT EXISTS ix_friendship_friend_id ON friendship (friend_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_friend_request_user_id_friend_id ON friend_request (user_id, friend_id)',
+        'CREATE INDEX IF NOT EXISTS ix_friend_request_friend_id_status ON friend_request (friend_id, status)',
+    )
+
+
+@migration(5, 'add post.updated_at')
+def add_post_updated_at(connection):
+    add_column(connection, 'post', 'updated_at', DateTime())
+    connection.execute(text('UPDATE post SET updated_at = created_at WHERE updated_at IS NULL'))
+    create_indexes(connection, 'CREATE INDEX IF NOT EXISTS ix_post_updated_at ON post (updated_at)')
+
+
+@migration(6, 'create version_stamp')
+def create_version_stamps(connection):
+    create_tables(connection, 'version_stamp')
+
+
+@migration(7, 'add user friend, post and pending request counters')
+def add_user_counters(connection):
+    for column in ('friend_count', 'post_count', 'pending_request_count'):
+        add_column(connection, 'user', column, Integer(), 'NOT NULL DEFAULT 0')
+    connection.execute(text(
+        'UPDATE "user" SET '
+        'friend_count = (SELECT count(*) FROM friendship WHERE friendship.user_id = "user".id), '
+        'post_count = (SELECT count(*) FROM post WHERE post.user_id = "user".id), '
+        'pending_request_count = (SELECT count(*) FROM friend_request '
+        "WHERE friend_request.friend_id = \"user\".id AND friend_request.status = 'pending')"
+    ))
+
+
+@migration(8, 'post search: ix_post_updated_at, the SQLite FTS5 index and planner statistics')
+def add_post_search(connection):
+    # Databases that were past migration 5 before the index was added there
+    create_indexes(connection, 'CREATE INDEX IF NOT EXISTS ix_post_updated_at ON post (updated_at)')
+    if connection.dialect.name == 'sqlite':
+        search.create_fts_index(connection)
+        # Lets SQLite look up search results by post_id instead of scanning every Public post
+        connection.exec_driver_sql('ANALYZE')
+
+
+@migration(9, 'create job and notification, index user.avatar_hash')
+def create_jobs(connection):
+    create_tables(connection, 'job', 'notification')
+    create_indexes(
+        connection,
+        'CREATE INDEX IF NOT EXISTS ix_user_avatar_hash ON "user" (avatar_hash)',
+        'CREATE INDEX IF NOT EXISTS ix_job_status_run_after ON job (status, run_after)',
+        """CREATE UNIQUE INDEX IF NOT EXISTS uq_job_queued_kind_key ON job (kind, "key") WHERE status = 'queued'""",
+        'CREATE INDEX IF NOT EXISTS ix_notification_user_id_created_at ON notification (user_id, created_at)',
+    )
+
+
+@migration(10, 'user name and email search keys, the SQLite FTS5 name index')
+def add_user_search_keys(connection):
+    for column in ('first_name_key', 'last_name_key', 'email_key'):
+        add_column(connection, 'user', column, String(255), "NOT NULL DEFAULT ''")
+    # Folded in Python: lower() in SQLite leaves non-ASCII letters as they are
+    rows = connection.execute(text('SELECT id, first_name, last_name, email FROM "user"')).all()
+    if rows:
+        connection.execute(
+            text('UPDATE "user" SET first_name_key = :first_name, last_name_key = :last_name, email_key = :email '
+                 'WHERE id = :id'),
+            [dict(id=row.id, first_name=search_key(row.first_name), last_name=search_key(row.last_name),
+                  email=search_key(row.email)) for row in rows])
+    for name in ('ix_user_name_lower', 'ix_user_first_name_lower', 'ix_user_email_lower'):
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    create_indexes(
+        connection,
+        'CREATE INDEX IF NOT EXISTS ix_user_name_key ON "user" (last_name_key, first_name_key, id)',
+        'CREATE INDEX IF NOT EXISTS ix_user_first_name_key ON "user" (first_name_key)',
+        'CREATE INDEX IF NOT EXISTS ix_user_email_key ON "user" (email_key)',
+    )
+    if connection.dialect.name == 'sqlite':
+        directory.create_fts_index(connection)
+
+
+def current_version(connection):
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(target=None):
+    """Apply pending migrations up to `target` (default: latest). Returns the applied versions."""
+    applied = []
+    with db.engine.begin() as connection:
+        version = current_version(connection)
+    for number, description, apply in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        with db.engine.begin() as connection:
+            apply(connection)
+            connection.execute(schema_version.insert().values(version=number, description=description))
+        applied.append((number, description))
+    return applied
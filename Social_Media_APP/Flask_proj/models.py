@@ -1,52 +1,121 @@
+import unicodedata
+from collections import namedtuple
 from datetime import datetime
-from flask import flash
-from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, ForeignKey
-from Flask_proj import db, login_manager
+from flask import flash, g, has_app_context
+from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, ForeignKey, Index, Text, exists, select
+from Flask_proj import db, login_manager, avatars, images, user_cache
 from flask_login import UserMixin
+from sqlalchemy.orm import deferred, load_only, validates
+
+# Viewer -> other user state; the request ids are None when there is no pending request
+Relationship = namedtuple('Relationship', ['friends', 'sent_request_id', 'received_request_id'])
+
+
+def search_key(value):
+    """Folded form of a name or email for the directory; SQLite's lower() only folds ASCII."""
+    return unicodedata.normalize('NFKC', value or '').casefold()
+
+
+def request_cached(key, loader):
+    """Memoize loader() on the request context so templates can call it freely."""
+    if not has_app_context():
+        return loader()
+    cache = g.setdefault('_model_cache', {})
+    if key not in cache:
+        cache[key] = loader()
+    return cache[key]
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(User, int(user_id))
 
 class User(db.Model, UserMixin):
     id = Column(Integer, primary_key=True)
     first_name = Column(String(255))
     last_name = Column(String(255))
     email = Column(String(255), unique=True)
-    profile_image = Column(LargeBinary)
+    # Legacy inline image bytes, see db_test.py migrate_avatars; never loaded unless asked for
+    profile_image = deferred(Column(LargeBinary))
+    avatar_hash = Column(String(64))
     password = Column(String(255))
+    # Recounted by the counters job after each write, repaired by counters.reconcile;
+    # deferred as a group so friend lists and post authors do not load them
+    friend_count = deferred(Column(Integer, nullable=False, server_default='0'), group='counters')
+    post_count = deferred(Column(Integer, nullable=False, server_default='0'), group='counters')
+    pending_request_count = deferred(Column(Integer, nullable=False, server_default='0'),
+                                     group='counters')
+    # search_key() of the names and email, kept in step by _set_search_key
+    first_name_key = Column(String(255), nullable=False, default='', server_default='')
+    last_name_key = Column(String(255), nullable=False, default='', server_default='')
+    email_key = Column(String(255), nullable=False, default='', server_default='')
 
     friendships = db.relationship('Friendship', foreign_keys='Friendship.user_id')
     friend_requests_sent = db.relationship('FriendRequest', foreign_keys='FriendRequest.user_id', backref='sender', lazy=True)
     friend_requests_received = db.relationship('FriendRequest', foreign_keys='FriendRequest.friend_id', backref='receiver', lazy=True)
     posts = db.relationship('Post', backref='user', lazy=True)
 
+    # Case-insensitive prefix search and ordering for the people directory
+    __table_args__ = (
+        Index('ix_user_name_key', 'last_name_key', 'first_name_key', 'id'),
+        Index('ix_user_first_name_key', 'first_name_key'),
+        Index('ix_user_email_key', 'email_key'),
+        # Checked before an unused avatar file is removed
+        Index('ix_user_avatar_hash', 'avatar_hash'),
+    )
+
     def __repr__(self):
         return f"User(id={self.id}, email='{self.email}')"
 
+    @validates('first_name', 'last_name', 'email')
+    def _set_search_key(self, name, value):
+        setattr(self, f'{name}_key', search_key(value))
+        return value
+
     def set_profile_image(self, image_path):
         if image_path:
-            with open(image_path, 'rb') as file:
-                image_data = file.read()
-            self.profile_image = image_data
+            store = avatars.get_store()
+            self.avatar_hash = store.put_file(image_path)
+            images.schedule_variants(store.root, self.avatar_hash)
 
     def send_friend_request(self, user):
-        friend_request = FriendRequest(user_id=self.id, friend_id=user.id, status='pending')
-        db.session.add(friend_request)
-        db.session.commit()
+        from Flask_proj import actions
+        actions.send_friend_request(self.id, user.id)
 
     def has_friend_request(self, user):
-        return FriendRequest.query.filter_by(user_id=self.id, friend_id=user.id, status='pending').first() is not None
+        return self.relationship_with(user).sent_request_id is not None
 
     def is_friends_with(self, user):
-        return Friendship.query.filter(
-            (Friendship.user_id == self.id) & (Friendship.friend_id == user.id) &
-            (Friendship.status == 'friends')
-        ).first() is not None
-    
+        return self.relationship_with(user).friends
+
+    def relationship_with(self, user):
+        return request_cached(('relationship', self.id, user.id), lambda: self._load_relationship(user))
+
+    def _load_relationship(self, user):
+        def pending(sender_id, receiver_id):
+            return select(FriendRequest.id).where(
+                FriendRequest.user_id == sender_id, FriendRequest.friend_id == receiver_id,
+                FriendRequest.status == 'pending'
+            ).limit(1).scalar_subquery()
+
+        friends = exists().where(
+            Friendship.user_id == self.id, Friendship.friend_id == user.id, Friendship.status == 'friends')
+        row = db.session.execute(select(friends, pending(self.id, user.id), pending(user.id, self.id))).one()
+        return Relationship(*row)
+
+    def friend_list(self):
+        """All friends in one query, without their image columns."""
+        return request_cached(('friends', self.id), lambda: User.query.options(
+            load_only(User.id, User.first_name, User.last_name, User.avatar_hash)
+        ).join(Friendship, Friendship.friend_id == User.id).filter(
+            Friendship.user_id == self.id
+        ).order_by(User.first_name, User.last_name).all())
+
     def get_friend_display(self, friendship):
         if friendship.user_id == self.id:
-            return User.query.filter_by(id=friendship.friend_id).first()
+            friends = request_cached(('friends_by_id', self.id),
+                                     lambda: {friend.id: friend for friend in self.friend_list()})
+            return friends.get(friendship.friend_id)
 
         
     # def handle_friend_request(self, request_id, action):
@@ -66,6 +135,11 @@ class Friendship(db.Model):
     status = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('uq_friendship_user_id_friend_id', 'user_id', 'friend_id', unique=True),
+        Index('ix_friendship_friend_id', 'friend_id'),
+    )
+
     def __repr__(self):
         return f"Friendship(id={self.id}, user_id={self.user_id}, friend_id={self.friend_id})"
 
@@ -79,6 +153,11 @@ class FriendRequest(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref=db.backref('sent_friend_requests', lazy=True))
     friend = db.relationship('User', foreign_keys=[friend_id], backref=db.backref('received_friend_requests', lazy=True))
 
+    __table_args__ = (
+        Index('uq_friend_request_user_id_friend_id', 'user_id', 'friend_id', unique=True),
+        Index('ix_friend_request_friend_id_status', 'friend_id', 'status'),
+    )
+
     def __repr__(self):
         return f"FriendRequest(id={self.id}, user_id={self.user_id}, friend_id={self.friend_id})"
 
@@ -90,6 +169,16 @@ class Post(db.Model):
     content = Column(String(255))
     privacy = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Part of the rendered-card cache key, see fragments.py
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_post_privacy_created_at', 'privacy', 'created_at'),
+        Index('ix_post_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_post_created_at', 'created_at'),
+        # Lets search.MemoryIndex pick up new and edited posts
+        Index('ix_post_updated_at', 'updated_at'),
+    )
 
     def __repr__(self):
         return f"Post(post_id={self.post_id}, user_id={self.user_id})"
@@ -101,5 +190,76 @@ class Chat(db.Model):
     message_content = Column(String(255))
     sent_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_chat_user_id_friend_id_sent_at', 'user_id', 'friend_id', 'sent_at'),
+    )
+
     def __repr__(self):
         return f"Chat(chat_id={self.chat_id}, user_id={self.user_id}, friend_id={self.friend_id})"
+
+
+class FeedEntry(db.Model):
+    owner_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    post_id = Column(Integer, ForeignKey('post.post_id'), primary_key=True)
+    author_id = Column(Integer, ForeignKey('user.id'))
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_feed_entry_owner_created_at', 'owner_id', 'created_at', 'post_id'),
+        Index('ix_feed_entry_post_id', 'post_id'),
+    )
+
+    def __repr__(self):
+        return f"FeedEntry(owner_id={self.owner_id}, post_id={self.post_id})"
+
+
+class VersionStamp(db.Model):
+    """Counters bumped by the write routes; conditional GETs compare them instead of querying posts."""
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+    def __repr__(self):
+        return f"VersionStamp(name='{self.name}', version={self.version})"
+
+
+class Job(db.Model):
+    """Deferred work queued by the write routes, see jobs.py.
+
+    status is 'queued', 'running' (leased until run_after) or 'dead'."""
+    job_id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    # Queued jobs with the same kind and key are coalesced into one
+    key = Column(String(128))
+    payload = Column(Text, nullable=False, default='{}')
+    status = Column(String(16), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_job_status_run_after', 'status', 'run_after'),
+        Index('uq_job_queued_kind_key', 'kind', 'key', unique=True,
+              sqlite_where=status == 'queued', postgresql_where=status == 'queued'),
+    )
+
+    def __repr__(self):
+        return f"Job(job_id={self.job_id}, kind='{self.kind}', status='{self.status}')"
+
+
+class Notification(db.Model):
+    notification_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    actor_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    kind = Column(String(32), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    read_at = Column(DateTime)
+
+    actor = db.relationship('User', foreign_keys=[actor_id])
+
+    __table_args__ = (
+        Index('ix_notification_user_id_created_at', 'user_id', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"Notification(notification_id={self.notification_id}, user_id={self.user_id}, kind='{self.kind}')"
@@ -0,0 +1,58 @@
+"""Notifications for friend requests received and accepted.
+
+Rows are written by the 'notify' job, batched with whatever else the worker
+picked up, so sending or accepting a request only adds a job to its own
+transaction. A notification that repeats an unread one (a request cancelled
+and sent again) is dropped, whether it is still queued or already written.
+"""
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import load_only, joinedload
+
+from Flask_proj import db, jobs
+from Flask_proj.models import Notification, User
+
+PAGE_SIZE = 50
+
+MESSAGES = {
+    'friend_request': 'sent you a friend request',
+    'friend_accepted': 'accepted your friend request',
+}
+
+
+def notify_later(user_id, actor_id, kind):
+    """Queue a notification for user_id in the current transaction."""
+    jobs.enqueue('notify', {'user_id': user_id, 'actor_id': actor_id, 'kind': kind},
+                 key=f'{user_id}:{actor_id}:{kind}')
+
+
+@jobs.handler('notify')
+def write_notifications(payloads):
+    wanted = {(payload['user_id'], payload['actor_id'], payload['kind']) for payload in payloads}
+    unread = set(db.session.execute(
+        select(Notification.user_id, Notification.actor_id, Notification.kind).where(
+            Notification.user_id.in_({user_id for user_id, _, _ in wanted}), Notification.read_at.is_(None))
+    ).all())
+    now = datetime.utcnow()
+    rows = [dict(user_id=user_id, actor_id=actor_id, kind=kind, created_at=now)
+            for user_id, actor_id, kind in sorted(wanted - unread)]
+    if rows:
+        db.session.execute(insert(Notification), rows)
+
+
+def recent(user_id, limit=PAGE_SIZE):
+    return Notification.query.options(
+        joinedload(Notification.actor).options(
+            load_only(User.id, User.first_name, User.last_name, User.avatar_hash))
+    ).filter_by(user_id=user_id).order_by(
+        Notification.created_at.desc(), Notification.notification_id.desc()
+    ).limit(limit).all()
+
+
+def mark_read(user_id, notification_ids):
+    """Mark the listed notifications read; ids of other users' notifications are ignored."""
+    db.session.execute(update(Notification).where(
+        Notification.user_id == user_id, Notification.notification_id.in_(notification_ids),
+        Notification.read_at.is_(None)).values(read_at=datetime.utcnow()))
+    db.session.commit()
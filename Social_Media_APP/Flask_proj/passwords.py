@@ -0,0 +1,80 @@
+"""bcrypt hashing in a bounded process pool, so a login burst cannot pin every request thread.
+
+At most PASSWORD_WORKERS hashes run at once and PASSWORD_QUEUE_LIMIT more
+may queue; a caller that cannot get a slot within PASSWORD_QUEUE_TIMEOUT
+seconds gets PasswordServiceBusy instead of piling up behind a
+credential-stuffing run. Set PASSWORD_WORKERS = 0 to hash inline.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from flask_bcrypt import Bcrypt
+
+from Flask_proj import app_state
+
+DEFAULT_ROUNDS = 12
+
+# Used inside the worker processes, where there is no app to configure it
+_bcrypt = Bcrypt()
+
+
+class PasswordServiceBusy(RuntimeError):
+    pass
+
+
+def _hash(password, rounds):
+    return _bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    try:
+        return _bcrypt.check_password_hash(pw_hash, password)
+    except ValueError:  # not a bcrypt hash, or a password bcrypt refuses
+        return False
+
+
+def get_pool():
+    """(process pool, semaphore bounding the running and queued hashes) for the current app."""
+    config = current_app.config
+
+    def make_pool():
+        workers = config.get('PASSWORD_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+        slots = threading.BoundedSemaphore(workers + config.get('PASSWORD_QUEUE_LIMIT', 32))
+        return ProcessPoolExecutor(max_workers=workers), slots
+    return app_state('passwords.pool', make_pool)
+
+
+def run(func, *args):
+    if current_app.config.get('PASSWORD_WORKERS') == 0:
+        return func(*args)
+    pool, slots = get_pool()
+    if not slots.acquire(timeout=current_app.config.get('PASSWORD_QUEUE_TIMEOUT', 5)):
+        raise PasswordServiceBusy('Too many sign-ins right now. Please try again in a moment.')
+    try:
+        return pool.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+def rounds():
+    return current_app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+
+
+def hash_password(password):
+    return run(_hash, password, rounds())
+
+
+def check_password(pw_hash, password):
+    if not pw_hash:
+        return False
+    return run(_check, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """True when pw_hash was made with a different work factor than BCRYPT_LOG_ROUNDS."""
+    try:
+        return int(pw_hash.split('$')[2]) != rounds()
+    except (AttributeError, IndexError, ValueError):
+        return True
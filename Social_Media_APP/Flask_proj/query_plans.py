@@ -0,0 +1,71 @@
+"""EXPLAIN QUERY PLAN guard for the hot queries (SQLite only).
+
+`python db_test.py check_query_plans` exits non-zero when any of these
+queries falls back to a full table scan, e.g. after an index is dropped or a
+query is rewritten so it no longer matches one.
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select
+
+from Flask_proj import db, directory, graph, stamps, timeline
+from Flask_proj.models import User, Friendship, FriendRequest, Post, Chat, FeedEntry
+
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+
+def hot_queries(viewer_id=1, other_id=2):
+    before = (datetime.utcnow(), 2 ** 31)
+
+    def timeline_page(mode):
+        return select(Post.post_id).where(
+            timeline.visibility_filter(viewer_id, mode), timeline.before_filter(before)
+        ).order_by(Post.created_at.desc(), Post.post_id.desc()).limit(timeline.DEFAULT_LIMIT + 1)
+
+    last_name, first_name = directory.sort_keys()
+    return {
+        'friend ids': timeline.friend_ids_query(viewer_id),
+        'friends version': stamps.friends_version_query(viewer_id, 'posts', 'profile'),
+        'friendship pair': select(Friendship.id).where(
+            Friendship.user_id == viewer_id, Friendship.friend_id == other_id, Friendship.status == 'friends'),
+        'friend list': select(User.id).join(Friendship, Friendship.friend_id == User.id).where(
+            Friendship.user_id == viewer_id),
+        'friend requests received': select(FriendRequest.id).where(
+            FriendRequest.friend_id == viewer_id, FriendRequest.status == 'pending'),
+        'pending requests': graph.pending_ids_query(viewer_id),
+        'friend request pair': select(FriendRequest.id).where(
+            FriendRequest.user_id == viewer_id, FriendRequest.friend_id == other_id,
+            FriendRequest.status == 'pending'),
+        'profile posts': select(Post.post_id).where(Post.user_id == other_id).order_by(
+            Post.created_at.desc()).limit(20),
+        'timeline all': timeline_page('all'),
+        'timeline friends': timeline_page('friends'),
+        'timeline public': timeline_page('public'),
+        'feed inbox page': select(FeedEntry.post_id).where(FeedEntry.owner_id == viewer_id).order_by(
+            FeedEntry.created_at.desc(), FeedEntry.post_id.desc()).limit(timeline.DEFAULT_LIMIT + 1),
+        'chat history': select(Chat.chat_id).where(or_(
+            and_(Chat.user_id == viewer_id, Chat.friend_id == other_id),
+            and_(Chat.user_id == other_id, Chat.friend_id == viewer_id)
+        )).order_by(Chat.sent_at.desc(), Chat.chat_id.desc()).limit(31),
+        'directory search': select(User.id).where(
+            User.id != viewer_id, directory.not_connected(viewer_id), directory.search_filter('smi')
+        ).order_by(last_name, first_name, User.id).limit(directory.DEFAULT_LIMIT + 1),
+    }
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    return [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)]
+
+
+def check(queries=None):
+    """Return {name: [plan lines]} for every query whose plan contains a full table scan."""
+    failures = {}
+    with db.engine.connect() as connection:
+        for name, statement in (queries or hot_queries()).items():
+            plan = explain(connection, statement)
+            if any(FULL_SCAN.match(line) for line in plan):
+                failures[name] = plan
+    return failures
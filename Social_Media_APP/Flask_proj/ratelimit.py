@@ -0,0 +1,51 @@
+"""In-process token-bucket rate limiting.
+
+Buckets live in each worker process, so with N workers a client can get up
+to N times the configured rate; that is enough to blunt a credential-stuffing
+burst without a shared store.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from Flask_proj import app_state
+
+
+class TokenBucketLimiter:
+    """`capacity` requests at once per key, refilled at capacity / per_seconds tokens a second."""
+
+    def __init__(self, capacity, per_seconds, max_keys=100000):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Spend one token for key. Returns 0 when allowed, else seconds until the next token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            # Least recently seen keys go first; a forgotten key simply starts full again
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+def get_limiter(name):
+    """The limiter configured as app.config['RATE_LIMITS'][name]."""
+    capacity, per_seconds = current_app.config['RATE_LIMITS'][name]
+    return app_state(f'ratelimit.{name}', lambda: TokenBucketLimiter(capacity, per_seconds))
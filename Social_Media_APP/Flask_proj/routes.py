@@ -1,22 +1,20 @@
-import base64
-
-from flask import render_template, redirect, url_for, flash, request, Blueprint
-from sqlalchemy import and_, desc, or_
-from werkzeug.utils import secure_filename
-from Flask_proj import app, db, bcrypt
-from Flask_proj.forms import RegistrationForm, LoginForm, PostForm, FriendRequestForm, ChatForm, EditProfileForm
-from Flask_proj.models import User, Friendship, FriendRequest, Post, Chat
+import json
+import math
+import time
+
+from flask import render_template, redirect, url_for, flash, request, Blueprint, abort, send_file, jsonify, Response, \
+    make_response, stream_with_context
+from Flask_proj import db, actions, avatars, chat, directory, feed, fragments, graph, images, notifications, \
+    passwords, ratelimit, search, sessions, stamps, timeline
+from Flask_proj.forms import RegistrationForm, LoginForm, PostForm, ChatForm, EditProfileForm
+from Flask_proj.models import User, FriendRequest, Post
 from flask_login import current_user, login_user, logout_user, login_required
+from sqlalchemy.orm import load_only, undefer_group
 import os
 
-UPLOAD_FOLDER = 'static/images/'
+main = Blueprint('main', __name__)
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-users = Blueprint(
-    'users',
-    __name__,
-    url_prefix='/users'
-)
 
 def allowed_image(filename):
     allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
@@ -25,11 +23,11 @@ def allowed_image(filename):
 
 # Authentication
 # --------------------------------------------------------------------------
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     form = RegistrationForm()
     if form.validate_on_submit():
@@ -38,304 +36,401 @@ def register():
         email = form.email.data
         password = form.password.data
 
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        try:
+            hashed_password = passwords.hash_password(password)
+        except passwords.PasswordServiceBusy as error:
+            flash(str(error), 'error')
+            return render_template('register.html', form=form), 503, {'Retry-After': '5'}
 
         if 'profile_picture' in request.files:
             profile_picture = request.files['profile_picture']
             if profile_picture.filename != '' and allowed_image(profile_picture.filename):
-                filename = secure_filename(profile_picture.filename)
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                profile_picture.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                profile_image = open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'rb').read()
+                try:
+                    avatar_hash = images.save_upload(profile_picture)
+                except images.UploadTooLarge as error:
+                    flash(str(error), 'error')
+                    return redirect(url_for('main.register'))
             else:
                 flash('Invalid file type. Please upload a valid image file.', 'error')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
         else:
-            profile_image = b''
+            avatar_hash = None
 
         user = User(first_name=first_name, last_name=last_name, email=email,
-                    profile_image=profile_image, password=hashed_password)
+                    avatar_hash=avatar_hash, password=hashed_password)
         db.session.add(user)
         db.session.commit()
         flash('Registration successful! You can now login.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template('register.html', form=form)
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     form = LoginForm()
     if form.validate_on_submit():
         email = form.email.data
         password = form.password.data
 
+        email_key = (email.lower(), request.remote_addr)
+        retry_after = max(ratelimit.get_limiter('login_ip').take(request.remote_addr),
+                          ratelimit.get_limiter('login_email').take(email_key))
+        if retry_after:
+            flash('Too many sign-in attempts. Please wait a minute and try again.', 'error')
+            return render_template('login.html', form=form), 429, {'Retry-After': str(math.ceil(retry_after))}
+
         user = User.query.filter_by(email=email).first()
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        try:
+            valid = user is not None and passwords.check_password(user.password, password)
+            if valid and passwords.needs_rehash(user.password):
+                user.password = passwords.hash_password(password)
+                db.session.commit()
+        except passwords.PasswordServiceBusy as error:
+            flash(str(error), 'error')
+            return render_template('login.html', form=form), 503, {'Retry-After': '5'}
+
+        if valid:
+            ratelimit.get_limiter('login_email').reset(email_key)
             login_user(user)
+            sessions.regenerate()
             next_page = request.args.get('next')
             if next_page:
                 return redirect(next_page)
             else:
-                return redirect(url_for('home'))
+                return redirect(url_for('main.home'))
         else:
             flash('Invalid email or password. Please try again.', 'error')
 
     return render_template('login.html', form=form)
 
-@app.route('/logout')
+@main.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    sessions.regenerate()
+    return redirect(url_for('main.login'))
 
 
 
 
 #     return render_template('home.html', form=form, posts=posts, friend_requests=friend_requests, privacy_mode=privacy_mode)
-@app.route('/home', methods=['GET', 'POST'])
+@main.route('/home', methods=['GET', 'POST'])
 @login_required
 def home():
-    friend_requests = FriendRequest.query.filter_by(friend_id=current_user.id).all()
-    form = PostForm()
     privacy_mode = request.args.get('privacy_mode', 'all')  # Get the privacy mode from the query parameter
+    before = timeline.parse_cursor(request.args.get('before'))
+    limit = timeline.parse_limit(request.args.get('limit'))
+    etag = None
+    if request.method == 'GET':
+        etag = stamps.home_etag(current_user.id, privacy_mode, before, limit)
+        if stamps.not_modified(etag):
+            return stamps.tag_response(Response(status=304), etag)
+
+    form = PostForm()
 
     if form.validate_on_submit():
-        content = form.content.data
-        privacy = form.privacy.data
-        post = Post(user_id=current_user.id, content=content, privacy=privacy)
-        db.session.add(post)
-        db.session.commit()
+        actions.create_post(current_user.id, form.content.data, form.privacy.data)
         flash('Post created successfully!', 'success')
-        return redirect(url_for('home', privacy_mode=privacy_mode))
-    
-    user_ids = [friendship.user_id for friendship in current_user.friendships]
-    friend_ids = [friendship.friend_id for friendship in current_user.friendships]
-    if privacy_mode == 'all':
-        # Fetch public posts, posts of friends with privacy set to "Public," and posts of the current user
-        posts = Post.query.filter(
-            or_(
-                (Post.privacy == 'Public'),
-                and_(
-                    (Post.privacy == 'Friends'),
-                    # (Post.user_id.in_(friend_ids))
-                    or_(
-                    (Post.user_id.in_(friend_ids)),
-                    (Post.user_id.in_(user_ids))
-                    )
-                ),
-                and_(
-                    (Post.privacy == 'Only Me'),
-                    (Post.user_id == current_user.id)
-                )
-            )
-        ).order_by(desc(Post.created_at))
-
-    elif privacy_mode == 'friends':
-        # Fetch posts of friends with privacy set to "Public" or "Friends"
-        posts = Post.query.filter(
-            or_(
-            Post.user_id.in_(friend_ids),
-            Post.user_id.in_(user_ids)
-            ),
-            or_(
-            Post.privacy == 'Public',
-            Post.privacy == 'Friends'
-            )
-        ).order_by(desc(Post.created_at)).all()
-
+        return redirect(url_for('main.home', privacy_mode=privacy_mode))
 
+    if privacy_mode == 'friends':
+        posts, next_cursor = feed.friends_timeline(current_user.id, before, limit)
     else:
-        # Fetch public posts and posts of the current user
-        posts = Post.query.filter(
-            or_(
-                (Post.privacy == 'Public'),
-                (Post.privacy == 'Only Me' and Post.user_id == current_user.id)
-            )
-        ).order_by(desc(Post.created_at))
-    return render_template('home.html', form=form, posts=posts, friend_requests=friend_requests, privacy_mode=privacy_mode)
+        posts, next_cursor = timeline.timeline(current_user.id, privacy_mode, before, limit)
+    fragments.prefetch(posts)
+    response = make_response(render_template('home.html', form=form, posts=posts, privacy_mode=privacy_mode,
+                                             next_cursor=next_cursor, limit=limit))
+    return stamps.tag_response(response, etag) if etag else response
 
 
 
-@app.route('/profile/<int:user_id>')
+@main.route('/profile/<int:user_id>')
 @login_required
 def profile(user_id):
-    user = User.query.get_or_404(user_id)
+    etag = stamps.profile_etag(current_user.id, user_id)
+    if stamps.not_modified(etag):
+        return stamps.tag_response(Response(status=304), etag)
+    user = User.query.options(undefer_group('counters')).get_or_404(user_id)
 
-    if user_id == current_user.id:
-        posts = Post.query.filter_by(user_id=user_id).order_by(Post.created_at.desc())
-    elif Friendship.query.filter_by(user_id=current_user.id, friend_id=user_id).first():
-        posts = Post.query.filter_by(user_id=user_id).order_by(Post.created_at.desc())
-    else:
-        posts = Post.query.filter_by(user_id=user_id, privacy='Public').order_by(Post.created_at.desc())
+    posts = timeline.profile_posts(current_user, user).order_by(Post.created_at.desc())
 
-    return render_template('profile.html', user=user, posts=posts, base64=base64)
+    mutual_friends = graph.get_graph().mutual_count(current_user.id, user_id) if user_id != current_user.id else None
+    response = make_response(render_template('profile.html', user=user, posts=posts, mutual_friends=mutual_friends))
+    return stamps.tag_response(response, etag)
 
 
-@app.template_filter('b64encode')
-def b64encode_filter(data):
-    return base64.b64encode(data).decode('utf-8')
+main.add_app_template_global(avatars.avatar_url)
+main.add_app_template_global(fragments.post_card)
+main.add_app_template_global(fragments.profile_sidebar)
+main.add_app_template_global(fragments.profile_details)
+
+
+# Content-addressed: the digest alone names the image, and stays valid until the cleanup job removes it
+@main.route('/avatar/<digest>')
+@login_required
+def avatar(digest):
+    store = avatars.get_store()
+    if not store.exists(digest):
+        abort(404)
+    path, etag, final = store.path(digest), digest, True
+    size = request.args.get('s', type=int)
+    if size in images.VARIANT_SIZES:
+        if os.path.exists(store.variant_path(digest, size)):
+            path, etag = store.variant_path(digest, size), f'{digest}-{size}'
+        else:
+            # Serve the original briefly until the worker pool has written the variant; queue it
+            # again in case its job failed or was lost with the process that ran it
+            images.schedule_variants(store.root, digest)
+            final = False
+    # The URL changes whenever the image does, so browsers never need to revalidate
+    response = send_file(path, mimetype=avatars.sniff_mimetype(path), etag=etag, conditional=True,
+                         max_age=365 * 24 * 3600 if final else 60)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = final
+    return response
 
 # Flask route
-@app.route('/edit_profile', methods=['GET', 'POST'])
+@main.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     form = EditProfileForm(obj=current_user)  # Load form with current user data
 
     if form.validate_on_submit():
+        old_avatar_hash = current_user.avatar_hash
         form.populate_obj(current_user)  # Update current user object with form data
         if form.profile_picture.data:
             # Process profile picture upload if provided
             profile_picture = form.profile_picture.data
             if profile_picture.filename != '' and allowed_image(profile_picture.filename):
-                filename = secure_filename(profile_picture.filename)
-                profile_picture.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                current_user.profile_image = open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'rb').read()
+                try:
+                    current_user.avatar_hash = images.save_upload(profile_picture)
+                except images.UploadTooLarge as error:
+                    flash(str(error), 'error')
+                    return redirect(url_for('main.edit_profile'))
             else:
                 flash('Invalid file type. Please upload a valid image file.', 'error')
-                return redirect(url_for('edit_profile'))
-        db.session.commit()
+                return redirect(url_for('main.edit_profile'))
+        actions.profile_updated(current_user, old_avatar_hash)
         flash('Profile updated successfully!', 'success')
-        return redirect(url_for('profile', user_id=current_user.id))
+        return redirect(url_for('main.profile', user_id=current_user.id))
 
     return render_template('edit_profile.html', form=form)
 
 
-@users.route('/<int:user_id>', methods=['GET'])
-@login_required
-def view_profile(user_id):
-    user = User.query.get_or_404(user_id)
-    return render_template('profile.html', user=user)
-
-
 # Friends & Friend Requests
 # --------------------------------------------------------------------------
 
-@app.route('/send_friend_request/<int:user_id>', methods=['POST'])
+@main.route('/send_friend_request/<int:user_id>', methods=['POST'])
 @login_required
 def send_friend_request(user_id):
     user = User.query.get(user_id)
     if user and not current_user.is_friends_with(user):
-        friend_request = FriendRequest.query.filter_by(user_id=current_user.id, friend_id=user.id, status='pending').first()
-        if not friend_request:
-            friend_request = FriendRequest(user_id=current_user.id, friend_id=user.id, status='pending')
-            db.session.add(friend_request)
-            db.session.commit()
-    return redirect(url_for('profile', user_id=user_id))
+        actions.send_friend_request(current_user.id, user.id)
+    return redirect(url_for('main.profile', user_id=user_id))
 
 
-@app.route('/cancel_friend_request/<int:request_id>', methods=['POST'])
+@main.route('/cancel_friend_request/<int:request_id>', methods=['POST'])
 @login_required
 def cancel_friend_request(request_id):
     friend_request = FriendRequest.query.get(request_id)
     if friend_request:
-        db.session.delete(friend_request)
-        db.session.commit()
-        return redirect(url_for('profile', user_id=friend_request.friend_id))
+        actions.drop_friend_requests([friend_request])
+        return redirect(url_for('main.profile', user_id=friend_request.friend_id))
     return redirect(request.referrer)
  
 
-@app.route('/friend_requests', methods=['GET', 'POST'])
+@main.route('/friend_requests', methods=['GET', 'POST'])
 @login_required
 def friend_requests():
     friend_requests_received = FriendRequest.query.filter_by(friend_id=current_user.id, status='pending').all()
-    users = User.query.filter(User.id != current_user.id).all()
-    
-    print(users)
-    return render_template('friend_requests.html', friend_requests=friend_requests_received, users = users)
+    q = request.args.get('q', '')
+    after = directory.decode_cursor(request.args.get('after'))
+    users, next_cursor = directory.search_people(current_user.id, q, after)
+
+    suggestions = graph.suggestions(current_user.id, k=6)
+    suggested_users = {user.id: user for user in User.query.options(
+        load_only(User.id, User.first_name, User.last_name, User.avatar_hash)
+    ).filter(User.id.in_([user_id for user_id, _ in suggestions]))}
+    suggestions = [(suggested_users[user_id], mutual) for user_id, mutual in suggestions if user_id in suggested_users]
+    return render_template('friend_requests.html', friend_requests=friend_requests_received, users=users,
+                           q=q, next_cursor=next_cursor, suggestions=suggestions)
 
 
-@app.route('/handle_friend_request/<int:request_id>/<action>', methods=['POST'])
+@main.route('/handle_friend_request/<int:request_id>/<action>', methods=['POST'])
 @login_required
 def handle_friend_request( request_id, action):
     friend_request = FriendRequest.query.get_or_404(request_id)
     if action == 'accept':
-        friends = Friendship(user_id=friend_request.user_id, friend_id=friend_request.friend_id, status='friends')
-        friend_user_first = Friendship(user_id=friend_request.friend_id, friend_id=friend_request.user_id, status='friends')
-        db.session.add(friends)
-        db.session.add(friend_user_first)
-        db.session.delete(friend_request)
-        db.session.commit()
+        actions.accept_friend_requests([friend_request])
         flash('Friend request accepted!', 'success')
 
     if action == 'decline':
-        db.session.delete(friend_request)
-        db.session.commit()
+        actions.drop_friend_requests([friend_request])
         flash('Friend request Decline!', 'success')
     return redirect(request.referrer)
 
-@app.route('/remove_friend/<int:user_id>/<int:friend_id>', methods=['POST'])
+@main.route('/remove_friend/<int:user_id>/<int:friend_id>', methods=['POST'])
 @login_required
 def remove_friend(user_id, friend_id):
-    with app.app_context():
-        friendship = Friendship.query.filter_by(user_id=user_id, friend_id=friend_id).first()
-        friendship_reverse = Friendship.query.filter_by(user_id=friend_id, friend_id=user_id).first()
-        if friendship:
-            db.session.delete(friendship)
-        if friendship_reverse:
-            db.session.delete(friendship_reverse)
-
-        db.session.commit()
+    actions.remove_friend(user_id, friend_id)
     return redirect(request.referrer)
 
 
+# Chat
+# --------------------------------------------------------------------------
+
+CHAT_WAIT_SECONDS = 25
+CHAT_STREAM_SECONDS = 300
+
+
+def chat_friend_or_403(friend_id):
+    friend = User.query.get_or_404(friend_id)
+    if not current_user.is_friends_with(friend):
+        abort(403)
+    return friend
+
+
+@main.route('/chat')
+@login_required
+def chat_index():
+    return render_template('chat.html', friends=current_user.friend_list())
+
+
+@main.route('/chat/<int:friend_id>', methods=['GET', 'POST'])
+@login_required
+def conversation(friend_id):
+    friend = chat_friend_or_403(friend_id)
+    form = ChatForm()
+    if form.validate_on_submit():
+        message = chat.send_message(current_user, friend.id, form.message_content.data)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(message)
+        return redirect(url_for('main.conversation', friend_id=friend.id))
+
+    # Read the newest id before the history so the stream resumes without gaps
+    last_seq = chat.last_id(chat.conversation_key(current_user.id, friend.id))
+    before = timeline.parse_cursor(request.args.get('before'))
+    messages, next_cursor = chat.history(current_user.id, friend.id, before)
+    return render_template('conversation.html', friend=friend, form=form, messages=messages[::-1],
+                           next_cursor=next_cursor, last_seq=last_seq)
+
+
+@main.route('/chat/<int:friend_id>/poll')
+@login_required
+def poll_messages(friend_id):
+    friend = chat_friend_or_403(friend_id)
+    key = chat.conversation_key(current_user.id, friend.id)
+    # Hand the request's connection back to the pool while waiting
+    db.session.close()
+    messages = chat.get_broker().wait(key, request.args.get('after', 0, type=int), CHAT_WAIT_SECONDS)
+    return jsonify(messages=[dict(message, seq=seq) for seq, message in messages])
+
+
+@main.route('/chat/<int:friend_id>/stream')
+@login_required
+def stream_messages(friend_id):
+    friend = chat_friend_or_403(friend_id)
+    key = chat.conversation_key(current_user.id, friend.id)
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    broker = chat.get_broker()
+    db.session.close()
+
+    def events(after):
+        yield 'retry: 3000\n\n'
+        # Close long-lived streams now and then; EventSource reconnects with Last-Event-ID
+        deadline = time.monotonic() + CHAT_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            messages = broker.wait(key, after, CHAT_WAIT_SECONDS)
+            if not messages:
+                yield ': keep-alive\n\n'
+            for seq, message in messages:
+                yield f'id: {seq}\ndata: {json.dumps(message)}\n\n'
+                after = seq
+
+    return Response(stream_with_context(events(after)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 # Posts Operations
 # --------------------------------------------------------------------------
 
 
-@app.route('/create_post', methods=['GET', 'POST'])
+@main.route('/create_post', methods=['GET', 'POST'])
 @login_required
 def create_post():
     form = PostForm()
     if form.validate_on_submit():
-        content = form.content.data
-        privacy = form.privacy.data
-
-        # Create a new post object and save it to the database
-        post = Post(user_id=current_user.id, content=content, privacy=privacy)
-        db.session.add(post)
-        db.session.commit()
-
+        actions.create_post(current_user.id, form.content.data, form.privacy.data)
         flash('Post created successfully!', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
-@app.route('/delete_post/<int:post_id>', methods=['Get','POST'])
+@main.route('/delete_post/<int:post_id>', methods=['Get','POST'])
 @login_required
 def delete_post(post_id):
-    with app.app_context():
-        post = Post.query.get_or_404(post_id)
-        if (not post) or (not post.user_id == current_user.id):
-            print(post)
-            print(post.user_id == current_user.id)
-            return redirect(request.referrer)
-        if post.user_id != current_user.id:
-            flash('You do not have permission to delete this post.', 'error')
-        else:
-            db.session.delete(post)
-            db.session.commit()
-            flash('Post deleted successfully!', 'success')
+    post = Post.query.get_or_404(post_id)
+    if (not post) or (not post.user_id == current_user.id):
+        return redirect(request.referrer)
+    if post.user_id != current_user.id:
+        flash('You do not have permission to delete this post.', 'error')
+    else:
+        actions.delete_post(post)
+        flash('Post deleted successfully!', 'success')
     return redirect(request.referrer)
 
 
-@app.route('/update_post/<int:post_id>', methods=['GET', 'POST'])
+@main.route('/update_post/<int:post_id>', methods=['GET', 'POST'])
 @login_required
 def update_post(post_id):
     post = Post.query.get_or_404(post_id)
     if post.user_id != current_user.id:
         flash('You do not have permission to update this post.', 'error')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     form = PostForm(obj = post)
     if form.validate_on_submit():
-        post.content = form.content.data
-        post.privacy = form.privacy.data
-        db.session.commit()
+        actions.update_post(post, form.content.data, form.privacy.data)
         flash('Post updated successfully!', 'success')
-        return redirect(url_for('profile',user_id=current_user.id ))
+        return redirect(url_for('main.profile',user_id=current_user.id ))
     elif request.method == 'GET':
         form.content.data = post.content
         form.privacy.data = post.privacy
-    return render_template('update_post.html', form=form)
\ No newline at end of file
+    return render_template('update_post.html', form=form)
+
+# Search
+# --------------------------------------------------------------------------
+
+@main.route('/search')
+@login_required
+def search_posts():
+    q = request.args.get('q', '')
+    after = search.decode_cursor(request.args.get('after'))
+    posts, next_cursor = search.search_posts(current_user.id, q, after)
+    fragments.prefetch(posts)
+    return render_template('search.html', q=q, posts=posts, next_cursor=next_cursor)
+
+
+# Notifications
+# --------------------------------------------------------------------------
+
+@main.route('/notifications')
+@login_required
+def notifications_page():
+    items = notifications.recent(current_user.id)
+    unread = [item.notification_id for item in items if item.read_at is None]
+    return render_template('notifications.html', notifications=items, unread=unread,
+                           messages=notifications.MESSAGES)
+
+
+@main.route('/notifications/read', methods=['POST'])
+@login_required
+def mark_notifications_read():
+    # Only the ids the page showed, so newer notifications stay unread
+    notification_ids = request.form.getlist('notification_id', type=int)
+    if notification_ids:
+        notifications.mark_read(current_user.id, notification_ids)
+    return redirect(url_for('main.notifications_page'))
@@ -0,0 +1,270 @@
+"""Ranked, privacy-aware full-text search over posts.
+
+On SQLite posts are indexed by the FTS5 table post_fts, which triggers keep in
+step with every insert, update and delete of a post (migration 8). Other
+databases use MemoryIndex, an inverted index per worker process that catches
+up with new and edited posts through ix_post_updated_at before each search.
+
+Results are ranked by BM25 among the newest SEARCH_RANK_WINDOW matches: a
+common word can match a large share of all posts, and ranking every one of
+them costs far more than the page is worth. The viewer's Public / Friends /
+Only Me rules are the same SQL filter as the home timeline, applied in the
+query that loads the page rather than to the results in Python.
+"""
+import base64
+import json
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import and_, column, or_, select, table, text
+
+from Flask_proj import app_state, db, timeline
+from Flask_proj.models import Post
+
+DEFAULT_LIMIT = 20
+RANK_WINDOW = 5000
+MAX_TERMS = 8
+TOKEN_RE = re.compile(r'\w+')
+
+FTS_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(content, content='post', content_rowid='post_id')",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, content) VALUES (new.post_id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, content) VALUES ('delete', old.post_id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF content ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, content) VALUES ('delete', old.post_id, old.content); "
+    "INSERT INTO post_fts(rowid, content) VALUES (new.post_id, new.content); END",
+    "INSERT INTO post_fts(post_fts) VALUES ('rebuild')",
+]
+
+
+def terms(q):
+    return list(dict.fromkeys(TOKEN_RE.findall((q or '').lower())))[:MAX_TERMS]
+
+
+def encode_cursor(floor, rank, post_id):
+    return base64.urlsafe_b64encode(json.dumps([floor, rank, post_id]).encode()).decode()
+
+
+def decode_cursor(value):
+    # Cursor format: [lowest post_id in the rank window, rank, post_id] of the last result
+    if not value:
+        return None
+    try:
+        floor, rank, post_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return int(floor), float(rank), int(post_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def after_filter(rank, after):
+    """Keyset condition for results ordered by (rank, post_id desc); lower ranks are better."""
+    _, after_rank, after_id = after
+    return or_(rank > after_rank, and_(rank == after_rank, Post.post_id < after_id))
+
+
+def load_page(viewer_id, query, after, limit, floor):
+    """Run a (Post, rank) query with the viewer's visibility rules and return (posts, next_cursor)."""
+    query = timeline.with_authors(query).filter(timeline.visibility_filter(viewer_id, 'all'))
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        post, rank = rows[limit - 1]
+        next_cursor = encode_cursor(floor, rank, post.post_id)
+    return [post for post, _ in rows[:limit]], next_cursor
+
+
+class SearchBackend:
+
+    def search(self, viewer_id, q, after=None, limit=DEFAULT_LIMIT):
+        """Return one page of (posts, next_cursor) for the words in q."""
+        raise NotImplementedError
+
+    def post_deleted(self, post):
+        pass
+
+
+class FtsIndex(SearchBackend):
+    """SQLite FTS5 external-content index, maintained by triggers on the post table."""
+
+    fts = table('post_fts', column('rowid'), column('rank'))
+
+    def search(self, viewer_id, q, after=None, limit=DEFAULT_LIMIT):
+        words = terms(q)
+        if not words:
+            return [], None
+        # Every word must appear: "coffee" "trip"
+        match = text('post_fts MATCH :match').bindparams(match=' '.join('"%s"' % word for word in words))
+        if after:
+            floor = after[0]
+        else:
+            newest = select(self.fts.c.rowid).where(match).order_by(self.fts.c.rowid.desc())
+            floor = db.session.scalar(newest.offset(self.window() - 1).limit(1)) or 0
+
+        rank = self.fts.c.rank
+        query = db.session.query(Post, rank).join(self.fts, self.fts.c.rowid == Post.post_id).filter(
+            match, self.fts.c.rowid >= floor)
+        if after:
+            query = query.filter(after_filter(rank, after))
+        return load_page(viewer_id, query.order_by(rank, Post.post_id.desc()), after, limit, floor)
+
+    def window(self):
+        return current_app.config.get('SEARCH_RANK_WINDOW', RANK_WINDOW)
+
+
+class MemoryIndex(SearchBackend):
+    """Per-process inverted index with BM25 scoring, for databases without FTS5.
+
+    Postings map a word to the ascending ids of the posts containing it, so
+    the newest matches are found by walking the rarest word's list from the
+    end; each post keeps its term frequencies for scoring. Posts deleted by
+    another worker stay in this index until a restart but never show up,
+    because every page is loaded back from the post table.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    # Posts committed this close to the last sync may not have been visible to it
+    SYNC_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self):
+        self.postings = {}
+        self.docs = {}
+        self.total_length = 0
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def add(self, post_id, content):
+        self.remove(post_id)
+        frequencies = Counter(TOKEN_RE.findall((content or '').lower()))
+        self.docs[post_id] = frequencies
+        self.total_length += sum(frequencies.values())
+        for word in frequencies:
+            posting = self.postings.setdefault(word, [])
+            if not posting or posting[-1] < post_id:
+                posting.append(post_id)
+            else:
+                insort(posting, post_id)
+
+    def remove(self, post_id):
+        frequencies = self.docs.pop(post_id, None)
+        if frequencies is None:
+            return
+        self.total_length -= sum(frequencies.values())
+        for word in frequencies:
+            posting = self.postings[word]
+            del posting[bisect_left(posting, post_id)]
+            if not posting:
+                del self.postings[word]
+
+    def sync(self):
+        """Index posts created or edited since the last sync, by any process."""
+        query = select(Post.post_id, Post.content, Post.updated_at)
+        if self.synced_at is None:
+            # Loading in id order lets add() append to every posting list
+            query = query.order_by(Post.post_id)
+        else:
+            query = query.where(Post.updated_at >= self.synced_at - self.SYNC_OVERLAP)
+        latest = self.synced_at
+        rows = db.session.execute(query.execution_options(yield_per=10000))
+        with self._lock:
+            for post_id, content, updated_at in rows:
+                self.add(post_id, content)
+                if updated_at is not None and (latest is None or updated_at > latest):
+                    latest = updated_at
+            self.synced_at = latest
+
+    def post_deleted(self, post):
+        with self._lock:
+            self.remove(post.post_id)
+
+    def ranked(self, words, floor, window):
+        """[(rank, post_id)] for the posts containing every word, newest `window` of them or those above floor."""
+        with self._lock:
+            if not all(word in self.postings for word in words):
+                return [], floor
+            words = sorted(words, key=lambda word: len(self.postings[word]))
+            rarest, others = self.postings[words[0]], words[1:]
+            matches = []
+            for position in range(len(rarest) - 1, -1, -1):
+                post_id = rarest[position]
+                if post_id < floor or (not floor and len(matches) == window):
+                    break
+                frequencies = self.docs[post_id]
+                if all(word in frequencies for word in others):
+                    matches.append((post_id, frequencies))
+            if not floor:
+                floor = matches[-1][0] if matches else 0
+
+            count = len(self.docs)
+            average = self.total_length / count
+            idf = {word: math.log(1 + (count - len(self.postings[word]) + 0.5) / (len(self.postings[word]) + 0.5))
+                   for word in words}
+            ranked = []
+            for post_id, frequencies in matches:
+                length = sum(frequencies.values())
+                score = sum(idf[word] * frequencies[word] * (self.K1 + 1)
+                            / (frequencies[word] + self.K1 * (1 - self.B + self.B * length / average))
+                            for word in words)
+                # Negated like FTS5's rank, so lower is better in both backends
+                ranked.append((-score, post_id))
+        return ranked, floor
+
+    def search(self, viewer_id, q, after=None, limit=DEFAULT_LIMIT):
+        words = terms(q)
+        if not words:
+            return [], None
+        self.sync()
+        window = current_app.config.get('SEARCH_RANK_WINDOW', RANK_WINDOW)
+        ranked, floor = self.ranked(words, after[0] if after else 0, window)
+        if after:
+            ranked = [(rank, post_id) for rank, post_id in ranked if (rank, -post_id) > (after[1], -after[2])]
+        ranked.sort(key=lambda item: (item[0], -item[1]))
+
+        # Candidates go back to the database in rank order, where the visibility rules apply;
+        # widen the slice until a full page survives them or the candidates run out
+        posts, start, size = [], 0, (limit + 1) * 4
+        while len(posts) <= limit and start < len(ranked):
+            ids = [post_id for _, post_id in ranked[start:start + size]]
+            visible = {post.post_id: post for post in timeline.with_authors(Post.query.filter(
+                Post.post_id.in_(ids), timeline.visibility_filter(viewer_id, 'all')))}
+            posts.extend(visible[post_id] for post_id in ids if post_id in visible)
+            start, size = start + len(ids), size * 2
+        next_cursor = None
+        if len(posts) > limit:
+            last = posts[limit - 1]
+            rank = next(rank for rank, post_id in ranked if post_id == last.post_id)
+            next_cursor = encode_cursor(floor, rank, last.post_id)
+        return posts[:limit], next_cursor
+
+
+BACKENDS = {
+    'fts': FtsIndex,
+    'memory': MemoryIndex,
+}
+
+def get_index():
+    """The POST_SEARCH backend; FTS5 on SQLite and the in-process index elsewhere by default."""
+    name = current_app.config.get('POST_SEARCH') or ('fts' if db.engine.dialect.name == 'sqlite' else 'memory')
+    return app_state('search.index', BACKENDS[name])
+
+
+def search_posts(viewer_id, q, after=None, limit=DEFAULT_LIMIT):
+    return get_index().search(viewer_id, q, after, limit)
+
+
+def post_deleted(post):
+    index = app_state('search.index')
+    if index is not None:
+        index.post_deleted(post)
+
+
+def create_fts_index(connection):
+    for statement in FTS_STATEMENTS:
+        connection.execute(text(statement))
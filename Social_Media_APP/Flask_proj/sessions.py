@@ -0,0 +1,214 @@
+"""Server-side sessions, so a login lives in a store that every worker reads.
+
+With SESSION_BACKEND = 'sqlite' or 'file' the session cookie carries only a
+random id, and the data (Flask-Login's user id, the CSRF token, flashed
+messages) is kept in instance/sessions.db or instance/sessions/, shared by
+all worker processes on the host. Logging out deletes the record, so a
+copied cookie stops working, which a signed cookie cannot offer. Any object
+with get / set / delete, e.g. a wrapper around a Redis client for several
+hosts, can be given as SESSION_BACKEND instead. Leave it unset to keep
+Flask's signed-cookie sessions.
+
+Records are written only when the session changes, and expire
+PERMANENT_SESSION_LIFETIME after that write.
+"""
+import os
+import random
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+SID_RE = re.compile(r'^[A-Za-z0-9_-]{43}$')
+PRUNE_CHANCE = 0.001
+
+
+class SessionStore:
+    """Interface for session stores. Values are serialized sessions, ttl is in seconds."""
+
+    def get(self, sid):
+        raise NotImplementedError
+
+    def set(self, sid, data, ttl):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def prune(self):
+        """Drop expired sessions."""
+
+
+class SqliteSessionStore(SessionStore):
+    """A table in its own SQLite file, so session writes never queue behind the main database."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS session (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)')
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config.get('SESSION_SQLITE_PATH') or os.path.join(app.instance_path, 'sessions.db'))
+
+    def _connection(self):
+        # One connection per thread, and never one opened before a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def get(self, sid):
+        row = self._connection().execute(
+            'SELECT data FROM session WHERE sid = ? AND expires > ?', (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, ttl):
+        self._connection().execute('INSERT OR REPLACE INTO session (sid, data, expires) VALUES (?, ?, ?)',
+                                   (sid, data, time.time() + ttl))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM session WHERE sid = ?', (sid,))
+
+    def prune(self):
+        self._connection().execute('DELETE FROM session WHERE expires <= ?', (time.time(),))
+
+
+class FileSessionStore(SessionStore):
+    """One file per session, named by its id, with the expiry time on the first line."""
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config.get('SESSION_FILE_DIR') or os.path.join(app.instance_path, 'sessions'))
+
+    def path(self, sid):
+        return os.path.join(self.root, sid[:2], sid)
+
+    def get(self, sid):
+        try:
+            with open(self.path(sid)) as file:
+                expires, data = file.read().split('\n', 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        return data if float(expires) > time.time() else None
+
+    def set(self, sid, data, ttl):
+        target = self.path(sid)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(f'{time.time() + ttl}\n{data}')
+        os.replace(tmp_path, target)
+
+    def delete(self, sid):
+        try:
+            os.remove(self.path(sid))
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if SID_RE.match(name) and self.get(name) is None:
+                    self.delete(name)
+
+
+BACKENDS = {
+    'sqlite': SqliteSessionStore,
+    'file': FileSessionStore,
+}
+
+
+class ServerSideSession(SecureCookieSession):
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.regenerate_sid = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SID_RE.match(sid):
+            data = self.store.get(sid)
+            if data is not None:
+                try:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid)
+                except ValueError:
+                    pass
+        # Unknown ids are not adopted: a new one is issued once there is something to store
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+            return
+
+        if session.sid and session.regenerate_sid:
+            self.store.delete(session.sid)
+            session.sid = None
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        elif not session.modified:
+            if self.should_set_cookie(app, session):
+                self.set_cookie(app, session, response)
+            return
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.store.set(session.sid, self.serializer.dumps(dict(session)), ttl)
+        if random.random() < PRUNE_CHANCE:
+            self.store.prune()
+        self.set_cookie(app, session, response)
+
+    def set_cookie(self, app, session, response):
+        response.set_cookie(self.get_cookie_name(app), session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=self.get_cookie_domain(app),
+                            path=self.get_cookie_path(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def init_app(app):
+    """Install SESSION_BACKEND as app.session_interface; the signed cookie stays when it is unset."""
+    backend = app.config.get('SESSION_BACKEND')
+    if not backend:
+        return
+    store = BACKENDS[backend].from_app(app) if isinstance(backend, str) else backend
+    app.session_interface = ServerSideSessionInterface(store)
+
+
+def regenerate():
+    """Move the current session to a new id, e.g. after logging in, so an id known beforehand is useless."""
+    if isinstance(session, ServerSideSession):
+        session.regenerate_sid = True
+        session.modified = True
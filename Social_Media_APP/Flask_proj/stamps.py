@@ -0,0 +1,161 @@
+"""Version stamps for conditional GETs of /home and /profile.
+
+The write routes bump small counters in the version_stamp table inside the
+same transaction as their change, and the pages build a weak ETag from the
+counters they depend on. A matching If-None-Match is answered with 304 after
+one primary-key lookup, before any post query or template rendering. The
+fragment cache keys its entries by the same counters (see fragments.py), so
+every worker sees a change as soon as it commits.
+
+A write only bumps stamps of the users it touches, never one per friend, so
+its cost does not grow with the author's friend count. Pages that show
+friends' posts or names read friends_version() instead: the sum of the
+friends' stamps, which grows whenever one of them is bumped.
+
+    public      any Public post added, edited or removed
+    posts:U     U's own posts
+    user:U      U's profile, friendships and friend requests
+    profile:U   U's name, email and avatar
+    friends:U   U's friend list
+    chat:A:B    messages between users A < B, see chat.py
+
+A non-friend's new name reaches timelines that already hold a Public post of
+theirs with the next Public post, or when the ETag's time bucket turns over.
+"""
+import hashlib
+import time
+
+from flask import current_app, has_request_context, request, session
+from sqlalchemy import String, cast, func, literal, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+from Flask_proj import db, timeline
+from Flask_proj.models import VersionStamp
+
+UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def bump(*names):
+    """Increment the named stamps in the current transaction; commit with the change they describe.
+
+    Returns the new versions by name, which are this write's once it commits."""
+    names = sorted(set(names))
+    if not names:
+        return {}
+    insert = UPSERTS[db.engine.dialect.name]
+    statement = insert(VersionStamp).on_conflict_do_update(
+        index_elements=[VersionStamp.name], set_={'version': VersionStamp.version + 1}
+    ).returning(VersionStamp.name, VersionStamp.version)
+    bumped = dict(db.session.execute(statement, [{'name': name, 'version': 1} for name in names]).all())
+    # The friends_version() sums may include any of them
+    _known().clear()
+    return bumped
+
+
+def _known():
+    # Versions read during this request, so the ETag and the fragment keys agree; kept in
+    # the WSGI environ because g outlives the request when an app context was already pushed
+    return request.environ.setdefault('flask_proj.stamp_versions', {}) if has_request_context() else {}
+
+
+def versions(names):
+    known = _known()
+    missing = [name for name in names if name not in known]
+    if missing:
+        rows = db.session.execute(select(VersionStamp.name, VersionStamp.version)
+                                  .where(VersionStamp.name.in_(missing))).all()
+        found = dict(rows)
+        known.update((name, found.get(name, 0)) for name in missing)
+    return [known[name] for name in names]
+
+
+def friends_version(user_id, *kinds):
+    """Sum of the `kinds` stamps ('posts', 'profile') of user_id's friends, in one query.
+
+    Versions only grow, so the sum changes whenever any of those stamps is
+    bumped; a change in who the friends are shows in friends:U instead."""
+    known = _known()
+    key = f'friends_version:{user_id}:{",".join(kinds)}'
+    if key not in known:
+        known[key] = db.session.scalar(friends_version_query(user_id, *kinds))
+    return known[key]
+
+
+def friends_versions(user_id, kind):
+    """The `kind` stamps of user_id's friends by friend id, read now; friends_version() is their sum."""
+    friends = timeline.friend_ids_query(user_id).subquery()
+    name = literal(f'{kind}:') + cast(friends.c.friend_id, String)
+    return dict(db.session.execute(
+        select(friends.c.friend_id, VersionStamp.version).join(VersionStamp, VersionStamp.name == name)).all())
+
+
+def friends_version_query(user_id, *kinds):
+    friends = timeline.friend_ids_query(user_id).subquery()
+    names = union_all(*[select(literal(f'{kind}:') + cast(friends.c.friend_id, String)) for kind in kinds])
+    return select(func.coalesce(func.sum(VersionStamp.version), 0)).where(VersionStamp.name.in_(names))
+
+
+# Events, called by the write routes before they commit
+# --------------------------------------------------------------------------
+
+def post_changed(post, old_privacy=None):
+    """A post was created, edited or deleted; old_privacy is its privacy before an edit.
+
+    Returns the author's new posts version, for the memory feed inbox."""
+    names = [f'posts:{post.user_id}']
+    if 'Public' in {post.privacy, old_privacy}:
+        names.append('public')
+    return bump(*names)[f'posts:{post.user_id}']
+
+
+def friendship_changed(user_id, friend_id):
+    bump(f'user:{user_id}', f'user:{friend_id}', f'friends:{user_id}', f'friends:{friend_id}')
+
+
+def request_changed(user_id, friend_id):
+    bump(f'user:{user_id}', f'user:{friend_id}')
+
+
+def profile_changed(user_id):
+    """Friends' pages see it through friends_version(user_id, 'profile')."""
+    bump(f'user:{user_id}', f'profile:{user_id}')
+
+
+# ETags
+# --------------------------------------------------------------------------
+
+def etag(*parts):
+    """Weak ETag over parts plus the session's CSRF token and its age bucket.
+
+    Pages embed a CSRF token, so a 304 must not keep a token past half of
+    WTF_CSRF_TIME_LIMIT or across a new session."""
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    csrf = (session.get('csrf_token'), int(time.time() // (time_limit // 2)) if time_limit else None)
+    return hashlib.sha1(repr(parts + csrf).encode()).hexdigest()
+
+
+def home_etag(viewer_id, privacy_mode, before, limit):
+    names = [f'posts:{viewer_id}', f'user:{viewer_id}']
+    if privacy_mode != 'friends':
+        names.append('public')
+    friends = friends_version(viewer_id, 'posts', 'profile') if privacy_mode != 'public' else None
+    return etag('home', viewer_id, privacy_mode, before, limit, versions(names), friends)
+
+
+def profile_etag(viewer_id, user_id):
+    # The friend grid shows the friends' names and avatars
+    names = [f'user:{viewer_id}', f'user:{user_id}', f'posts:{user_id}']
+    return etag('profile', viewer_id, user_id, versions(names), friends_version(user_id, 'profile'))
+
+
+def not_modified(tag):
+    """True when the client already holds the page tagged `tag`."""
+    return request.if_none_match.contains_weak(tag)
+
+
+def tag_response(response, tag):
+    response.set_etag(tag, weak=True)
+    # Revalidate every time: the stamps, not a max-age, decide freshness
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
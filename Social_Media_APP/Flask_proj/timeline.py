@@ -0,0 +1,99 @@
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import joinedload, load_only
+
+from Flask_proj.models import User, Friendship, Post
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def parse_cursor(value):
+    # Cursor format: "<created_at isoformat>,<post_id>"
+    if not value:
+        return None
+    try:
+        created_at, post_id = value.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(post_id)
+    except ValueError:
+        return None
+
+
+def make_cursor(post):
+    return f'{post.created_at.isoformat()},{post.post_id}'
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def friend_ids_query(user_id):
+    return select(Friendship.friend_id).where(Friendship.user_id == user_id)
+
+
+def visibility_filter(user_id, privacy_mode):
+    """SQL filter for the posts a viewer may see in the given home mode."""
+    authors = or_(Post.user_id == user_id, Post.user_id.in_(friend_ids_query(user_id)))
+
+    if privacy_mode == 'all':
+        # Public posts, friends' "Friends" posts and the viewer's own posts
+        return or_(
+            Post.privacy == 'Public',
+            and_(Post.privacy == 'Friends', authors),
+            and_(Post.privacy == 'Only Me', Post.user_id == user_id)
+        )
+    if privacy_mode == 'friends':
+        # Posts of friends with privacy set to "Public" or "Friends"
+        return and_(authors, Post.privacy.in_(['Public', 'Friends']))
+    # Public posts and the viewer's own "Only Me" posts
+    return or_(
+        Post.privacy == 'Public',
+        and_(Post.privacy == 'Only Me', Post.user_id == user_id)
+    )
+
+
+def profile_posts(viewer, user):
+    """Query for the posts of `user` that `viewer` sees on their profile, in the pages and the API.
+
+    The same rule as the home timeline: "Only Me" posts are the author's
+    alone, friends also see "Friends" posts, everyone else the Public ones."""
+    query = Post.query.filter_by(user_id=user.id)
+    if viewer.id == user.id:
+        return query
+    if viewer.relationship_with(user).friends:
+        return query.filter(Post.privacy.in_(('Public', 'Friends')))
+    return query.filter_by(privacy='Public')
+
+
+def before_filter(cursor):
+    created_at, post_id = cursor
+    return or_(
+        Post.created_at < created_at,
+        and_(Post.created_at == created_at, Post.post_id < post_id)
+    )
+
+
+def with_authors(query):
+    # Load authors in the same query, skipping the image blob
+    return query.options(
+        joinedload(Post.user).options(load_only(User.id, User.first_name, User.last_name, User.avatar_hash))
+    )
+
+
+def page_of(query, before=None, limit=DEFAULT_LIMIT):
+    """Return one keyset page of `query` as (posts, next_cursor)."""
+    if before:
+        query = query.filter(before_filter(before))
+    posts = query.order_by(Post.created_at.desc(), Post.post_id.desc()).limit(limit + 1).all()
+    next_cursor = make_cursor(posts[limit - 1]) if len(posts) > limit else None
+    return posts[:limit], next_cursor
+
+
+def timeline(user_id, privacy_mode='all', before=None, limit=DEFAULT_LIMIT):
+    query = with_authors(Post.query.filter(visibility_filter(user_id, privacy_mode)))
+    return page_of(query, before, limit)
@@ -0,0 +1,42 @@
+"""Identity cache for the user loader, so authenticated requests skip the user SELECT."""
+
+from flask import current_app
+from sqlalchemy.orm import load_only, make_transient_to_detached
+
+from Flask_proj import app_state, db
+from Flask_proj.cache import LRUCache
+
+# pending_request_count is the nav badge on every page; the counters job invalidates it
+SLIM_FIELDS = ('id', 'first_name', 'last_name', 'email', 'avatar_hash', 'pending_request_count')
+
+
+def get_backend():
+    """The configured USER_CACHE_BACKEND, or a process-local LRU cache."""
+    config = current_app.config
+    return config.get('USER_CACHE_BACKEND') or app_state(
+        'user_cache.cache', lambda: LRUCache(maxsize=config.get('USER_CACHE_SIZE', 10000),
+                                             ttl=config.get('USER_CACHE_TTL', 300)))
+
+
+def load(model, user_id):
+    record = get_backend().get(user_id)
+    if record is not None:
+        # Attach a slim instance without a SELECT; other columns load on first access
+        user = model(**record)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    columns = [getattr(model, field) for field in SLIM_FIELDS]
+    user = db.session.get(model, user_id, options=[load_only(*columns)])
+    if user is not None:
+        get_backend().set(user_id, {field: getattr(user, field) for field in SLIM_FIELDS})
+    return user
+
+
+def invalidate(*user_ids):
+    for user_id in user_ids:
+        get_backend().delete(user_id)
+
+
+def stats():
+    return get_backend().stats()
@@ -1,4 +1,6 @@
-from Flask_proj import app
+from Flask_proj import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
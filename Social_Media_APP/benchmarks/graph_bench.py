@@ -0,0 +1,60 @@
+"""Benchmark the friend graph on a synthetic power-law graph.
+
+    python benchmarks/graph_bench.py --users 100000 --edges 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Flask_proj.graph import FriendGraph
+
+
+def synthetic_edges(users, edges, seed=1):
+    # Preferential attachment: popular users are more likely to gain friends
+    rng = random.Random(seed)
+    targets = list(range(1, min(users, 10) + 1))
+    pairs = set()
+    while len(pairs) * 2 < edges:
+        user_id = rng.randint(1, users)
+        friend_id = rng.choice(targets) if rng.random() < 0.5 else rng.randint(1, users)
+        if user_id != friend_id and (friend_id, user_id) not in pairs:
+            pairs.add((user_id, friend_id))
+            targets.append(friend_id)
+    for user_id, friend_id in pairs:
+        yield user_id, friend_id
+        yield friend_id, user_id
+
+
+def timed(label, func, calls=1):
+    start = time.perf_counter()
+    result = func()
+    elapsed = (time.perf_counter() - start) / calls
+    print(f'{label:<28} {elapsed * 1e6:12.1f} us/call')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--edges', type=int, default=1000000, help='directed Friendship rows')
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    edges = timed('generate edges', lambda: list(synthetic_edges(args.users, args.edges)))
+    graph = timed('build graph', lambda: FriendGraph.from_edges(edges))
+    print(f'{len(edges)} edges, {len(graph.adjacency)} users')
+
+    rng = random.Random(2)
+    users = [rng.randint(1, args.users) for _ in range(args.queries)]
+    timed('mutual_count', lambda: [graph.mutual_count(u, rng.randint(1, args.users)) for u in users], len(users))
+    timed('suggestions k=10', lambda: [graph.suggestions(u, 10) for u in users], len(users))
+    timed('add + remove friendship', lambda: [
+        (graph.add_friendship(u, u + 1), graph.remove_friendship(u, u + 1)) for u in users], len(users))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Write latency with side effects run as background jobs, and how fast the workers catch up.
+
+    python benchmarks/jobs_bench.py                    # JOB_WORKERS=1, SQL feed inbox
+    python benchmarks/jobs_bench.py --inline           # JOB_WORKERS=0: every job runs before the call returns
+    python benchmarks/jobs_bench.py --batch-size 1     # one job per worker transaction
+
+Seeds a scratch database, then times actions.create_post and a friend
+request sent and accepted, each the way the routes call them. With
+workers, the write only commits its rows and jobs; the drain line shows
+how long the queue took to empty after the last write.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import seed_database
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--friendships', type=int, default=100000)
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--writes', type=int, default=300, help='timed calls per scenario')
+    parser.add_argument('--inline', action='store_true', help='run jobs inline (JOB_WORKERS=0)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "bench.db")}'
+
+    from sqlalchemy import func, select
+    from Flask_proj import actions, create_app, db, feed, jobs
+    from Flask_proj.models import Friendship, FriendRequest, Job
+
+    app = create_app({'FEED_INBOX': 'sql', 'JOB_WORKERS': 0 if args.inline else args.workers,
+                      'JOB_BATCH_SIZE': args.batch_size})
+    rng = random.Random(1)
+
+    with app.app_context():
+        seed_database(users=args.users, friendships=args.friendships, posts=args.posts, requests=0, chats=0)
+        feed.SqlInbox().rebuild()
+
+        def create_post():
+            actions.create_post(rng.randint(1, args.users), 'benchmark post', rng.choice(['Public', 'Friends']))
+
+        def befriend():
+            while True:
+                sender_id, receiver_id = rng.sample(range(1, args.users + 1), 2)
+                if not Friendship.query.filter_by(user_id=sender_id, friend_id=receiver_id).first():
+                    break
+            actions.send_friend_request(sender_id, receiver_id)
+            actions.accept_friend_requests(
+                FriendRequest.query.filter_by(user_id=sender_id, friend_id=receiver_id).all())
+
+        def queued():
+            return db.session.scalar(select(func.count()).select_from(Job).where(Job.status != 'dead'))
+
+        mode = 'inline' if args.inline else f'{args.workers} worker(s), batch {args.batch_size}'
+        print(f'\njobs {mode}')
+        for name, write in (('create_post', create_post), ('befriend', befriend)):
+            latencies = []
+            for _ in range(args.writes):
+                start = time.perf_counter()
+                write()
+                latencies.append(time.perf_counter() - start)
+            written = time.perf_counter()
+            while queued():
+                time.sleep(0.01)
+            drained = time.perf_counter() - written
+            cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+            print(f'{name:<12} p50 {cuts[49] * 1000:7.2f} ms  p95 {cuts[94] * 1000:7.2f} ms  '
+                  f'queue empty {drained * 1000:7.0f} ms after the last write')
+        print(f'dead jobs: {jobs.stats().get("dead", 0)}')
+
+
+if __name__ == '__main__':
+    main()
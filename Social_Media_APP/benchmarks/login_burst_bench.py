@@ -0,0 +1,71 @@
+"""Home-page latency while a burst of logins is hashing passwords.
+
+    python benchmarks/login_burst_bench.py                 # process pool (default)
+    python benchmarks/login_burst_bench.py --inline        # PASSWORD_WORKERS=0, hashing on request threads
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import SEED_PASSWORD, seed_database
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--login-threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--inline', action='store_true')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "bench.db")}'
+    if args.inline:
+        os.environ['PASSWORD_WORKERS'] = '0'
+
+    from Flask_proj import create_app
+    from Flask_proj.config import Config
+
+    app = create_app({'WTF_CSRF_ENABLED': False, 'RATE_LIMITS': {name: (10 ** 9, 1) for name in Config.RATE_LIMITS}})
+    with app.app_context():
+        seed_database(users=500, friendships=5000, posts=5000, requests=100, chats=0)
+
+    reader = app.test_client()
+    reader.post('/login', data={'email': 'user1@example.com', 'password': SEED_PASSWORD})
+    stop = threading.Event()
+    logins, statuses = [], []
+
+    def login_loop(user_id):
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = app.test_client().post('/login', data={'email': f'user{user_id}@example.com',
+                                                              'password': SEED_PASSWORD})
+            logins.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=login_loop, args=(user_id,)) for user_id in range(2, args.login_threads + 2)]
+    for thread in threads:
+        thread.start()
+    reads = []
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        reader.get('/home?privacy_mode=all')
+        reads.append(time.perf_counter() - start)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    cuts = statistics.quantiles(reads, n=100) if len(reads) > 1 else [reads[0]] * 99
+    print(f'{"inline" if args.inline else "pool"} workers={app.config["PASSWORD_WORKERS"]} '
+          f'login threads={args.login_threads}: home p50 {cuts[49] * 1000:.1f} ms, p95 {cuts[94] * 1000:.1f} ms '
+          f'({len(reads)} reads); {len(logins)} logins, p50 {statistics.median(logins) * 1000:.0f} ms, '
+          f'statuses {sorted(set(statuses))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Latency and query counts for the core routes, driven through the Flask test client.
+
+    python benchmarks/routes_bench.py                                  # small scratch database
+    python benchmarks/routes_bench.py --database /tmp/seed.db --output before.json
+    python benchmarks/routes_bench.py --database /tmp/seed.db --baseline before.json
+    python benchmarks/routes_bench.py --metrics --baseline before.json   # instrumentation overhead
+
+Seed a large database first with benchmarks/seed.py. Results are written as
+JSON keyed by scenario (p50/p95/p99 in ms, SQL queries per request) so two
+commits can be compared with --baseline.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import SEED_PASSWORD, seed_database
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def summarize(latencies, queries):
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(cuts[49] * 1000, 2),
+        'p95_ms': round(cuts[94] * 1000, 2),
+        'p99_ms': round(cuts[98] * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+        'queries_mean': round(statistics.fmean(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def compare(results, baseline):
+    print(f'\n{"scenario":<16} {"p50 ms":>18} {"p95 ms":>18} {"queries":>14}')
+    for name, current in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+
+        def delta(key):
+            change = (current[key] - before[key]) / before[key] * 100 if before[key] else 0
+            return f'{before[key]:.1f}->{current[key]:.1f} ({change:+.0f}%)'
+        print(f'{name:<16} {delta("p50_ms"):>18} {delta("p95_ms"):>18} {delta("queries_mean"):>14}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='SQLite file or database URL to benchmark; seeds a scratch one if omitted')
+    parser.add_argument('--users', type=int, default=2000, help='scratch database size')
+    parser.add_argument('--posts', type=int, default=20000, help='scratch database size')
+    parser.add_argument('--requests', type=int, default=100, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--viewer', type=int, default=1, help='user id to log in as')
+    parser.add_argument('--only', action='append', help='run just these scenarios')
+    parser.add_argument('--metrics', action='store_true', help='run with METRICS instrumentation enabled')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    args = parser.parse_args()
+
+    if args.database:
+        url = args.database if '://' in args.database else f'sqlite:///{os.path.abspath(args.database)}'
+    else:
+        url = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "bench.db")}'
+    os.environ['DATABASE_URL'] = url
+    if args.metrics:
+        os.environ['METRICS'] = '1'
+
+    from sqlalchemy import event
+    from Flask_proj import create_app, db
+    from Flask_proj.models import User, Friendship
+
+    app = create_app()
+    # The login scenario measures hashing, not the limiter in front of it
+    app.config.update(WTF_CSRF_ENABLED=False, TESTING=False,
+                      RATE_LIMITS={name: (10 ** 9, 1) for name in app.config['RATE_LIMITS']})
+    with app.app_context():
+        if not args.database:
+            seed_database(users=args.users, friendships=args.users * 10, posts=args.posts,
+                          requests=args.users // 2, chats=args.users * 5)
+        viewer = db.session.get(User, args.viewer)
+        friend_ids = [row.friend_id for row in Friendship.query.filter_by(user_id=viewer.id).limit(50)]
+        user_count = User.query.count()
+        email = viewer.email
+
+        queries = [0]
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(*args):
+            queries[0] += 1
+
+    rng = random.Random(1)
+    client = app.test_client()
+    response = client.post('/login', data={'email': email, 'password': SEED_PASSWORD})
+    if response.status_code != 302:
+        sys.exit(f'Could not log in as {email} with the seed password')
+
+    def login():
+        return app.test_client().post('/login', data={'email': email, 'password': SEED_PASSWORD})
+
+    def profile():
+        if friend_ids and rng.random() < 0.5:
+            return client.get(f'/profile/{rng.choice(friend_ids)}')
+        return client.get(f'/profile/{rng.randint(1, user_count)}')
+
+    def revalidate(url):
+        # A browser refresh: send back the ETag of the last full response
+        etags = {}
+
+        def request():
+            response = client.get(url, headers={'If-None-Match': etags[url]} if url in etags else {})
+            if 'ETag' in response.headers:
+                etags[url] = response.headers['ETag']
+            return response
+        return request
+
+    def create_post():
+        return client.post('/create_post', data={'content': 'benchmark post',
+                                                 'privacy': rng.choice(['Public', 'Friends', 'Only Me'])})
+
+    scenarios = {
+        'home_all': lambda: client.get('/home?privacy_mode=all'),
+        'home_friends': lambda: client.get('/home?privacy_mode=friends'),
+        'home_public': lambda: client.get('/home?privacy_mode=public'),
+        'profile': profile,
+        'home_revalidate': revalidate('/home?privacy_mode=all'),
+        'api_timeline': lambda: client.get('/api/v1/timeline?privacy_mode=all', headers={'Accept-Encoding': 'gzip'}),
+        'profile_revalidate': revalidate(f'/profile/{friend_ids[0] if friend_ids else args.viewer}'),
+        'friend_requests': lambda: client.get('/friend_requests'),
+        'login': login,
+        'create_post': create_post,
+    }
+    if args.only:
+        scenarios = {name: scenarios[name] for name in args.only}
+
+    results = {
+        'commit': git_commit(),
+        'recorded_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'database': url,
+        'viewer': args.viewer,
+        'metrics': args.metrics,
+        'scenarios': {},
+    }
+    for name, request in scenarios.items():
+        for _ in range(args.warmup):
+            request()
+        latencies, counts = [], []
+        for _ in range(args.requests):
+            queries[0] = 0
+            start = time.perf_counter()
+            response = request()
+            latencies.append(time.perf_counter() - start)
+            counts.append(queries[0])
+            if response.status_code >= 400:
+                sys.exit(f'{name}: HTTP {response.status_code}')
+        results['scenarios'][name] = summary = summarize(latencies, counts)
+        print(f'{name:<16} p50 {summary["p50_ms"]:8.2f} ms  p95 {summary["p95_ms"]:8.2f} ms  '
+              f'p99 {summary["p99_ms"]:8.2f} ms  {summary["queries_mean"]:6.1f} queries/request')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Post search latency by query selectivity, against a LIKE '%term%' scan.
+
+    python benchmarks/seed.py --users 100000 --friendships 1000000 --posts 1000000   # DATABASE_URL=...
+    python benchmarks/search_bench.py --database /tmp/seed.db
+    python benchmarks/search_bench.py --database /tmp/seed.db --backend memory --requests 20
+
+Each query fetches the first page and then follows the cursor for --pages
+pages as the viewer. The seed's vocabulary is small, so a single word
+matches about a third of all posts: the worst case for ranking.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERIES = {
+    'one common word': 'coffee',
+    'two words': 'coffee trip',
+    'three words': 'coffee trip music',
+    'no match': 'zebra',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', required=True, help='SQLite file or database URL seeded by seed.py')
+    parser.add_argument('--backend', choices=('fts', 'memory'), help='default: fts on SQLite, memory elsewhere')
+    parser.add_argument('--viewer', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--like', action='store_true', help="also time the LIKE '%%term%%' scan it replaces")
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database if '://' in args.database else \
+        f'sqlite:///{os.path.abspath(args.database)}'
+    if args.backend:
+        os.environ['POST_SEARCH'] = args.backend
+
+    from Flask_proj import create_app, db, search, timeline
+    from Flask_proj.models import Post
+
+    app = create_app()
+
+    with app.app_context():
+        index = search.get_index()
+        start = time.perf_counter()
+        if isinstance(index, search.MemoryIndex):
+            index.sync()
+        print(f'{type(index).__name__}: ready in {time.perf_counter() - start:.2f}s')
+
+        for label, q in QUERIES.items():
+            first, deeper, found = [], [], 0
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                posts, cursor = search.search_posts(args.viewer, q)
+                first.append(time.perf_counter() - start)
+                found = len(posts)
+                for _ in range(args.pages - 1):
+                    if not cursor:
+                        break
+                    start = time.perf_counter()
+                    posts, cursor = search.search_posts(args.viewer, q, search.decode_cursor(cursor))
+                    deeper.append(time.perf_counter() - start)
+                    found += len(posts)
+                db.session.rollback()
+            line = f'{label:<16} first page p50 {statistics.median(first) * 1000:7.1f} ms  ' \
+                   f'max {max(first) * 1000:7.1f} ms'
+            if deeper:
+                line += f'  next pages p50 {statistics.median(deeper) * 1000:7.1f} ms'
+            print(f'{line}  ({found} results in {args.pages} pages)')
+
+            if args.like:
+                start = time.perf_counter()
+                query = Post.query.filter(timeline.visibility_filter(args.viewer, 'all'))
+                for word in search.terms(q):
+                    query = query.filter(Post.content.like(f'%{word}%'))
+                query.order_by(Post.created_at.desc()).limit(search.DEFAULT_LIMIT).all()
+                print(f'{"":<16} LIKE scan       {(time.perf_counter() - start) * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
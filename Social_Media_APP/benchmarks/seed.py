@@ -0,0 +1,207 @@
+"""Fill a database with synthetic users, friendships, posts, requests and chats.
+
+    python benchmarks/seed.py --users 100000 --friendships 1000000 --posts 1000000
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/seed.py --users 1000
+
+Every user's password is SEED_PASSWORD. Friendships follow a power law, so a
+handful of low user ids have very many friends, like real hub accounts.
+Rows go in with executemany in large batches, one transaction per table and
+with that table's indexes rebuilt once at the end, which keeps a million
+rows well under a minute on SQLite.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+SEED_PASSWORD = 'password'
+BATCH_SIZE = 50000
+PRIVACY_MIX = (('Public', 50), ('Friends', 40), ('Only Me', 10))
+FIRST_NAMES = ['Ahmed', 'Mohamed', 'Sara', 'Omar', 'Laila', 'Youssef', 'Nour', 'Ali', 'Mona', 'Karim',
+               'Hana', 'Tarek', 'Salma', 'Ziad', 'Farida', 'Adam', 'Maya', 'John', 'Emma', 'Lucas']
+LAST_NAMES = ['Osama', 'Hassan', 'Ibrahim', 'Mahmoud', 'Saleh', 'Fathy', 'Nabil', 'Smith', 'Jones',
+              'Brown', 'Garcia', 'Kamal', 'Adel', 'Samir', 'Fouad', 'Lotfy', 'Said', 'Taylor', 'Wilson']
+WORDS = ('the a today just new my friends weekend coffee work trip photo happy great day night '
+         'finally love this city game music book movie food dinner team project').split()
+
+
+def bulk_insert(connection, table, columns, rows):
+    """executemany straight on the driver cursor, with the table's secondary
+    indexes (and SQLite triggers) dropped for the load and restored at the end."""
+    compiled = insert(table).compile(dialect=connection.dialect, column_keys=columns)
+    processors = [(position, table.c[name].type.bind_processor(connection.dialect))
+                  for position, name in enumerate(columns)]
+    processors = [(position, process) for position, process in processors if process]
+    order = [columns.index(name) for name in compiled.positiontup] if compiled.positional else None
+    if order == list(range(len(columns))):
+        order = []
+
+    def params(row):
+        if processors:
+            row = list(row)
+            for position, process in processors:
+                row[position] = process(row[position])
+        if order is None:
+            return dict(zip(columns, row))
+        return tuple(row[position] for position in order) if order else tuple(row)
+
+    triggers = []
+    if connection.dialect.name == 'sqlite':
+        # Per-row triggers (the post search index) would dominate the load time
+        triggers = connection.exec_driver_sql(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table.name,)).all()
+    for name, _ in triggers:
+        connection.exec_driver_sql(f'DROP TRIGGER "{name}"')
+    for index in table.indexes:
+        connection.execute(DropIndex(index, if_exists=True))
+    batch = []
+    for row in rows:
+        batch.append(params(row))
+        if len(batch) == BATCH_SIZE:
+            connection.exec_driver_sql(str(compiled), batch)
+            batch = []
+    if batch:
+        connection.exec_driver_sql(str(compiled), batch)
+    for index in table.indexes:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    for _, sql in triggers:
+        connection.exec_driver_sql(sql)
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<16} {count:>10} rows in {elapsed:6.2f}s')
+    return count
+
+
+def seed_database(users=1000, friendships=10000, posts=10000, requests=1000, chats=10000, seed=1):
+    """Insert the synthetic data set into app's database. Needs an app context."""
+    from Flask_proj import bcrypt, counters, db, migrations, search
+    from Flask_proj.models import User, Friendship, FriendRequest, Post, Chat, search_key
+    from graph_bench import synthetic_edges
+
+    migrations.upgrade()
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    # Hashing once keeps seeding fast; the hash is still a real bcrypt hash
+    password = bcrypt.generate_password_hash(SEED_PASSWORD).decode('utf-8')
+    sentences = [' '.join(rng.choices(WORDS, k=rng.randint(3, 20))) for _ in range(5000)]
+
+    def ago(max_seconds):
+        return now - timedelta(seconds=int(rng.random() * max_seconds))
+
+    def user_rows():
+        for user_id in range(1, users + 1):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            email = f'user{user_id}@example.com'
+            yield (user_id, first_name, last_name, email, search_key(first_name), search_key(last_name),
+                   search_key(email), password)
+
+    edges = list(synthetic_edges(users, friendships, seed))
+    friend_pairs = set(edges)
+
+    def friendship_rows():
+        for user_id, friend_id in edges:
+            yield user_id, friend_id, 'friends', ago(365 * 86400)
+
+    # Popular users post more: weight authors by a Zipf-like curve over a shuffled id order
+    authors = list(range(1, users + 1))
+    rng.shuffle(authors)
+    author_weights = [1 / rank ** 0.8 for rank in range(1, users + 1)]
+    privacies, privacy_weights = zip(*PRIVACY_MIX)
+
+    def post_rows():
+        author_ids = rng.choices(authors, weights=author_weights, k=posts)
+        privacy_values = rng.choices(privacies, weights=privacy_weights, k=posts)
+        for author_id, privacy, content in zip(author_ids, privacy_values, rng.choices(sentences, k=posts)):
+            created_at = ago(365 * 86400)
+            yield author_id, privacy, content, created_at, created_at
+
+    def request_rows():
+        seen = set()
+        attempts = 0
+        while len(seen) < requests and attempts < requests * 10:
+            attempts += 1
+            pair = rng.randint(1, users), rng.randint(1, users)
+            if pair[0] == pair[1] or pair in seen or pair in friend_pairs or pair[::-1] in seen:
+                continue
+            seen.add(pair)
+            yield pair[0], pair[1], 'pending', ago(30 * 86400)
+
+    def chat_rows():
+        for user_id, friend_id in rng.choices(edges, k=chats) if edges else ():
+            yield user_id, friend_id, rng.choice(sentences), ago(30 * 86400)
+
+    tables = (
+        ('users', User, ('id', 'first_name', 'last_name', 'email', 'first_name_key', 'last_name_key', 'email_key',
+                         'password'), user_rows),
+        ('friendships', Friendship, ('user_id', 'friend_id', 'status', 'created_at'), friendship_rows),
+        ('posts', Post, ('user_id', 'privacy', 'content', 'created_at', 'updated_at'), post_rows),
+        ('friend requests', FriendRequest, ('user_id', 'friend_id', 'status', 'created_at'), request_rows),
+        ('chats', Chat, ('user_id', 'friend_id', 'message_content', 'sent_at'), chat_rows),
+    )
+    counts = {}
+    for label, model, columns, rows in tables:
+        def load():
+            materialized = list(rows())
+            with db.engine.begin() as connection:
+                bulk_insert(connection, model.__table__, list(columns), materialized)
+            return len(materialized)
+        counts[label] = timed(label, load)
+    # Bulk rows bypass the write paths, so fill in the denormalized counters once
+    counts['user counters'] = timed('user counters', counters.reconcile)
+    if db.engine.dialect.name == 'sqlite':
+        def index_posts():
+            with db.engine.begin() as connection:
+                search.create_fts_index(connection)
+            return posts
+        counts['post search'] = timed('post search', index_posts)
+
+        # Without sqlite_stat1 the planner treats the visibility filter's OR as two index
+        # scans over every Public post, for the home timeline and search pages alike
+        def analyze():
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql('ANALYZE')
+            return posts
+        timed('analyze', analyze)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--friendships', type=int, default=10000, help='directed Friendship rows')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=1000, help='pending friend requests')
+    parser.add_argument('--chats', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--feed-inbox', action='store_true', help='also rebuild the SQL feed inbox')
+    args = parser.parse_args()
+
+    from Flask_proj import create_app, feed
+    from Flask_proj.models import FeedEntry
+
+    app = create_app()
+
+    def rebuild_inbox():
+        feed.SqlInbox().rebuild()
+        return FeedEntry.query.count()
+
+    with app.app_context():
+        seed_database(args.users, args.friendships, args.posts, args.requests, args.chats, args.seed)
+        if args.feed_inbox:
+            timed('feed entries', rebuild_inbox)
+    print(f'Seeded {app.config["SQLALCHEMY_DATABASE_URI"]}; every password is {SEED_PASSWORD!r}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Cold-start time of a worker: import, create_app() and the first request.
+
+    python benchmarks/startup_bench.py                     # median of 10 fresh interpreters
+    python benchmarks/startup_bench.py --budget-ms 1500    # exit 1 when the median is over budget
+    python benchmarks/startup_bench.py --importtime 15     # also list the slowest imports
+
+Each run is a new `python` process, so nothing is cached in memory; the
+operating system's file cache is warm after the first run. "process" is
+the wall time of the whole child including interpreter start-up, and is
+what the budget is checked against.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from Flask_proj import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+with app.test_client() as client:
+    status = client.get('/login').status_code
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported, 'first_request': done - created,
+                  'modules': len(sys.modules), 'status': status}))
+'''
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(tempfile.mkdtemp(), "startup.db")}')
+    # A fixed key keeps the benchmark from writing instance/secret_key
+    env.setdefault('SECRET_KEY', 'startup-bench')
+    return env
+
+
+def run_once(env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['process'] = time.perf_counter() - start
+    return sample
+
+
+def slowest_imports(env, count):
+    """Parse `python -X importtime` output for the modules with the largest cumulative time."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        # Only top-level imports, so a package is not counted twice with its submodules
+        if match and len(match.group(3)) <= 1:
+            rows.append((int(match.group(2)), match.group(4)))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, help='fail when the median process time is above this')
+    parser.add_argument('--importtime', type=int, metavar='N', help='list the N slowest top-level imports')
+    args = parser.parse_args()
+
+    env = child_env()
+    run_once(env)  # warm the file cache and the bytecode cache
+    samples = [run_once(env) for _ in range(args.runs)]
+    if any(sample['status'] != 200 for sample in samples):
+        sys.exit(f'first request failed: {samples[0]["status"]}')
+
+    print(f'\nstartup over {args.runs} runs (median / max)')
+    for name in ('import', 'create_app', 'first_request', 'process'):
+        values = [sample[name] * 1000 for sample in samples]
+        print(f'{name:<14} {statistics.median(values):8.1f} ms {max(values):8.1f} ms')
+    print(f'{"modules":<14} {samples[0]["modules"]:8d}')
+
+    if args.importtime:
+        print('\nslowest imports (cumulative)')
+        for microseconds, module in slowest_imports(env, args.importtime):
+            print(f'{module:<40} {microseconds / 1000:8.1f} ms')
+
+    if args.budget_ms is not None:
+        median = statistics.median(sample['process'] for sample in samples) * 1000
+        if median > args.budget_ms:
+            sys.exit(f'\nstartup {median:.0f} ms is over the {args.budget_ms:.0f} ms budget')
+        print(f'\nstartup {median:.0f} ms is within the {args.budget_ms:.0f} ms budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Requests per second for 1, 2, 4... preforked worker processes sharing one socket.
+
+    python benchmarks/workers_bench.py                          # GET /home, workers 1,2,4
+    python benchmarks/workers_bench.py --workers 1,4,8 --clients 16
+    python benchmarks/workers_bench.py --sessions cookie        # Flask's signed cookie instead
+
+The app is created and the database seeded once, then forked into the
+workers the way gunicorn's preload_app does, each running a single-threaded
+wsgiref server on the shared listening socket. Client processes log in
+through whichever worker accepts them and then load the page for
+--seconds. A response that lands anywhere but the page (e.g. a redirect to
+/login because a worker did not know the session) counts as an error.
+The numbers only scale up to the number of cores, which is printed too.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, build_opener
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import SEED_PASSWORD, seed_database
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(app, listener):
+    """Run a wsgiref server on an already listening socket; never returns."""
+    server = WSGIServer(listener.getsockname(), QuietHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    server.server_name, server.server_port = listener.getsockname()
+    server.setup_environ()
+    server.set_app(app)
+    server.serve_forever()
+
+
+def client(url, path, email, seconds, ready, results):
+    opener = build_opener(HTTPCookieProcessor(CookieJar()))
+    opener.open(f'{url}/login', urlencode({'email': email, 'password': SEED_PASSWORD}).encode()).read()
+    ready.wait()
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        with opener.open(url + path) as response:
+            response.read()
+            if not response.geturl().endswith(path):
+                errors += 1
+        latencies.append(time.perf_counter() - start)
+    results.put((latencies, errors))
+
+
+def measure(app, workers, args):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    url = 'http://%s:%d' % listener.getsockname()
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Its own process group, so stopping the worker also stops its password pool
+            os.setpgid(0, 0)
+            try:
+                serve(app, listener)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    context = multiprocessing.get_context('fork')
+    ready = context.Barrier(args.clients + 1)
+    results = context.Queue()
+    clients = [context.Process(target=client, args=(url, args.path, f'user{number % args.users + 1}@example.com',
+                                                     args.seconds, ready, results))
+               for number in range(args.clients)]
+    for process in clients:
+        process.start()
+    ready.wait()
+    collected = [results.get() for _ in clients]
+    for process in clients:
+        process.join()
+    for pid in children:
+        os.killpg(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    listener.close()
+
+    latencies = [latency for sample, _ in collected for latency in sample]
+    errors = sum(count for _, count in collected)
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    print(f'{workers:>7}  {len(latencies) / args.seconds:8.1f}  {cuts[49] * 1000:8.1f}  {cuts[94] * 1000:8.1f}  '
+          f'{errors:6d}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--path', default='/home')
+    parser.add_argument('--sessions', choices=('sqlite', 'file', 'cookie'), default='sqlite')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=20000)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(scratch, "bench.db")}'
+
+    from Flask_proj import create_app, db
+    from Flask_proj.config import Config
+
+    app = create_app({
+        'SECRET_KEY': 'workers-bench',
+        'WTF_CSRF_ENABLED': False,
+        'RATE_LIMITS': {name: (10 ** 9, 1) for name in Config.RATE_LIMITS},
+        'SESSION_BACKEND': None if args.sessions == 'cookie' else args.sessions,
+        'SESSION_SQLITE_PATH': os.path.join(scratch, 'sessions.db'),
+        'SESSION_FILE_DIR': os.path.join(scratch, 'sessions'),
+    })
+    with app.app_context():
+        seed_database(users=args.users, friendships=args.users * 10, posts=args.posts, requests=args.users // 2,
+                      chats=0)
+        db.session.remove()
+
+    print(f'\nGET {args.path}, {args.clients} clients, {args.sessions} sessions, {os.cpu_count()} core(s)')
+    print('workers     req/s   p50 ms   p95 ms  errors')
+    for workers in (int(count) for count in args.workers.split(',')):
+        measure(app, workers, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Concurrent write throughput against a scratch database.
+
+    python benchmarks/write_bench.py                # tuned SQLite pragmas
+    python benchmarks/write_bench.py --no-pragmas   # library defaults
+    DATABASE_URL=postgresql://... python benchmarks/write_bench.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--writes', type=int, default=300, help='commits per thread')
+    parser.add_argument('--no-pragmas', action='store_true')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(scratch, "bench.db")}')
+
+    from Flask_proj import create_app, db
+    from Flask_proj.models import User, Post
+    from sqlalchemy.exc import OperationalError
+
+    app = create_app({'SQLITE_PRAGMAS': {}} if args.no_pragmas else None)
+    with app.app_context():
+        db.create_all()
+        user = User(first_name='Bench', last_name='User', email='bench@example.com')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    errors = []
+
+    def worker():
+        with app.app_context():
+            for i in range(args.writes):
+                try:
+                    db.session.add(Post(user_id=user_id, content=f'post {i}', privacy='Public'))
+                    db.session.commit()
+                except OperationalError as error:
+                    db.session.rollback()
+                    errors.append(error)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = args.threads * args.writes - len(errors)
+    print(f'{app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0]} pragmas={"off" if args.no_pragmas else "on"} '
+          f'threads={args.threads}: {total} commits in {elapsed:.2f}s = {total / elapsed:.0f} commits/s, '
+          f'{len(errors)} errors')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,25 @@
 import sys
 
-from Flask_proj import db, app
+from sqlalchemy import select
+from sqlalchemy.orm import undefer
+
+from Flask_proj import create_app, db, avatars, counters, feed, images, jobs, migrations, query_plans
 from Flask_proj.models import User, Friendship
 
+app = create_app()
+
 
 def create_db():
+    upgrade()
+
+def upgrade():
     with app.app_context():
-        db.create_all()
+        for version, description in migrations.upgrade():
+            print(f'Applied migration {version}: {description}')
+
+def schema_version():
+    with app.app_context(), db.engine.connect() as connection:
+        print(migrations.current_version(connection))
 
 def drop_db():
     with app.app_context():
@@ -27,6 +40,61 @@ def create_friendships():
         db.session.commit()
 
 
+def rebuild_feed_inbox():
+    with app.app_context():
+        feed.SqlInbox().rebuild()
+
+
+def reconcile_counters():
+    """Repair drifted user counters; safe to run from cron while the site is up."""
+    with app.app_context():
+        print(f'Repaired counters on {counters.reconcile()} users')
+
+
+def run_jobs():
+    """Run every due background job here, e.g. from cron when no web process is up."""
+    with app.app_context():
+        print(f'Ran {jobs.drain()} jobs; {jobs.stats()}')
+
+
+def retry_dead_jobs():
+    with app.app_context():
+        print(f'Requeued {jobs.retry_dead()} dead jobs')
+
+
+def migrate_avatars():
+    """Move inline profile_image blobs into the avatar store and make their thumbnails."""
+    upgrade()
+    with app.app_context():
+        store = avatars.get_store()
+        user_ids = db.session.scalars(
+            select(User.id).where(User.avatar_hash.is_(None), User.profile_image.is_not(None))
+        ).all()
+        for start in range(0, len(user_ids), 100):
+            batch = User.query.options(undefer(User.profile_image)).filter(
+                User.id.in_(user_ids[start:start + 100]))
+            for user in batch:
+                if user.profile_image:
+                    user.avatar_hash = store.put(user.profile_image)
+                    images.schedule_variants(store.root, user.avatar_hash)
+                user.profile_image = None
+            db.session.commit()
+        print(f'Migrated {len(user_ids)} avatars to {store.root}')
+        # The pool finishes the queued thumbnails before the script exits
+
+
+def check_query_plans():
+    with app.app_context():
+        failures = query_plans.check()
+    for name, plan in failures.items():
+        print(f'Full table scan in {name}:')
+        for line in plan:
+            print(f'    {line}')
+    if failures:
+        sys.exit(1)
+    print('All hot queries use an index.')
+
+
 def get_user():
     with app.app_context():
         user = User.query.first()
@@ -0,0 +1,33 @@
+"""gunicorn settings: `gunicorn` from this directory serves app:app with them.
+
+The app is created once in the master (preload_app) and forked, so each
+worker starts in milliseconds and shares the imported code copy-on-write.
+create_app makes that safe: inherited database connections are dropped in
+the child, and job, chat-writer and process-pool workers start per process.
+Set SESSION_BACKEND=sqlite (or file) so a login made through one worker is
+seen by the others without relying on the signed cookie alone.
+
+Chat goes through the database, so a message sent to one worker reaches
+streams held by any other. An open chat page keeps a stream waiting,
+though: with gevent installed each one is a greenlet, otherwise it holds
+one of a worker's `threads` and a site with many chatters needs gevent
+(`pip install gevent`) or GUNICORN_THREADS raised to match.
+"""
+import importlib.util
+import multiprocessing
+import os
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or (
+    'gevent' if importlib.util.find_spec('gevent') else 'gthread')
+worker_connections = 1000  # gevent: open connections per worker
+threads = int(os.environ.get('GUNICORN_THREADS', 4))  # gthread: requests in flight per worker
+preload_app = True
+timeout = 60
+graceful_timeout = 30
+# Recycle workers now and then so slow leaks cannot grow without bound
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = '-'
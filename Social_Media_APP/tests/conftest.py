@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+
+import pytest
+
+from Flask_proj import create_app, db, migrations
+from Flask_proj.models import Friendship, User
+
+
+def app_config(database, **overrides):
+    return {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}',
+        'SECRET_KEY': 'test',
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'BCRYPT_LOG_ROUNDS': 4,
+        'PASSWORD_WORKERS': 0,
+        'JOB_WORKERS': 0,
+        **overrides,
+    }
+
+
+@contextmanager
+def app_context(app):
+    with app.app_context():
+        try:
+            yield app
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def database(tmp_path):
+    return tmp_path / 'site.db'
+
+
+@pytest.fixture
+def app(database):
+    with app_context(create_app(app_config(database))) as app:
+        yield app
+
+
+@pytest.fixture
+def migrated(app):
+    migrations.upgrade()
+    return app
+
+
+@pytest.fixture
+def second_worker(database):
+    """`with second_worker(**config):` runs its block in another app on the same database,
+    the way a request handled by another worker process would."""
+    return lambda **config: app_context(create_app(app_config(database, **config)))
+
+
+@pytest.fixture
+def add_users(migrated):
+    """add_users('Ann', 'Bob') commits one user per first name, emails derived from it, and returns them."""
+    def add(*first_names, **fields):
+        users = [User(**{'last_name': 'X', 'email': f'{name.lower()}@example.com', 'password': 'x', **fields},
+                      first_name=name)
+                 for name in first_names]
+        db.session.add_all(users)
+        db.session.commit()
+        return users
+    return add
+
+
+@pytest.fixture
+def befriend(migrated):
+    def befriend(user, *friends):
+        for friend in friends:
+            db.session.add_all([Friendship(user_id=user.id, friend_id=friend.id, status='friends'),
+                                Friendship(user_id=friend.id, friend_id=user.id, status='friends')])
+        db.session.commit()
+    return befriend
+
+
+@pytest.fixture
+def login(migrated):
+    """login(user) returns a test client whose session is signed in as user."""
+    def login(user):
+        client = migrated.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+    return login
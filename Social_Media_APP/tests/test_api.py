@@ -0,0 +1,45 @@
+import pytest
+
+from Flask_proj import actions
+
+
+@pytest.fixture
+def ann_bob_cat(add_users, befriend):
+    """Bob is Ann's friend, Cat is not; Ann has one post of each privacy."""
+    ann, bob, cat = add_users('Ann', 'Bob', 'Cat')
+    befriend(ann, bob)
+    for privacy in ('Public', 'Friends', 'Only Me'):
+        actions.create_post(ann.id, f'{privacy} post', privacy)
+    return ann, bob, cat
+
+
+def test_api_needs_a_session(migrated, ann_bob_cat):
+    ann, _, _ = ann_bob_cat
+    response = migrated.test_client().get(f'/api/v1/users/{ann.id}/posts')
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Log in first.'}
+
+
+@pytest.mark.parametrize('viewer, expected', [
+    ('ann', ['Only Me post', 'Friends post', 'Public post']),
+    ('bob', ['Friends post', 'Public post']),
+    ('cat', ['Public post']),
+])
+def test_profile_posts_are_the_same_in_the_api_and_the_page(ann_bob_cat, login, viewer, expected):
+    ann, bob, cat = ann_bob_cat
+    client = login({'ann': ann, 'bob': bob, 'cat': cat}[viewer])
+    for url in (f'/api/v1/users/{ann.id}', f'/api/v1/users/{ann.id}/posts'):
+        assert [post['content'] for post in client.get(url).get_json()['posts']] == expected
+    page = client.get(f'/profile/{ann.id}').get_data(as_text=True)
+    assert [privacy for privacy in ('Public', 'Friends', 'Only Me') if f'{privacy} post' in page] == \
+        [content.replace(' post', '') for content in reversed(expected)]
+
+
+def test_batch_users_keeps_the_order_asked_for(ann_bob_cat, login):
+    ann, bob, cat = ann_bob_cat
+    client = login(ann)
+    response = client.get(f'/api/v1/users?ids={cat.id},{ann.id},999,{cat.id}')
+    assert [user['first_name'] for user in response.get_json()['users']] == ['Cat', 'Ann']
+    assert client.get('/api/v1/users?ids=1,x').status_code == 400
+    too_many = ','.join(str(user_id) for user_id in range(1, 102))
+    assert client.get(f'/api/v1/users?ids={too_many}').status_code == 400
@@ -0,0 +1,28 @@
+import os
+
+from Flask_proj import create_app, fragments, ratelimit
+
+
+def test_state_is_configured_per_app(app, tmp_path):
+    other = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "other.db"}', 'SECRET_KEY': 'test',
+                        'RATE_LIMITS': {'login_ip': (1, 60), 'login_email': (1, 60)},
+                        'FRAGMENT_CACHE_SIZE': 7})
+    limiter = ratelimit.get_limiter('login_ip')
+    cache = fragments.get_backend()
+    with other.app_context():
+        assert ratelimit.get_limiter('login_ip').capacity == 1
+        assert fragments.get_backend() is not cache
+        assert fragments.get_backend().maxsize == 7
+    assert ratelimit.get_limiter('login_ip') is limiter
+    assert limiter.capacity == app.config['RATE_LIMITS']['login_ip'][0]
+
+
+def test_state_is_rebuilt_after_fork(app):
+    limiter = ratelimit.get_limiter('login_ip')
+    pid = os.fork()
+    if pid == 0:
+        # Exit status 0 only when the child got a limiter of its own
+        os._exit(0 if ratelimit.get_limiter('login_ip') is not limiter else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert ratelimit.get_limiter('login_ip') is limiter
@@ -0,0 +1,50 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from Flask_proj import avatars, db, images
+from Flask_proj.models import User
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 32
+
+
+def test_avatar_is_served_by_digest(migrated, tmp_path):
+    migrated.config['AVATAR_STORE'] = str(tmp_path / 'avatars')
+    digest = avatars.get_store().put(PNG)
+    user = User(first_name='Ann', last_name='Lee', email='ann@example.com', password='x', avatar_hash=digest)
+    db.session.add(user)
+    db.session.commit()
+
+    client = migrated.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    with migrated.test_request_context():
+        url = avatars.avatar_url(user)
+    assert url == f'/avatar/{digest}'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == PNG
+    assert client.get('/avatar/' + '0' * 64).status_code == 404
+
+
+def test_missing_variant_is_queued_again_on_request(migrated, tmp_path, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    migrated.config['AVATAR_STORE'] = str(tmp_path / 'avatars')
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 300), 'teal').save(buffer, 'PNG')
+    store = avatars.get_store()
+    # As if the job queued with the upload was lost with its process
+    digest = store.put(buffer.getvalue())
+    user = User(first_name='Ann', last_name='Lee', email='ann@example.com', password='x', avatar_hash=digest)
+    db.session.add(user)
+    db.session.commit()
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(images, 'get_pool', lambda: pool)
+
+    client = migrated.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    assert client.get(f'/avatar/{digest}?s=48').headers['ETag'] == f'"{digest}"'
+    pool.shutdown(wait=True)
+    assert client.get(f'/avatar/{digest}?s=48').headers['ETag'] == f'"{digest}-48"'
@@ -0,0 +1,82 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from Flask_proj import chat, db
+from Flask_proj.models import Chat, User
+
+
+def test_message_reaches_a_waiter_in_another_worker(migrated, second_worker):
+    ann = User(first_name='Ann', last_name='Lee', email='ann@example.com', password='x')
+    bob = User(first_name='Bob', last_name='Ray', email='bob@example.com', password='x')
+    db.session.add_all([ann, bob])
+    db.session.commit()
+    key = chat.conversation_key(ann.id, bob.id)
+    after = chat.last_id(key)
+
+    with second_worker():
+        chat.send_message(db.session.get(User, ann.id), bob.id, 'hello')
+        chat.get_writer().flush()
+
+    messages = chat.get_broker().wait(key, after, timeout=2)
+    assert [(message['sender_name'], message['message_content']) for _, message in messages] == \
+        [('Ann Lee', 'hello')]
+    assert chat.get_broker().wait(key, messages[-1][0], timeout=0) == []
+
+
+def test_one_poller_query_wakes_every_waiter(migrated, second_worker, add_users, monkeypatch):
+    ann, bob, cat = add_users('Ann', 'Bob', 'Cat')
+    keys = [chat.conversation_key(ann.id, bob.id), chat.conversation_key(ann.id, cat.id)]
+    broker = chat.Broker(migrated, poll_interval=0.05)
+    polled = []
+    poll = broker.poll
+    monkeypatch.setattr(broker, 'poll', lambda: polled.append(len(broker._watches)) or poll())
+    received = {}
+
+    def wait(key):
+        with migrated.app_context():
+            received[key] = broker.wait(key, 0, timeout=5)
+
+    waiters = [threading.Thread(target=wait, args=(key,)) for key in keys]
+    for waiter in waiters:
+        waiter.start()
+    while 2 not in polled:
+        time.sleep(0.01)
+
+    with second_worker():
+        for friend in (bob, cat):
+            chat.send_message(db.session.get(User, ann.id), friend.id, f'hi {friend.first_name}')
+        chat.get_writer().flush()
+
+    for waiter in waiters:
+        waiter.join(5)
+    assert [[message['message_content'] for _, message in received[key]] for key in keys] == \
+        [['hi Bob'], ['hi Cat']]
+
+
+def test_failed_batch_is_retried_then_dropped(migrated, monkeypatch, caplog):
+    writer = chat.ChatWriter(migrated, interval=3600, max_attempts=2)
+    insert = writer._insert
+
+    def fail(rows):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(writer, '_insert', fail)
+    writer.write(dict(user_id=1, friend_id=2, message_content='kept', sent_at=datetime.utcnow()))
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    monkeypatch.setattr(writer, '_insert', insert)
+    writer.flush()
+    assert [row.message_content for row in Chat.query] == ['kept']
+
+    monkeypatch.setattr(writer, '_insert', fail)
+    writer.write(dict(user_id=1, friend_id=2, message_content='lost', sent_at=datetime.utcnow()))
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            writer.flush()
+    assert 'Dropped 1 chat messages after 2 failed writes' in caplog.text
+    monkeypatch.setattr(writer, '_insert', insert)
+    writer.flush()
+    assert Chat.query.count() == 1
@@ -0,0 +1,36 @@
+import pytest
+
+from Flask_proj import db, directory
+from Flask_proj.models import User
+
+
+@pytest.fixture
+def people(migrated):
+    users = [User(first_name=first_name, last_name=last_name, email=email, password='x')
+             for first_name, last_name, email in [('Viewer', 'X', 'viewer@example.com'),
+                                                  ('Émile', 'Zola', 'EMILE@example.com'),
+                                                  ('Emma', 'Öztürk', 'emma@example.com')]]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def names(viewer, q):
+    return [user.first_name for user in directory.search_people(viewer.id, q)[0]]
+
+
+@pytest.mark.parametrize('fts', [False, True])
+def test_prefix_search_folds_non_ascii_case(migrated, people, fts):
+    migrated.config['DIRECTORY_FTS'] = fts
+    viewer = people[0]
+    assert names(viewer, 'ÉMI') == ['Émile']
+    assert names(viewer, 'öz') == ['Emma']
+
+
+def test_search_keys_follow_edits(people):
+    viewer, emile, _ = people
+    emile.first_name = 'Zoë'
+    db.session.commit()
+    assert names(viewer, 'zoË') == ['Zoë']
+    assert names(viewer, 'emile@') == ['Zoë']
+    assert names(viewer, 'émi') == []
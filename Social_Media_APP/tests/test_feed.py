@@ -0,0 +1,38 @@
+from Flask_proj import actions, db, feed
+from Flask_proj.models import Friendship, User
+
+
+def test_memory_inbox_sees_posts_made_through_another_worker(migrated, second_worker):
+    migrated.config['FEED_INBOX'] = 'memory'
+    ann = User(first_name='Ann', last_name='Lee', email='ann@example.com', password='x')
+    bob = User(first_name='Bob', last_name='Ray', email='bob@example.com', password='x')
+    db.session.add_all([ann, bob])
+    db.session.flush()
+    db.session.add_all([Friendship(user_id=ann.id, friend_id=bob.id), Friendship(user_id=bob.id, friend_id=ann.id)])
+    db.session.commit()
+    actions.create_post(bob.id, 'first', 'Friends')
+    assert [post.content for post in feed.friends_timeline(ann.id)[0]] == ['first']
+
+    with second_worker(FEED_INBOX='memory'):
+        actions.create_post(bob.id, 'second', 'Friends')
+
+    assert [post.content for post in feed.friends_timeline(ann.id)[0]] == ['second', 'first']
+
+
+def test_memory_inbox_applies_local_posts_without_rehydrating(migrated, add_users, befriend, monkeypatch):
+    migrated.config['FEED_INBOX'] = 'memory'
+    ann, bob, cat = add_users('Ann', 'Bob', 'Cat')
+    befriend(ann, bob, cat)
+    actions.create_post(bob.id, 'first', 'Friends')
+    assert [post.content for post in feed.friends_timeline(ann.id)[0]] == ['first']
+
+    inbox = feed.get_inbox()
+    hydrated = []
+    hydrate = inbox.hydrate
+    monkeypatch.setattr(inbox, 'hydrate', lambda owner_id: hydrated.append(owner_id) or hydrate(owner_id))
+    actions.create_post(cat.id, 'second', 'Friends')
+    post = actions.create_post(bob.id, 'third', 'Public')
+    actions.update_post(post, 'third', 'Only Me')
+    actions.create_post(ann.id, 'fourth', 'Friends')
+    assert [post.content for post in feed.friends_timeline(ann.id)[0]] == ['fourth', 'second', 'first']
+    assert hydrated == []
@@ -0,0 +1,17 @@
+from Flask_proj import actions, db, fragments
+from Flask_proj.models import User
+
+
+def test_edit_through_another_worker_reaches_the_cache(migrated, second_worker):
+    user = User(first_name='Ann', last_name='Lee', email='ann@example.com', password='x')
+    db.session.add(user)
+    db.session.commit()
+    assert 'Ann' in fragments.profile_details(user)
+
+    with second_worker():
+        edited = db.session.get(User, user.id)
+        edited.first_name = 'Annie'
+        actions.profile_updated(edited)
+
+    db.session.expire_all()
+    assert 'Annie' in fragments.profile_details(db.session.get(User, user.id))
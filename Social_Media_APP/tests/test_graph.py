@@ -0,0 +1,58 @@
+import time
+
+from Flask_proj import STATE_KEY, db, graph
+from Flask_proj.models import Friendship, FriendRequest, User
+
+
+def add_users(count):
+    users = [User(first_name=f'User{number}', last_name='X', email=f'user{number}@example.com', password='x')
+             for number in range(count)]
+    db.session.add_all(users)
+    db.session.flush()
+    return [user.id for user in users]
+
+
+def befriend(user_id, friend_id):
+    db.session.add_all([Friendship(user_id=user_id, friend_id=friend_id),
+                        Friendship(user_id=friend_id, friend_id=user_id)])
+
+
+def test_suggestions_leave_out_pending_requests(migrated):
+    ann, bob, cat, dan, eve = add_users(5)
+    for other in (cat, dan, eve):
+        befriend(bob, other)
+    befriend(ann, bob)
+    db.session.add_all([FriendRequest(user_id=cat, friend_id=ann, status='pending'),
+                        FriendRequest(user_id=ann, friend_id=dan, status='pending')])
+    db.session.commit()
+    assert graph.suggestions(ann) == [(eve, 1)]
+
+
+def test_expired_graph_is_rebuilt_in_the_background(migrated):
+    migrated.config['GRAPH_TTL'] = 0
+    ann, bob, cat = add_users(3)
+    befriend(ann, bob)
+    db.session.commit()
+    old = graph.get_graph()
+    befriend(ann, cat)
+    db.session.commit()
+
+    time.sleep(0.01)
+    assert graph.get_graph() is old
+    state = migrated.extensions[STATE_KEY]
+    deadline = time.monotonic() + 5
+    while state['graph'] is old and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert list(state['graph'].friends(ann)) == [bob, cat]
+
+
+def test_edits_during_a_rebuild_are_replayed(migrated):
+    ann, bob = add_users(2)
+    db.session.commit()
+    state = migrated.extensions[STATE_KEY]
+    state['graph'] = graph.FriendGraph()
+    state['graph.edits'] = []
+    graph.add_friendship(ann, bob)
+    graph._rebuild(migrated, state)
+    assert list(state['graph'].friends(bob)) == [ann]
+    assert 'graph.edits' not in state
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from Flask_proj import images
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def noise(size):
+    return Image.frombytes('RGB', (size, size), os.urandom(size * size * 3))
+
+
+def test_variant_is_shrunk_until_it_fits():
+    # Random pixels do not compress, so the lowest quality alone is not enough
+    data = images._encode(noise(200), 4 * 1024)
+    assert len(data) <= 4 * 1024
+
+
+def test_variant_that_cannot_fit_is_rejected():
+    with pytest.raises(ValueError):
+        images._encode(noise(200), 10)
@@ -0,0 +1,67 @@
+import pytest
+
+from Flask_proj import db, jobs
+from Flask_proj.models import Job
+
+
+@pytest.fixture
+def handled(migrated, monkeypatch):
+    """Payloads seen by the 'test' job handler, which raises for payloads with fail set."""
+    seen = []
+
+    def handler(payloads):
+        seen.append(payloads)
+        if any(payload.get('fail') for payload in payloads):
+            raise RuntimeError('handler failed')
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test', handler)
+    migrated.config.update(JOB_RETRY_DELAY=0, JOB_MAX_ATTEMPTS=2)
+    return seen
+
+
+def enqueue(*payloads, key=None):
+    for payload in payloads:
+        jobs.enqueue('test', payload, key=key)
+    db.session.commit()
+
+
+def test_jobs_with_a_key_are_coalesced_while_queued(handled):
+    enqueue({'n': 1}, {'n': 2}, key='same')
+    enqueue({'n': 3}, key='other')
+    assert jobs.drain() == 2
+    assert handled == [[{'n': 1}, {'n': 3}]]
+    assert Job.query.count() == 0
+
+
+def test_failing_job_is_retried_alone_then_kept_dead(handled):
+    enqueue({'n': 1}, {'fail': True})
+    assert jobs.run_pending() == 2
+    # The batch, then each job on its own so the good one goes through
+    assert handled == [[{'n': 1}, {'fail': True}], [{'n': 1}], [{'fail': True}]]
+    job, = Job.query.all()
+    assert (job.status, job.attempts) == ('running', 1)
+    assert 'handler failed' in job.last_error
+
+    assert jobs.run_pending() == 1
+    db.session.expire_all()
+    assert (job.status, job.attempts) == ('dead', 2)
+    assert jobs.run_pending() == 0
+
+    assert jobs.retry_dead() == 1
+    assert jobs.run_pending() == 1
+    db.session.expire_all()
+    assert (job.status, job.attempts) == ('running', 1)
+
+
+def test_expired_lease_is_claimed_again(handled):
+    enqueue({'n': 1})
+    # A worker that claimed the job and died before running it
+    assert len(jobs.claim(10)) == 1
+    assert jobs.run_pending() == 0
+
+    job = Job.query.one()
+    job.run_after = job.created_at
+    db.session.commit()
+    assert jobs.run_pending() == 1
+    assert handled == [[{'n': 1}]]
+    assert Job.query.count() == 0
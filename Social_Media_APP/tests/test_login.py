@@ -0,0 +1,31 @@
+from Flask_proj import bcrypt, db
+from Flask_proj.models import User
+
+
+def sign_in(client, password, address='203.0.113.1'):
+    # As the reverse proxy in front of gunicorn forwards it
+    return client.post('/login', data={'email': 'ann@example.com', 'password': password},
+                       headers={'X-Forwarded-For': address})
+
+
+def test_failed_sign_ins_are_limited_per_email_and_address(migrated, add_users):
+    migrated.config['RATE_LIMITS'] = {'login_ip': (100, 60), 'login_email': (2, 300)}
+    add_users('Ann', password=bcrypt.generate_password_hash('right password', 4).decode())
+    client = migrated.test_client()
+    for _ in range(2):
+        assert sign_in(client, 'wrong password').status_code == 200
+
+    response = sign_in(client, 'wrong password')
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 150
+    # Ann, signing in from her own address, is not locked out by someone else's failures
+    assert sign_in(migrated.test_client(), 'right password', '198.51.100.7').status_code == 302
+
+
+def test_sign_in_rehashes_with_the_configured_work_factor(migrated, add_users):
+    user, = add_users('Ann', password=bcrypt.generate_password_hash('right password', 5).decode())
+    assert sign_in(migrated.test_client(), 'right password').status_code == 302
+    db.session.expire_all()
+    password = db.session.get(User, user.id).password
+    assert password.startswith('$2b$04$')
+    assert bcrypt.check_password_hash(password, 'right password')
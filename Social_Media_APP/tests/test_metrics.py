@@ -0,0 +1,13 @@
+def test_metrics_need_a_token_or_an_allowed_address(migrated, second_worker):
+    with second_worker(METRICS=True) as app:
+        assert app.test_client().get('/_metrics').status_code == 404
+
+    with second_worker(METRICS=True, METRICS_TOKEN='s3cret', METRICS_ALLOWED_IPS=('10.0.0.5',)) as app:
+        client = app.test_client()
+        assert client.get('/_metrics').status_code == 404
+        assert client.get('/_metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 404
+        assert client.get('/_metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+        # Behind the proxy, its own address is not the scraper's
+        assert client.get('/_metrics', headers={'X-Forwarded-For': '10.0.0.5'}).status_code == 200
+        assert client.get('/_metrics', environ_base={'REMOTE_ADDR': '10.0.0.5'},
+                          headers={'X-Forwarded-For': '198.51.100.7'}).status_code == 404
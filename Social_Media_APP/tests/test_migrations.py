@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import pytest
+from sqlalchemy import inspect
+
+from Flask_proj import db, migrations
+
+SHIPPED_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'site.db')
+
+
+@pytest.fixture(params=['empty', 'shipped'])
+def database(request, tmp_path):
+    path = tmp_path / 'site.db'
+    if request.param == 'shipped':
+        if not os.path.exists(SHIPPED_DATABASE):
+            pytest.skip('no instance/site.db')
+        shutil.copy(SHIPPED_DATABASE, path)
+    return path
+
+
+def test_upgrade_reaches_the_model_schema(app):
+    applied = migrations.upgrade()
+    assert [number for number, _ in applied] == [number for number, _, _ in migrations.MIGRATIONS]
+
+    with db.engine.connect() as connection:
+        inspector = inspect(connection)
+        indexes = set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars())
+        for table in db.metadata.sorted_tables:
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            assert {column.name for column in table.columns} <= columns, table.name
+            assert {index.name for index in table.indexes} <= indexes, table.name
+
+
+def test_upgrade_is_idempotent(migrated):
+    assert migrations.upgrade() == []
+    with db.engine.connect() as connection:
+        assert migrations.current_version(connection) == migrations.MIGRATIONS[-1][0]
+
+
+@pytest.mark.parametrize('database', ['empty'], indirect=True)
+def test_duplicates_and_counters_are_fixed_by_their_migrations(app):
+    migrations.upgrade(target=3)
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, first_name, email) VALUES (1, 'Ann', 'ann@example.com'), (2, 'Bob', 'bob@example.com')")
+        connection.exec_driver_sql(
+            "INSERT INTO friendship (user_id, friend_id, status) VALUES (1, 2, 'friends'), (1, 2, 'friends')")
+        connection.exec_driver_sql(
+            "INSERT INTO friend_request (user_id, friend_id, status, created_at) "
+            "VALUES (1, 2, 'pending', '2024-01-01'), (1, 2, 'pending', '2024-01-02')")
+        connection.exec_driver_sql(
+            "INSERT INTO post (user_id, content, privacy, created_at) VALUES (1, 'hi', 'Public', '2024-01-01')")
+    migrations.upgrade()
+
+    with db.engine.connect() as connection:
+        counts = connection.exec_driver_sql(
+            'SELECT id, friend_count, post_count, pending_request_count FROM user ORDER BY id').all()
+        updated_at = connection.exec_driver_sql('SELECT updated_at FROM post').scalar()
+    assert [tuple(row) for row in counts] == [(1, 1, 1, 0), (2, 0, 0, 1)]
+    assert updated_at is not None
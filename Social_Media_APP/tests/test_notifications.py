@@ -0,0 +1,47 @@
+from flask import g
+from sqlalchemy import event, select
+
+from Flask_proj import actions, db
+from Flask_proj.models import FriendRequest, Notification, User
+
+
+def notifications_page(client):
+    # The fixture's app context outlives each request: start from an empty session and no loaded user
+    db.session.close()
+    g.pop('_login_user', None)
+    return client.get('/notifications').get_data(as_text=True)
+
+
+def test_request_badge_comes_from_the_user_cache(migrated, add_users, login):
+    ann_id, bob_id = [user.id for user in add_users('Ann', 'Bob')]
+    actions.send_friend_request(bob_id, ann_id)
+    client = login(db.session.get(User, ann_id))
+    notifications_page(client)
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        page = notifications_page(client)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert '<span class="nav-badge">1</span>' in page
+    assert not [statement for statement in statements if 'pending_request_count' in statement]
+
+    # The counters job drops the cached record
+    actions.drop_friend_requests(FriendRequest.query.filter_by(friend_id=ann_id).all())
+    assert 'nav-badge' not in notifications_page(client)
+
+
+def test_only_the_notifications_shown_are_marked_read(migrated, add_users, login):
+    ann_id, bob_id, cat_id = [user.id for user in add_users('Ann', 'Bob', 'Cat')]
+    actions.send_friend_request(bob_id, ann_id)
+    client = login(db.session.get(User, ann_id))
+    assert 'name="notification_id"' in notifications_page(client)
+    shown = db.session.scalars(select(Notification.notification_id)).all()
+
+    # The GET changed nothing, and a notification that arrives after it stays unread
+    actions.send_friend_request(cat_id, ann_id)
+    client.post('/notifications/read', data={'notification_id': shown})
+    unread = db.session.scalars(select(Notification.actor_id).where(Notification.read_at.is_(None))).all()
+    assert unread == [cat_id]
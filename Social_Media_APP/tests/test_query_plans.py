@@ -0,0 +1,13 @@
+from sqlalchemy import select
+
+from Flask_proj import query_plans
+from Flask_proj.models import Post
+
+
+def test_hot_queries_use_an_index(migrated):
+    assert query_plans.check() == {}
+
+
+def test_full_scan_is_reported(migrated):
+    failures = query_plans.check({'by content': select(Post.post_id).where(Post.content == 'x')})
+    assert list(failures) == ['by content']
@@ -0,0 +1,48 @@
+import pytest
+
+from Flask_proj import actions, search
+
+
+@pytest.fixture(params=['fts', 'memory'])
+def backend(request, migrated):
+    migrated.config['POST_SEARCH'] = request.param
+    return request.param
+
+
+def contents(posts):
+    return [post.content for post in posts]
+
+
+def test_results_are_ranked_and_paged(backend, add_users):
+    ann, = add_users('Ann')
+    for content in ('coffee with friends after the long trip home', 'coffee coffee', 'tea only',
+                    'a trip for coffee'):
+        actions.create_post(ann.id, content, 'Public')
+
+    posts, next_cursor = search.search_posts(ann.id, 'coffee')
+    assert contents(posts) == ['coffee coffee', 'a trip for coffee', 'coffee with friends after the long trip home']
+    assert next_cursor is None
+    assert contents(search.search_posts(ann.id, 'Trip COFFEE')[0]) == \
+        ['a trip for coffee', 'coffee with friends after the long trip home']
+
+    pages, after = [], None
+    while True:
+        posts, after = search.search_posts(ann.id, 'coffee', search.decode_cursor(after), limit=1)
+        pages.append(contents(posts))
+        if not after:
+            break
+    assert pages == [['coffee coffee'], ['a trip for coffee'], ['coffee with friends after the long trip home']]
+
+
+def test_results_follow_the_privacy_rules(backend, add_users, befriend):
+    ann, bob, cat = add_users('Ann', 'Bob', 'Cat')
+    befriend(ann, bob)
+    for author in (ann, bob, cat):
+        for privacy in ('Public', 'Friends', 'Only Me'):
+            actions.create_post(author.id, f'news from {author.first_name} {privacy}', privacy)
+    gone = actions.create_post(cat.id, 'news that was deleted', 'Public')
+    actions.delete_post(gone)
+
+    found = sorted(contents(search.search_posts(ann.id, 'news', limit=20)[0]))
+    assert found == ['news from Ann Friends', 'news from Ann Only Me', 'news from Ann Public',
+                     'news from Bob Friends', 'news from Bob Public', 'news from Cat Public']
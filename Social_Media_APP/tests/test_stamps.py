@@ -0,0 +1,49 @@
+from Flask_proj import actions, db
+from Flask_proj.models import User, VersionStamp
+
+
+def stamp_rows():
+    return dict(db.session.query(VersionStamp.name, VersionStamp.version))
+
+
+def test_home_is_not_modified_until_a_friend_posts(add_users, befriend, login):
+    ann, bob = add_users('Ann', 'Bob')
+    befriend(ann, bob)
+    client = login(ann)
+    first = client.get('/home')
+    assert first.status_code == 200 and first.headers['ETag'].startswith('W/')
+    etag = first.headers['ETag']
+    assert client.get('/home', headers={'If-None-Match': etag}).status_code == 304
+
+    actions.create_post(bob.id, 'news', 'Friends')
+    changed = client.get('/home', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and b'news' in changed.data
+    assert changed.headers['ETag'] != etag
+
+
+def test_friend_rename_changes_the_etag_without_per_friend_writes(add_users, befriend, login):
+    ann, bob, *others = add_users('Ann', 'Bob', 'Cat', 'Dan', 'Eve')
+    befriend(bob, ann, *others)
+    client = login(ann)
+    etag = client.get('/home?privacy_mode=friends').headers['ETag']
+    profile_etag = client.get(f'/profile/{ann.id}').headers['ETag']
+    before = stamp_rows()
+
+    bob = db.session.get(User, bob.id)
+    bob.first_name = 'Robert'
+    actions.profile_updated(bob)
+
+    changed = {name for name, version in stamp_rows().items() if before.get(name) != version}
+    assert changed == {f'user:{bob.id}', f'profile:{bob.id}'}
+    assert client.get('/home?privacy_mode=friends', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get(f'/profile/{ann.id}', headers={'If-None-Match': profile_etag}).status_code == 200
+
+
+def test_public_post_is_one_write_for_a_hub_author(add_users, befriend):
+    hub, *fans = add_users('Hub', *[f'Fan{number}' for number in range(20)])
+    befriend(hub, *fans)
+    before = stamp_rows()
+    actions.create_post(hub.id, 'hello', 'Public')
+    changed = {name for name, version in stamp_rows().items() if before.get(name) != version}
+    # user:U is the author's own counters, bumped by the counters job
+    assert changed == {'public', f'posts:{hub.id}', f'user:{hub.id}'}